@@ -0,0 +1,42 @@
+import os
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+# Writes a file under a temporary name in the same folder and renames it over the target, which is atomic,
+# so readers (and a restart after a crash) only ever see the old or the new file, never a half written one.
+# Every write gets a temporary name of its own, so threads or processes writing the same file at once do not
+# write into each other's temporary file; the last rename wins.
+
+# NamedTemporaryFile creates files only the owner can read, the file gets the usual permissions instead
+# (e.g. the metrics textfile is read by node_exporter, which may run as another user)
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+@contextmanager
+def atomic_write(path, mode='w', fsync=False):
+    """
+    Opens a temporary file for writing, which replaces path once the with block completes.
+    If the block raises, the temporary file is removed and path is left unchanged.
+
+    :param path: The file to write, its folder must exist.
+    :param mode: 'w' for text or 'wb' for bytes.
+    :param fsync: Flush the file to disk before it replaces path, for files that must survive a power loss.
+    """
+    path = Path(path)
+    temp_file = tempfile.NamedTemporaryFile(mode, dir=path.parent, prefix=f".{path.name}.", suffix='.tmp', delete=False)
+    try:
+        with temp_file as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(temp_file.name, FILE_MODE)
+        os.replace(temp_file.name, path)
+    except BaseException:
+        try:
+            os.remove(temp_file.name)
+        except OSError:
+            pass
+        raise
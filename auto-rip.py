@@ -1,23 +1,91 @@
 import copy
 import os
+import glob
+import time
+import argparse
+import contextlib
+import shutil
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 import ctypes
 from pathlib import Path
 from dotenv import load_dotenv
-from get_media_info import tmdb_movie_info, store_media_info, tmdb_tv_info
-import re
+from get_media_info import tmdb_movie_info, store_media_info, tmdb_tv_info, fetch_tv_seasons, TMDB_MAX_CONCURRENCY
+from drive_watcher import disc_present, watch_drive
+from drive_scheduler import discover_drives, run_drive_workers, bind_drive, drive_watch_path
+from job_queue import JobQueue
+from makemkv_info import parse_robot_output, match_titles, DiscInfo
+from scan_cache import ScanCache
+from progress import run_with_progress, MakeMKVProgress, HandBrakeProgress
+from segmented_encode import segmented_encode
+from encode_cluster import start_coordinator, submit_and_wait, handbrake_command, HANDBRAKE_CLI, HANDBRAKE_PRESET, COORDINATOR_HOST
+from batch import load_manifest, scan_backlog, DiscManifest
+from job_journal import JobJournal, verify_output, remove_output
+from progress import path_size
+from disc_index import DiscIndex, disc_fingerprint, read_volume_name
+from media_store import MediaStore, media_kind
+from metrics import Run, active_run, bind_run, timed, timed_stage, record_disc, start_metrics_server
+from resources import configure as configure_resources
+from storage import AdmissionController, IsoRetention, InsufficientSpace, estimate_title_bytes, disc_size, DISC_SIZE_ESTIMATE, ADMISSION_RETRY_SECONDS, ISO_RETENTION_MAX_BYTES
 
 load_dotenv()
 
 # Handbrake CLI, can be found at this link https://handbrake.fr/downloads2.php
 
-def eject_dvd():
+# Limits how many encoder processes run at once across every disc being encoded.
+# HandBrake is CPU bound, so MAX_HANDBRAKE_JOBS should be about the number of cores divided by the cores one encode can use.
+# MakeMKV extractions are disk bound, so only a small number of them should read at the same time
+HANDBRAKE_SLOTS = threading.BoundedSemaphore(int(os.getenv('MAX_HANDBRAKE_JOBS', 2)))
+MAKEMKV_SLOTS = threading.BoundedSemaphore(int(os.getenv('MAX_MAKEMKV_JOBS', 1)))
+# Each HandBrake slot gets its own share of the encode cores (see resources.py)
+configure_resources(encode_slots=int(os.getenv('MAX_HANDBRAKE_JOBS', 2)))
+
+SCAN_CACHE = ScanCache()
+
+# Discs that have been ripped before are recognised by their fingerprint and ripped without asking anything
+DISC_INDEX = DiscIndex()
+
+# Space is reserved for the outputs of a disc before it is backed up, extracted or encoded (see storage.py),
+# its retention deletes old images when ISO_RETENTION_MAX_BYTES is set
+ADMISSION = AdmissionController()
+
+# 'iso' encodes the MP4 from the image while the MKV is extracted from it at the same time, 'mkv' extracts the MKV
+# first and encodes the MP4 from it, which reads the image once (see benchmarks/bench_fanout.py)
+ENCODE_SOURCE = os.getenv('ENCODE_SOURCE', 'iso')
+
+# Splits each title into this many chapter ranges that are encoded in parallel, 0 or 1 encodes every title in one piece.
+# Setting it to MAX_HANDBRAKE_JOBS lets a single movie use all of the HandBrake slots
+ENCODE_SEGMENTS = int(os.getenv('ENCODE_SEGMENTS', 0))
+
+# With ENCODE_COORDINATOR set (e.g. 'http://localhost:8750') encodes are sent to the workers of an encode_cluster.py
+# coordinator instead of running here, COORDINATOR_PORT starts the coordinator in this process (on COORDINATOR_HOST).
+# Both need COORDINATOR_TOKEN. Encodes fall back to running here if the coordinator cannot be reached
+COORDINATOR_PORT = os.getenv('COORDINATOR_PORT')
+_COORDINATOR_ADDRESS = COORDINATOR_HOST if COORDINATOR_HOST not in ('0.0.0.0', '::', '') else '127.0.0.1'
+ENCODE_COORDINATOR = os.getenv('ENCODE_COORDINATOR') or (f"http://{_COORDINATOR_ADDRESS}:{COORDINATOR_PORT}" if COORDINATOR_PORT else None)
+
+def eject_dvd(device=None):
+    """
+    Ejects the disc.
+
+    :param device: The drive to eject, e.g. 'E:' or '/dev/sr0'. Defaults to the first drive.
+    """
     print('Ejecting DVD!')
     try:
-        ctypes.windll.WINMM.mciSendStringW(u"set cdaudio door open",None,0,None)
+        if device:
+            alias = f"drive{device.strip(':').lower()}"
+            ctypes.windll.WINMM.mciSendStringW(f"open {device} type cdaudio alias {alias}",None,0,None)
+            ctypes.windll.WINMM.mciSendStringW(f"set {alias} door open",None,0,None)
+            ctypes.windll.WINMM.mciSendStringW(f"close {alias}",None,0,None)
+        else:
+            ctypes.windll.WINMM.mciSendStringW(u"set cdaudio door open",None,0,None)
     except:
-        os.system("eject cdrom")
+        try:
+            subprocess.run(["eject", device or "cdrom"])
+        except OSError as e:
+            # e.g. macOS and minimal Linux images have no eject command, the disc has to be taken out by hand
+            print(f"Error: could not eject the disc: {e}")
 
 def dvd_detected(drive_path):
     """
@@ -26,55 +94,35 @@ def dvd_detected(drive_path):
     :param drive_path: The path to the disc drive
     :return: True if a DVD is detected, False otherwise.
     """
-    return os.path.exists(drive_path) and os.path.isdir(drive_path)
-
-def get_title_id(makemkv_info, expected_runtime, runtime_threshold=10, previous_title_ids=[]):
-    print(f"Looking for runtime: {expected_runtime} minutes")
-    
-    for line in makemkv_info.splitlines():
-        processed_line = line.split(',')
-        info_title = processed_line[0].split(':')
-        info_type = info_title[0]
-        runtime = -1
-        highest_runtime = -1
-        if 'TINFO' in info_type:
-            title_id = int(info_title[1])
-            info = processed_line[-1].strip('"')
-
-            # Checks if the info is a runtime in the format HH:MM
-            if re.match(r'^\d{1,2}:\d{2}(:\d{2})?$', info):
-                time_parts = info.split(':')
-                if len(time_parts) == 3:
-                    hours = int(time_parts[0])
-                    minutes = int(time_parts[1])
-                    runtime = (hours * 60) + minutes
-                elif len(time_parts) == 2:
-                    runtime = int(time_parts[0])
-            if runtime >= (expected_runtime-runtime_threshold) and runtime <= (expected_runtime+runtime_threshold) and title_id not in previous_title_ids:
-                print(f"Found matching runtime title: {title_id}, runtime: {runtime} minutes")
-                return title_id
-            elif runtime > highest_runtime:
-                highest_runtime = runtime
-                backup_title_id = title_id
-    if highest_runtime > 0:
-        print(f"No exact match found, using highest runtime title: {backup_title_id}, runtime: {highest_runtime} minutes")
-        return backup_title_id
-    print("No matching title found.")
-    return -1
+    return disc_present(drive_path)
+
+def makemkv_source(source):
+    """
+    Returns the MakeMKV source for an image path, or the source unchanged if it is already a drive (e.g. 'disc:0').
+    """
+    if str(source).startswith('disc:'):
+        return str(source)
+    return f"file:{source}"
 
 def convert_to_mkv_makemkv(output_dir, title_id, iso_filename, makemkv_cli_path=os.getenv('MAKEMKV', "C:\\Program Files (x86)\\MakeMKV\\makemkvcon")):
     mkv_command = [
         makemkv_cli_path,
         'mkv',
-        f"file:{iso_filename}",
+        makemkv_source(iso_filename),
         f"{title_id}",
         output_dir,
-        '--noscan'
+        '--noscan',
+        '--robot',
+        '--progress=-same'
     ]
 
+    # Extractions straight from a drive only read that drive, so they do not share the slots for reading images
+    slots = contextlib.nullcontext() if str(iso_filename).startswith('disc:') else MAKEMKV_SLOTS
+
     try:
-        print(f"Starting MakeMKV decryption for disc:0...")
-        subprocess.run(mkv_command, check=True)
+        with slots, timed_stage('convert_to_mkv_makemkv', subject=f"title {title_id}", output_path=output_dir):
+            print(f"Starting MakeMKV extraction of title {title_id} from {iso_filename}...")
+            run_with_progress(mkv_command, f"Extract title {title_id} of {Path(iso_filename).name}", MakeMKVProgress(), output_path=output_dir)
         print(f"Decryption completed. Output saved to {output_dir}.")
     except FileNotFoundError:
         print("Error: MakeMKV not found. Please check the path to MakeMKV.")
@@ -85,13 +133,14 @@ def get_title_info(iso_filename, makemkv_cli_path=os.getenv('MAKEMKV', "C:\\Prog
     info_command = [
         makemkv_cli_path,
         'info',
-        f"file:{iso_filename}",
+        makemkv_source(iso_filename),
         '--robot'
     ]
 
     try:
         print(f"Starting retrieving disc information using MakeMKV...")
-        disc_info = subprocess.run(info_command, check=True, text=True, capture_output=True)
+        with timed_stage('get_title_info', subject=iso_filename):
+            disc_info = subprocess.run(info_command, check=True, text=True, capture_output=True)
         print(f"Decryption completed. Output saved to {'output_file'}.")
         return disc_info.stdout
     except FileNotFoundError:
@@ -99,132 +148,240 @@ def get_title_info(iso_filename, makemkv_cli_path=os.getenv('MAKEMKV', "C:\\Prog
     except subprocess.CalledProcessError as e:
         print(f"Error: MakeMKV failed with error code {e.returncode}.")
 
-def start_makemkv_decryption(output_dir, makemkv_cli_path=os.getenv('MAKEMKV', "C:\\Program Files (x86)\\MakeMKV\\makemkvcon")):
+def start_makemkv_decryption(output_dir, disc_index=0, makemkv_cli_path=os.getenv('MAKEMKV', "C:\\Program Files (x86)\\MakeMKV\\makemkvcon")):
     rip_command = [
         makemkv_cli_path,
         'backup',
-        'disc:0', # is whatever is in the disc drive (may need to change index, if multiple drive). Possible solution is to use the 'file:<>' option and point to 'E:'
+        f"disc:{disc_index}", # The drive index, as listed by drive_scheduler.discover_drives
         output_dir,
         '--noscan',
-        '--decrypt'
+        '--decrypt',
+        '--robot',
+        '--progress=-same'
     ]
 
     try:
-        print(f"Starting MakeMKV decryption for disc:0...")
-        subprocess.run(rip_command, check=True)
+        print(f"Starting MakeMKV decryption for disc:{disc_index}...")
+        with timed_stage('start_makemkv_decryption', subject=f"disc:{disc_index}", output_path=output_dir):
+            run_with_progress(rip_command, f"Backup disc:{disc_index} to {Path(output_dir).name}", MakeMKVProgress(), output_path=output_dir)
         print(f"Decryption completed. Output saved to {'output_file'}.")
+        return True
     except FileNotFoundError:
         print("Error: MakeMKV not found. Please check the path to MakeMKV.")
     except subprocess.CalledProcessError as e:
         print(f"Error: MakeMKV failed with error code {e.returncode}.")
+    return False
 
-def convert_to_mp4_handbrake(input_file, output_file, title_id=None, handbrake_cli_path=os.getenv('HANDBRAKE', "C:\\Program Files\\HandBrake\\HandBrakeCLI.exe"), file_format="mp4"):
+def convert_to_mp4_handbrake(input_file, output_file, title_id=None, handbrake_cli_path=HANDBRAKE_CLI, file_format="mp4", chapters=None):
     """
     Automatically starts HandBrake encoding with the preset 'Fast 1080p30'.
 
     :param input_file: Path to the input video file.
     :param output_file: Path to the output encoded video file.
+    :param chapters: Optional (first, last) tuple, to only encode a range of chapters.
     """
 
-    # HandBrakeCLI command with the 'Fast 1080p30' preset
-    # The preset does not upscale, this is an upper limit of quality
-    command = [
-        handbrake_cli_path,
-        "-i", input_file,
-        "-o", output_file,
-        # "-f", f"av_{file_format}",
-        "--preset", "Fast 1080p30"
-    ]
-
-    if title_id:
-        command.extend(["--title", str(title_id+1)])
+    # HandBrakeCLI command with the 'Fast 1080p30' preset, the workers of an encode cluster build the same one
+    command = handbrake_command(input_file, output_file, title_id, chapters, HANDBRAKE_PRESET, handbrake_cli_path)
+
+    if ENCODE_COORDINATOR:
+        # The workers limit how many encodes run at once, so HANDBRAKE_SLOTS is not used
+        print(f"Sending {input_file} to the encode workers...")
+        try:
+            with timed_stage('convert_to_mp4_handbrake', subject=Path(output_file).name, output_path=output_file) as timer:
+                job = submit_and_wait(ENCODE_COORDINATOR, {
+                    'input': str(input_file),
+                    'output': str(output_file),
+                    'preset': HANDBRAKE_PRESET,
+                    'title_id': title_id,
+                    'chapters': chapters
+                })
+                if job['state'] != 'done':
+                    timer.fail()
+            if job['state'] == 'done':
+                print(f"Encoding completed by {job['worker']}. Output saved to {output_file}.")
+            else:
+                print(f"Error: encoding {output_file} failed: {job['error']}.")
+            return
+        except OSError as e:
+            # e.g. urllib.error.URLError when the coordinator is down, the title is encoded here instead
+            print(f"Error: the encode coordinator could not be used ({e}), encoding {Path(output_file).name} here.")
 
     try:
         # Run the HandBrakeCLI command
-        print(f"Starting HandBrake encoding for {input_file}...")
-        subprocess.run(command, check=True)
+        with HANDBRAKE_SLOTS, timed_stage('convert_to_mp4_handbrake', subject=Path(output_file).name, output_path=output_file):
+            print(f"Starting HandBrake encoding for {input_file}...")
+            run_with_progress(command, f"Encode {Path(output_file).name}", HandBrakeProgress(), output_path=output_file)
         print(f"Encoding completed. Output saved to {output_file}.")
     except FileNotFoundError:
         print("Error: HandBrakeCLI not found. Please check the path to HandBrakeCLI.")
     except subprocess.CalledProcessError as e:
         print(f"Error: HandBrakeCLI failed with error code {e.returncode}.")
 
-def rip_dvd_title(iso_filename, mp4_output_folder, mkv_output_folder, title_id, file_name):
-    mp4_name = Path(mp4_output_folder) / f"{file_name}.mp4"
+def extract_mkv_title(source, mkv_output_folder, title_id, file_name, expected_duration=None, journal=None):
+    """
+    Extracts a title to '<file_name>.mkv' with MakeMKV.
+
+    :param source: The image to extract from, or a drive (e.g. 'disc:0').
+    :param expected_duration: The length of the title in seconds, used to check the MKV file is complete.
+    :param journal: The JobJournal the extraction is recorded in.
+    :return: The path to the MKV file, or None if the extraction failed.
+    """
+    journal = journal or JobJournal({})
+    stage = f"extract:{file_name}"
     mkv_name = os.path.join(mkv_output_folder, f"{file_name}.mkv")
-    mkv_started = False
-    handbrake_started = False
+    if journal.output_complete(stage, mkv_name, expected_duration):
+        print(f"MKV file already exists: {mkv_name}")
+        return mkv_name
+    journal.start(stage)
+
+    # MakeMKV picks its own file name, so each title is extracted into its own folder and then renamed.
+    # This stops titles that are ripped at the same time (e.g. from several drives) picking up each others files
+    mkv_staging_folder = os.path.join(mkv_output_folder, f".{file_name}.partial")
+    os.makedirs(mkv_staging_folder, exist_ok=True)
+    convert_to_mkv_makemkv(mkv_staging_folder, title_id, source)
+
+    new_file_name = [f for f in os.listdir(mkv_staging_folder) if f.endswith('.mkv')]
+    # The MKV only gets its final name once it has been checked, so a name that exists is always a complete file
+    if new_file_name and verify_output(os.path.join(mkv_staging_folder, new_file_name[0]), expected_duration):
+        os.replace(os.path.join(mkv_staging_folder, new_file_name[0]), mkv_name)
+        journal.complete(stage, path=mkv_name, size=os.path.getsize(mkv_name))
+    shutil.rmtree(mkv_staging_folder, ignore_errors=True)
+
+    if os.path.exists(mkv_name):
+        print(f"MKV conversion completed: {mkv_name}")
+        return mkv_name
+    return None
 
-    current_files = os.listdir(mkv_output_folder)
+def encode_title_mp4(input_file, mp4_name, title_id=None, chapter_count=0, expected_duration=None, journal=None):
+    """
+    Encodes a title to MP4. With ENCODE_SEGMENTS set, titles with several chapters are split into that many
+    chapter ranges which are encoded in parallel and joined, falling back to a single encode if that fails.
+
+    The MP4 is encoded under a temporary name and only renamed to mp4_name once it has been checked,
+    so an encode that was interrupted never leaves a file that looks finished.
+    """
+    journal = journal or JobJournal({})
+    mp4_name = Path(mp4_name)
+    stage = f"encode:{mp4_name.stem}"
+    journal.start(stage)
+    partial_name = mp4_name.with_name(f".{mp4_name.stem}.partial{mp4_name.suffix}")
+    remove_output(partial_name)
+
+    encoded = False
+    if ENCODE_SEGMENTS > 1 and chapter_count > 1:
+        encoded = segmented_encode(input_file, partial_name, bind_run(convert_to_mp4_handbrake), title_id=title_id, chapter_count=chapter_count, segment_count=ENCODE_SEGMENTS)
+        if not encoded:
+            print(f"Segmented encoding failed, encoding {mp4_name.name} in one piece.")
+    if not encoded:
+        convert_to_mp4_handbrake(input_file, partial_name, title_id=title_id)
+
+    if verify_output(partial_name, expected_duration):
+        os.replace(partial_name, mp4_name)
+        journal.complete(stage, path=str(mp4_name), size=mp4_name.stat().st_size)
+    else:
+        print(f"Error: the encode of {mp4_name.name} is incomplete.")
+        remove_output(partial_name)
+
+def encode_mkv_title(mkv_name, mp4_output_folder, file_name, chapter_count=0, expected_duration=None, journal=None):
+    """
+    Encodes an extracted MKV file to MP4, used when the disc was ripped without an image.
+    """
+    journal = journal or JobJournal({})
+    mp4_name = Path(mp4_output_folder) / f"{file_name}.mp4"
+    if journal.output_complete(f"encode:{file_name}", mp4_name, expected_duration):
+        print(f"MP4 file already exists: {mp4_name}")
+        return
+    encode_title_mp4(mkv_name, mp4_name, chapter_count=chapter_count, expected_duration=expected_duration, journal=journal)
+    if os.path.exists(mp4_name):
+        print(f"MP4 conversion completed: {mp4_name}")
+
+def rip_dvd_title(iso_filename, mp4_output_folder, mkv_output_folder, title_id, file_name, chapter_count=0, expected_duration=None, journal=None):
+    journal = journal or JobJournal({})
+    if ENCODE_SOURCE == 'mkv':
+        # Each byte of the title is read from the image once, HandBrake then reads the MKV that was just written
+        # (usually still in the page cache), instead of both tools seeking around the same image at once
+        mkv_name = extract_mkv_title(iso_filename, mkv_output_folder, title_id, file_name, expected_duration, journal)
+        if mkv_name:
+            encode_mkv_title(mkv_name, mp4_output_folder, file_name, chapter_count, expected_duration, journal)
+        return
+
+    mp4_name = Path(mp4_output_folder) / f"{file_name}.mp4"
+    handbrake_started = False
 
     mkv_thread = threading.Thread(
-        target=convert_to_mkv_makemkv,
-        args=(mkv_output_folder, title_id, iso_filename)
+        target=bind_run(bind_drive(extract_mkv_title)),
+        args=(iso_filename, mkv_output_folder, title_id, file_name, expected_duration, journal)
     )
 
     handbrake_thread = threading.Thread(
-        target=convert_to_mp4_handbrake,
+        target=bind_run(bind_drive(encode_title_mp4)),
         args=(iso_filename, mp4_name),
-        kwargs={'title_id': title_id}
+        kwargs={'title_id': title_id, 'chapter_count': chapter_count, 'expected_duration': expected_duration, 'journal': journal}
     )
 
     # Start both threads
-    if not os.path.exists(mkv_name):
-        mkv_thread.start()
-        mkv_started = True
-    else:
-        print(f"MKV file already exists: {mkv_name}")
+    mkv_thread.start()
 
-    if not os.path.exists(mp4_name):
+    if not journal.output_complete(f"encode:{file_name}", mp4_name, expected_duration):
         handbrake_thread.start()
         handbrake_started = True
     else:
         print(f"MP4 file already exists: {mp4_name}")
 
     # Wait for both threads to complete
-    if mkv_started:
-        mkv_thread.join()
+    mkv_thread.join()
     if handbrake_started:
         handbrake_thread.join()
 
-    updated_files = os.listdir(mkv_output_folder)
-    new_file_name = list(set(updated_files) - set(current_files))
-    if new_file_name:
-        new_file_path = os.path.join(mkv_output_folder, new_file_name[0])
-        mkv_name = os.path.join(mkv_output_folder, f"{file_name}.mkv")
-        os.rename(new_file_path, mkv_name)
-
-    if mkv_started and os.path.exists(mkv_name):
-        print(f"MKV conversion completed: {mkv_name}")
     if handbrake_started and os.path.exists(mp4_name):
         print(f"MP4 conversion completed: {mp4_name}")
 
-# NOTE: Need to split this function up, as it is too large
-# NOTE: Add a check to see if the rip was successful and if so call store_media_info
-def main(output_folders):
+# Only one drive can ask the user for information at a time, the rest of the rip runs concurrently
+PROMPT_LOCK = threading.Lock()
+
+def disc_folders(output_folders, dvd_title, season_number=None):
+    """
+    :param season_number: The season on the disc, None for movies.
+    :return: The output folders for a disc, the folders of TV shows are created.
+    """
     # This is modified, if there is a tv show and therefore needs to be copied to ensure that thr argument is not modified
     out_folders = copy.deepcopy(output_folders)
+    if season_number is None:
+        out_folders['mkv'] = Path(out_folders['mkv']) / 'Movies'
+        return out_folders
+
+    # Create the path for the tv show and seasons, based on the file structure provided by Plex and Jellyfin
+    season_folder_name = f"Season {season_number:02d}"
+
+    # NOTE: Maybe have the dict as a user input and if one is missing, assume that it does not need to create the file for that
+    # NOTE: For iso, if it is not present, just point it to the dvd drive directly
+    out_folders['mkv'] = Path(out_folders['mkv']) / 'TV Shows'
+    for key in out_folders:
+        out_folders[key] = Path(out_folders[key]) / dvd_title / season_folder_name
+        out_folders[key].mkdir(parents=True, exist_ok=True)
+    return out_folders
+
+def resolve_titles(output_folders, dvd_title, tv_show=False, season_number=1, first_episode=1, num_episodes=1, media_info=None):
+    """
+    Looks up the expected titles of a disc on TMDB, without asking the user anything.
+
+    :param output_folders: Dict containing the 'mp4', 'mkv' and 'iso' output folders.
+    :param dvd_title: The name of the movie or TV series.
+    :param media_info: The TV show from tmdb_tv_info, if it has already been looked up.
+    :return: Dict containing the media info, the titles to rip, the ISO name and the output folders for this disc,
+        or None if the title could not be found on TMDB.
+    """
     titles_to_rip = [] # NOTE: rename this variable, as it no longer holds the title id
-    dvd_title = str(input('Title of DVD (Movie/TV Series Name): ')).strip()
-    media_info = {}
     iso_name = ''
-    tv_show = False
 
     # Handles DVDs with multiple episodes
-    tv_show_input = str((input('Is this a TV show y/n: ')))
-    if tv_show_input == 'y':
-        tv_show = True
-        # Get the media info from TMDB
-        media_info = tmdb_tv_info(dvd_title)
-        number_of_seasons = len(media_info['seasons'])
-        print(f"This show has {number_of_seasons} season(s).")
-
-        # Get user input for season and episode information
-        season_number = 1
-        if number_of_seasons > 1:
-            season_number = int(input(f'Enter the season number for this disc (1-{number_of_seasons}): '))
-        first_episode = int(input(f'Enter the first episode number: '))
-        num_episodes = int((input('Enter the number of episodes on the disc: ')))
+    if tv_show:
+        # Get the media info from TMDB, the episodes are only fetched for the season on this disc
+        media_info = media_info or tmdb_tv_info(dvd_title, season_numbers=[])
+        if media_info is None:
+            return None
+        fetch_tv_seasons(media_info, [season_number])
 
         # Adds a leading zero to the season and episode numbers for formatting (both Plex and Jellyfin use this format)
         formatted_season = f"{season_number:02d}"
@@ -243,19 +400,12 @@ def main(output_folders):
 
         # 1 is subtracted, is because the 'first episode' is included in the count
         iso_name = f"{dvd_title} s{formatted_season}e{first_episode:02d} - e{((first_episode+num_episodes)-1):02d}"
-
-        # Create the path for the tv show and seasons, based on the file structure provided by Plex and Jellyfin
-        season_folder_name = f"Season {formatted_season}"
-
-        # NOTE: Maybe have the dict as a user input and if one is missing, assume that it does not need to create the file for that
-        # NOTE: For iso, if it is not present, just point it to the dvd drive directly
-        out_folders['mkv'] = Path(out_folders['mkv']) / 'TV Shows'
-        for key in out_folders:
-            out_folders[key] = Path(out_folders[key]) / dvd_title / season_folder_name
-            out_folders[key].mkdir(parents=True, exist_ok=True)
+        out_folders = disc_folders(output_folders, dvd_title, season_number)
     else:
-        out_folders['mkv'] = Path(out_folders['mkv']) / 'Movies'
+        out_folders = disc_folders(output_folders, dvd_title)
         media_info = tmdb_movie_info(dvd_title)
+        if media_info is None:
+            return None
         iso_name = dvd_title
         titles_to_rip.append(
             {
@@ -264,51 +414,568 @@ def main(output_folders):
             }
         )
 
-    iso_filename = Path(out_folders['iso']) / f"{iso_name}.iso"
+    return {
+        'media_info': media_info,
+        'titles_to_rip': titles_to_rip,
+        'iso_name': iso_name,
+        'tv_show': tv_show,
+        'out_folders': out_folders,
+        # The answers in the same format as a manifest entry, so the disc can be resolved again without asking
+        'answers': {
+            'title': dvd_title,
+            'tv_show': tv_show,
+            'season': season_number if tv_show else None,
+            'first_episode': first_episode if tv_show else None,
+            'episodes': num_episodes if tv_show else None,
+            'iso': None
+        }
+    }
+
+def get_titles_to_rip(output_folders):
+    """
+    Asks the user about the inserted disc and looks up the expected titles on TMDB.
+
+    :param output_folders: Dict containing the 'mp4', 'mkv' and 'iso' output folders.
+    :return: The dict returned by resolve_titles.
+    """
+    dvd_title = str(input('Title of DVD (Movie/TV Series Name): ')).strip()
+
+    tv_show_input = str((input('Is this a TV show y/n: ')))
+    if tv_show_input != 'y':
+        return resolve_titles(output_folders, dvd_title)
+
+    media_info = tmdb_tv_info(dvd_title, season_numbers=[])
+    number_of_seasons = len(media_info['seasons'])
+    print(f"This show has {number_of_seasons} season(s).")
+
+    # Get user input for season and episode information
+    season_number = 1
+    if number_of_seasons > 1:
+        season_number = int(input(f'Enter the season number for this disc (1-{number_of_seasons}): '))
+    first_episode = int(input(f'Enter the first episode number: '))
+    num_episodes = int((input('Enter the number of episodes on the disc: ')))
+    return resolve_titles(output_folders, dvd_title, True, season_number, first_episode, num_episodes, media_info=media_info)
+
+def resolve_manifest_entry(output_folders, entry):
+    """
+    The same as get_titles_to_rip, but reads the answers from a manifest entry (see batch.py).
+    """
+    if entry['tv_show']:
+        return resolve_titles(output_folders, entry['title'], True, entry['season'], entry['first_episode'], entry['episodes'])
+    return resolve_titles(output_folders, entry['title'])
+
+def resolve_known_disc(output_folders, record):
+    """
+    The same as get_titles_to_rip, for a disc from the DISC_INDEX. The media info is read from the MediaStore,
+    so nothing is looked up on TMDB unless the disc's media info was never stored (e.g. its encode failed).
+
+    :param record: The record stored in the DISC_INDEX when the disc was first ripped.
+    """
+    answers = record['answers']
+    media_info = MediaStore().get(record['kind'], record['tmdb_id'])
+    if media_info is None:
+        return resolve_manifest_entry(output_folders, answers)
+    return {
+        'media_info': media_info,
+        'titles_to_rip': record['titles_to_rip'],
+        'iso_name': record['iso_name'],
+        'tv_show': answers['tv_show'],
+        'out_folders': disc_folders(output_folders, answers['title'], answers['season'] if answers['tv_show'] else None),
+        'answers': answers
+    }
+
+def disc_record(disc):
+    """
+    :return: The record stored in the DISC_INDEX for a disc returned by resolve_titles.
+    """
+    return {
+        'answers': disc['answers'],
+        'kind': media_kind(disc['media_info']),
+        'tmdb_id': disc['media_info']['tmdb_id'],
+        'iso_name': disc['iso_name'],
+        'titles_to_rip': disc['titles_to_rip']
+    }
+
+@timed('match_disc_titles')
+def match_disc_titles(disc_info, titles_to_rip, tv_show):
+    """
+    Matches every title to rip against the titles on the disc.
+
+    :return: A list of (title_id, file_name) tuples, for the titles that were found.
+    """
+    # Every title is matched before any encoding starts, so the titles can be encoded in parallel without
+    # two of them being given the same title_id
+    threshold = 4 if tv_show else 10 # Threshold needs to be shorter, to allow for the specific episode to be found
+    title_ids = match_titles(disc_info, [title['expected_runtime'] for title in titles_to_rip], runtime_threshold=threshold)
+    matched_titles = []
+    for title, title_id in zip(titles_to_rip, title_ids):
+        if title_id == -1:
+            print(f"Title ID not found for {title['file_name']}. Skipping encoding.")
+        else:
+            matched_titles.append((title_id, title['file_name']))
+    return matched_titles
+
+def mp4_space(size_bytes, duration):
+    """
+    :return: The space needed to encode a title, the segments of a segmented encode are kept until they are joined.
+    """
+    mp4_bytes = estimate_title_bytes(size_bytes, duration)[1]
+    return mp4_bytes * 2 if ENCODE_SEGMENTS > 1 else mp4_bytes
+
+def title_outputs(folder, file_name, suffix):
+    """
+    :return: The paths (as glob patterns) a title's MKV or MP4 is written to, under its final and temporary names,
+        so the space they already take is not reserved twice.
+    """
+    folder = glob.escape(str(folder))
+    name = glob.escape(file_name)
+    # The MKV staging folder, the MP4 partial file and the folder of its segments
+    return [os.path.join(folder, f"{name}{suffix}"), os.path.join(folder, f".{name}.partial*"), os.path.join(folder, f"..{name}.partial.segments.*")]
 
-    encode = 'n' # Default to not encoding, if the user does not want to encode, then it will not start the decryption
-    if not os.path.exists(iso_filename):
-        encode = 'y'
-        start_makemkv_decryption(iso_filename)
+def encode_disc(job, journal=None):
+    """
+    Encodes every title of a ripped disc, this is the second stage of the pipeline and does not need the drive.
+    Stages that the journal records as complete are skipped, so an interrupted job resumes where it stopped.
+
+    :param job: The job dict created by main. It contains the output folders, the media info and either the
+        ISO path and titles to rip, or 'mkv_titles' when the titles were extracted straight from the disc.
+    :param journal: The JobJournal of the job, one that is only kept in memory is used if not provided.
+    :raises RuntimeError: If a title could not be extracted or encoded.
+    :raises InsufficientSpace: If the outputs would not fit in the output folders.
+    """
+    journal = journal or JobJournal(job)
+    print(f"Starting {job['name']} at the {journal.resume_stage()} stage.")
+
+    out_folders = job['out_folders']
+    if 'mkv_titles' in job:
+        needs = [
+            (out_folders['mp4'], mp4_space(path_size(title['mkv_filename']), title.get('duration')), title_outputs(out_folders['mp4'], title['file_name'], '.mp4'))
+            for title in job['mkv_titles'] if not journal.is_complete(f"encode:{title['file_name']}")
+        ]
+        with ADMISSION.reserve(needs, job['name']), \
+                ThreadPoolExecutor(max_workers=max(len(job['mkv_titles']), 1), thread_name_prefix='title') as executor:
+            futures = [
+                executor.submit(bind_run(encode_mkv_title), title['mkv_filename'], out_folders['mp4'], title['file_name'], title.get('chapter_count', 0), title.get('duration'), journal)
+                for title in job['mkv_titles']
+            ]
+            for future in futures:
+                future.result()
     else:
-        print('Image already exists')
-        encode = str(input('Proceed with encoding y/n: '))
-        print('\nProcessing encoding, using existing ISO file.')
-
-    if encode == 'y':
-        # This is done after the user input, so the user does not have to wait for the decryption to start
-        # This also means they can enter the required information and then leave
-        disc_info = get_title_info(iso_filename)
-
-        previous_title_ids = [] # Used to prevent the same title_id being used for multiple titles
-        threshold = 4 if tv_show else 10 # Threshold needs to be shorter, to allow for the specific episode to be found
-        for title in titles_to_rip:
-            title_id = -1 # Default to -1, prevents same title_id being used for multiple titles
-            title_id = get_title_id(disc_info, title['expected_runtime'], runtime_threshold=threshold, previous_title_ids=previous_title_ids)
-            if title_id == -1:
-                print(f"Title ID not found for {title['file_name']}. Skipping encoding.")
-            else:
-                rip_dvd_title(iso_filename, out_folders['mp4'], out_folders['mkv'], title_id, title['file_name'])
-                previous_title_ids.append(title_id)
+        iso_filename = Path(job['iso_filename'])
+        if journal.is_complete('scan'):
+            disc_info = DiscInfo.from_dict(journal.details('scan')['disc_info'])
+        else:
+            journal.start('scan')
+            # Re-encoding an existing image reuses its last scan, which can take minutes on discs with playlist obfuscation
+            disc_info = SCAN_CACHE.get(iso_filename)
+            if disc_info is None:
+                makemkv_info = get_title_info(iso_filename)
+                if makemkv_info is None:
+                    raise RuntimeError(f"Could not read the titles from {iso_filename}")
+                disc_info = parse_robot_output(makemkv_info)
+                SCAN_CACHE.put(iso_filename, disc_info)
+            journal.complete('scan', disc_info=disc_info.to_dict())
+
+        if journal.is_complete('match'):
+            matched_titles = [tuple(title) for title in journal.details('match')['titles']]
+        else:
+            matched_titles = match_disc_titles(disc_info, job['titles_to_rip'], job['tv_show'])
+            journal.complete('match', titles=matched_titles)
+            if job.get('fingerprint'):
+                DISC_INDEX.update(job['fingerprint'], image_scan={'disc_info': disc_info.to_dict(), 'titles': matched_titles})
+
+        # The titles that are still to be extracted or encoded must fit, otherwise the job is deferred
+        needs = []
+        for title_id, file_name in matched_titles:
+            title = disc_info.titles[title_id]
+            if not journal.is_complete(f"extract:{file_name}"):
+                needs.append((out_folders['mkv'], estimate_title_bytes(title.size_bytes, title.duration)[0], title_outputs(out_folders['mkv'], file_name, '.mkv')))
+            if not journal.is_complete(f"encode:{file_name}"):
+                needs.append((out_folders['mp4'], mp4_space(title.size_bytes, title.duration), title_outputs(out_folders['mp4'], file_name, '.mp4')))
+        if ADMISSION.retention is not None:
+            ADMISSION.retention.touch(iso_filename)
+
+        # The number of processes that actually run is limited by HANDBRAKE_SLOTS and MAKEMKV_SLOTS
+        with ADMISSION.reserve(needs, job['name']), \
+                ThreadPoolExecutor(max_workers=max(len(matched_titles), 1), thread_name_prefix='title') as executor:
+            futures = [
+                executor.submit(bind_run(rip_dvd_title), iso_filename, out_folders['mp4'], out_folders['mkv'], title_id, file_name,
+                                disc_info.titles[title_id].chapter_count, disc_info.titles[title_id].duration, journal)
+                for title_id, file_name in matched_titles
+            ]
+            for future in futures:
+                future.result()
+
+    if not journal.is_complete('metadata'):
+        store_media_info(job['media_info'])
+        journal.complete('metadata')
+
+    # Every title that was asked for counts, titles that were not found on the disc (or not extracted) were not encoded
+    file_names = [title['file_name'] for title in job['titles_to_rip']]
+    file_names += [title['file_name'] for title in job.get('mkv_titles', []) if title['file_name'] not in file_names]
+    unfinished = [file_name for file_name in file_names if not journal.is_complete(f"encode:{file_name}")]
+    if unfinished:
+        raise RuntimeError(f"{len(unfinished)} title(s) were not encoded: {', '.join(unfinished)}")
+
+def encode_worker(queue, stop_event=None):
+    """
+    Encodes the discs in the job queue one at a time, until stop_event is set.
+
+    :param queue: The JobQueue the backed up discs are added to.
+    :param stop_event: Optional threading.Event, used to stop the worker.
+    """
+    while True:
+        claimed = queue.wait_for_job(stop_event)
+        if claimed is None:
+            return
+        job_id, job = claimed
+        print(f"Encoding {job['name']} ({queue.pending_count()} disc(s) waiting)")
+        # The run continues from the stages timed while the disc was ripped
+        previous = job.get('run', {})
+        run = Run(job['name'], previous.get('stages'), previous.get('started'), previous.get('processes'))
+        try:
+            # The journal is saved to the job file, so a job recovered after a crash skips the stages it finished
+            with active_run(run):
+                encode_disc(job, JobJournal(job, queue, job_id))
+            queue.complete(job_id)
+            record_disc('done')
+            # The image is only evictable now its encodes have been verified, and once no other job of it is queued
+            if ADMISSION.retention is not None and job.get('iso_filename'):
+                if ADMISSION.retention.mark_encoded(job['iso_filename']):
+                    ADMISSION.retention.evict()
+        except InsufficientSpace as e:
+            if not e.retryable:
+                # The job can never fit, it fails instead of being deferred forever
+                print(f"Error: encoding {job['name']} failed: {e}")
+                queue.fail(job_id, e)
+                record_disc('failed')
+                print(f"Run summary written to {run.write()}")
+                continue
+            # Tried again later, by then other encodes may have finished or images been deleted
+            print(f"Deferring {job['name']} for {ADMISSION_RETRY_SECONDS:.0f}s: {e}.")
+            summary = run.to_dict()
+            job['run'] = {'started': run.started, 'stages': summary['stages'], 'processes': summary['processes']}
+            queue.update(job_id, job)
+            queue.defer(job_id, ADMISSION_RETRY_SECONDS)
+            continue
+        except Exception as e:
+            print(f"Error: encoding {job['name']} failed: {e}")
+            queue.fail(job_id, e)
+            record_disc('failed')
+        print(f"Run summary written to {run.write()}")
+
+def rip_direct(disc, disc_index, journal):
+    """
+    Extracts the matched titles straight from the drive to MKV, without writing an image of the whole disc.
+
+    :param journal: The JobJournal of the disc's job, the scan, match and extractions are recorded in it.
+    :return: A list of dicts containing the 'mkv_filename', 'file_name', 'chapter_count' and 'duration' of each extracted title.
+    """
+    source = f"disc:{disc_index}"
+    # Discs from the DISC_INDEX already have their scan and match in the journal
+    if journal.is_complete('scan') and journal.is_complete('match'):
+        disc_info = DiscInfo.from_dict(journal.details('scan')['disc_info'])
+        matched_titles = [tuple(title) for title in journal.details('match')['titles']]
     else:
-        print("\nEncoding skipped.")
+        journal.start('scan')
+        makemkv_info = get_title_info(source)
+        if makemkv_info is None:
+            return []
+        disc_info = parse_robot_output(makemkv_info)
+        journal.complete('scan', disc_info=disc_info.to_dict())
+
+        matched_titles = match_disc_titles(disc_info, disc['titles_to_rip'], disc['tv_show'])
+        journal.complete('match', titles=matched_titles)
+        if disc.get('fingerprint'):
+            DISC_INDEX.update(disc['fingerprint'], disc_scan={'disc_info': disc_info.to_dict(), 'titles': matched_titles})
+
+    # The disc is in the drive, so the extraction waits for space instead of being deferred
+    needs = [
+        (disc['out_folders']['mkv'], estimate_title_bytes(disc_info.titles[title_id].size_bytes, disc_info.titles[title_id].duration)[0],
+         title_outputs(disc['out_folders']['mkv'], file_name, '.mkv'))
+        for title_id, file_name in matched_titles if not journal.is_complete(f"extract:{file_name}")
+    ]
+    mkv_titles = []
+    with ADMISSION.wait(needs, disc['iso_name']):
+        for title_id, file_name in matched_titles:
+            mkv_filename = extract_mkv_title(source, disc['out_folders']['mkv'], title_id, file_name, disc_info.titles[title_id].duration, journal)
+            if mkv_filename:
+                mkv_titles.append({
+                    'mkv_filename': str(mkv_filename),
+                    'file_name': file_name,
+                    'chapter_count': disc_info.titles[title_id].chapter_count,
+                    'duration': disc_info.titles[title_id].duration
+                })
+    return mkv_titles
+
+def disc_job(disc):
+    """
+    :param disc: The dict returned by resolve_titles.
+    :return: The encode job for the disc, without the image or the extracted titles.
+    """
+    return {
+        'name': disc['iso_name'],
+        'out_folders': {key: str(folder) for key, folder in disc['out_folders'].items()},
+        'titles_to_rip': disc['titles_to_rip'],
+        'tv_show': disc['tv_show'],
+        'media_info': disc['media_info'],
+        'fingerprint': disc.get('fingerprint')
+    }
+
+def backlog_encoded(disc, iso_filename):
+    """
+    Checks every MP4 of an image is complete, against the durations of the titles in the image's cached scan.
 
-    if os.getenv('NO_EJECT') != True:
-        store_media_info(media_info)
-        eject_dvd()
+    :return: True if the image does not need to be encoded again. Without a cached scan this cannot be checked and
+        False is returned, the encode job then skips the MP4s that verify against the durations from its own scan.
+    """
+    mp4_folder = Path(disc['out_folders']['mp4'])
+    if not all((mp4_folder / f"{title['file_name']}.mp4").exists() for title in disc['titles_to_rip']):
+        return False
+    disc_info = SCAN_CACHE.get(iso_filename)
+    if disc_info is None:
+        return False
+    matched_titles = match_disc_titles(disc_info, disc['titles_to_rip'], disc['tv_show'])
+    if len(matched_titles) != len(disc['titles_to_rip']):
+        return False
+    return all(verify_output(mp4_folder / f"{file_name}.mp4", disc_info.titles[title_id].duration) for title_id, file_name in matched_titles)
+
+def queue_backlog(entries, output_folders, queue):
+    """
+    Adds every manifest entry that already has an image to the encode queue, without asking the user anything.
+    Images that are already queued, or whose MP4s are all complete (see backlog_encoded), are skipped.
+
+    :param entries: Manifest entries from batch.load_manifest or batch.scan_backlog.
+    :return: A tuple of (the number of images queued, the entries without an image, which have to be ripped from a disc).
+    """
+    queued_images = {job.get('iso_filename') for _, job in queue.jobs('pending', 'active')}
+
+    def resolve(entry):
+        try:
+            return resolve_manifest_entry(output_folders, entry)
+        except (IndexError, KeyError) as e:
+            print(f"Error: could not find the episodes of {entry['title']} on TMDB: {e}")
+            return None
+
+    # Looking up the metadata is the slow part of queuing a large backlog, so the entries are resolved concurrently
+    with ThreadPoolExecutor(max_workers=TMDB_MAX_CONCURRENCY, thread_name_prefix='resolve') as executor:
+        resolved = list(executor.map(resolve, entries))
+
+    queued = 0
+    discs = []
+    for entry, disc in zip(entries, resolved):
+        if disc is None:
+            print(f"Skipping {entry['iso'] or entry['title']}, it was not found on TMDB.")
+            continue
+        if entry['iso']:
+            iso_filename = Path(entry['iso'])
+        elif 'iso' in disc['out_folders']:
+            iso_filename = Path(disc['out_folders']['iso']) / f"{disc['iso_name']}.iso"
+        else:
+            iso_filename = None
+        if iso_filename is None or not iso_filename.exists():
+            discs.append(entry)
+            continue
+
+        if str(iso_filename) in queued_images:
+            print(f"{iso_filename} is already in the encode queue.")
+        elif backlog_encoded(disc, iso_filename):
+            print(f"{iso_filename} has already been encoded.")
+        else:
+            job = disc_job(disc)
+            job['iso_filename'] = str(iso_filename)
+            JobJournal(job).complete('backup', path=str(iso_filename), size=path_size(iso_filename))
+            queue.put(job)
+            # An image that is queued again is kept until it has been encoded again
+            if ADMISSION.retention is not None:
+                ADMISSION.retention.touch(iso_filename)
+            queued_images.add(str(iso_filename))
+            queued += 1
+    return queued, discs
+
+def main(output_folders, queue, drive=None, manifest=None):
+    """
+    Rips the disc in a drive, ejects it and adds it to the encode queue.
+    The disc is backed up to an ISO, unless output_folders has no 'iso' folder, in which case only the
+    matched titles are extracted to MKV and the MP4s are encoded from those.
+
+    :param output_folders: Dict containing the 'mp4', 'mkv' and (optionally) 'iso' output folders.
+    :param queue: The JobQueue the encode_worker threads take discs from.
+    :param drive: The drive dict from drive_scheduler.discover_drives, defaults to the first drive.
+    :param manifest: Optional batch.DiscManifest, each disc takes the next entry instead of asking the user.
+    """
+    # Every stage timed while this disc is ripped is recorded in the disc's run summary
+    with active_run(Run()) as run:
+        disc_index = drive['index'] if drive else 0
+        device = drive['device'] if drive else None
+        direct = 'iso' not in output_folders
+
+        disc_path = drive_watch_path(device) if device else (os.getenv('DISC_DRIVE') or 'E:\\')
+        fingerprint = disc_fingerprint(disc_path)
+        record = DISC_INDEX.get(fingerprint) if fingerprint else None
+
+        entry = None
+        disc = None
+        if manifest is not None:
+            entry = manifest.next_disc()
+            disc = resolve_manifest_entry(output_folders, entry) if entry else None
+            if disc is None:
+                print("No more discs in the manifest." if entry is None else f"Could not find {entry['title']} on TMDB.")
+                eject_dvd(device)
+                return
+        elif record is not None:
+            disc = resolve_known_disc(output_folders, record)
+            if disc is not None:
+                print(f"This disc has been ripped before, as {disc['iso_name']}.")
+        known = disc is not None and entry is None
+
+        with PROMPT_LOCK:
+            if disc is None:
+                disc = get_titles_to_rip(output_folders)
+            out_folders = disc['out_folders']
+
+            encode = 'n' # Default to not encoding, if the user does not want to encode, then it will not start the decryption
+            backup_needed = False
+            if direct:
+                encode = 'y'
+            else:
+                iso_filename = Path(entry['iso']) if entry and entry['iso'] else Path(out_folders['iso']) / f"{disc['iso_name']}.iso"
+                backup_needed = not os.path.exists(iso_filename)
+                if backup_needed or entry is not None or known:
+                    encode = 'y'
+                else:
+                    print('Image already exists')
+                    encode = str(input('Proceed with encoding y/n: '))
+                    print('\nProcessing encoding, using existing ISO file.')
+
+        if fingerprint:
+            disc['fingerprint'] = fingerprint
+            if not known:
+                DISC_INDEX.put(fingerprint, read_volume_name(disc_path), disc_record(disc))
+
+        job = disc_job(disc)
+        journal = JobJournal(job)
+        # A disc that has been ripped before reuses the scan and title matches from last time
+        scan = record.get('disc_scan' if direct else 'image_scan') if known else None
+        if scan:
+            journal.complete('scan', disc_info=scan['disc_info'])
+            journal.complete('match', titles=scan['titles'])
+        if direct:
+            journal.complete('backup', source=f"disc:{disc_index}")
+            try:
+                job['mkv_titles'] = rip_direct(disc, disc_index, journal)
+            except InsufficientSpace as e:
+                # Nothing running can free the space, so the disc is ejected instead of waiting forever
+                print(f"Error: {e}.")
+                record_disc('failed')
+                job['mkv_titles'] = []
+            if not job['mkv_titles']:
+                print("No titles were extracted, the disc will not be encoded.")
+                encode = 'n'
+        else:
+            job['iso_filename'] = str(iso_filename)
+            if backup_needed:
+                # The backup is written under a temporary name and only renamed once MakeMKV has finished, so an
+                # image with the final name is always complete and an interrupted backup is started again
+                partial_filename = iso_filename.with_name(f".{iso_filename.name}.partial")
+                remove_output(partial_filename)
+                journal.start('backup')
+                # The disc is in the drive, so the backup waits until the image fits
+                iso_outputs = [glob.escape(str(iso_filename)), glob.escape(str(partial_filename))]
+                try:
+                    with ADMISSION.wait([(out_folders['iso'], disc_size(disc_path) or DISC_SIZE_ESTIMATE, iso_outputs)], disc['iso_name']):
+                        if start_makemkv_decryption(partial_filename, disc_index=disc_index) and os.path.exists(partial_filename):
+                            os.replace(partial_filename, iso_filename)
+                        else:
+                            remove_output(partial_filename)
+                except InsufficientSpace as e:
+                    # Nothing running can free the space, so the disc is ejected instead of waiting forever
+                    print(f"Error: {e}.")
+                    record_disc('failed')
+                if not os.path.exists(iso_filename):
+                    print("Backup failed, the disc will not be encoded.")
+                    encode = 'n'
+            if os.path.exists(iso_filename):
+                journal.complete('backup', path=str(iso_filename), size=path_size(iso_filename))
+                if ADMISSION.retention is not None:
+                    ADMISSION.retention.touch(iso_filename)
+
+        # The job is queued before the disc is ejected, so a failed eject never loses a finished backup
+        if encode == 'y':
+            run.name = job['name']
+            summary = run.to_dict()
+            job['run'] = {'started': run.started, 'stages': summary['stages'], 'processes': summary['processes']}
+            queue.put(job)
+            print(f"Added {disc['iso_name']} to the encode queue.")
+        else:
+            print("\nEncoding skipped.")
+
+        # The drive is only needed for the backup, so the disc is ejected before encoding starts
+        if os.getenv('NO_EJECT') != True:
+            eject_dvd(device)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rips discs to ISO, MKV and MP4.')
+    parser.add_argument('--manifest', help='JSON or TOML file describing the discs, so nothing is asked (see batch.py)')
+    parser.add_argument('--scan-backlog', action='store_true', help='encode every image in ISO_OUT_DIR without asking anything')
+    args = parser.parse_args()
+
     iso_out_dir = os.getenv('ISO_OUT_DIR', 'C:\\iso_movies\\')
     mp4_out_dir = os.getenv('MP4_OUT_DIR', 'C:\\mp4_movies\\')
     mkv_out_dir = os.getenv('MKV_OUT_DIR', 'C:\\mkv_movies\\')
-    disc_drive = os.getenv('DISC_DRIVE', 'E:\\')
+    disc_drive = os.getenv('DISC_DRIVE')
+    encode_workers = int(os.getenv('ENCODE_WORKERS', 1))
+    # 'iso' backs up the whole disc before encoding, 'direct' only extracts the titles that are needed
+    rip_mode = os.getenv('RIP_MODE', 'iso')
 
     output_folders = {
         'mp4': mp4_out_dir,
-        'mkv': mkv_out_dir,
-        'iso': iso_out_dir
+        'mkv': mkv_out_dir
     }
-
-    while True:
-        if dvd_detected(disc_drive):
-            main(output_folders)
\ No newline at end of file
+    if rip_mode != 'direct' and iso_out_dir:
+        output_folders['iso'] = iso_out_dir
+
+    if COORDINATOR_PORT:
+        # Workers may only write to the MP4 folder
+        start_coordinator(int(COORDINATOR_PORT), [mp4_out_dir])
+    if os.getenv('METRICS_PORT'):
+        start_metrics_server(int(os.getenv('METRICS_PORT')))
+
+    # Discs that were being encoded when the script last stopped are encoded again
+    queue = JobQueue()
+    recovered = queue.recover()
+    if recovered:
+        print(f"Resuming {recovered} unfinished encode(s).")
+    if ISO_RETENTION_MAX_BYTES and 'iso' in output_folders:
+        # Images are only deleted once their job is done, mark_encoded is called by encode_worker
+        ADMISSION.retention = IsoRetention(iso_out_dir, queue=queue)
+        ADMISSION.retention.evict()
+    for i in range(encode_workers):
+        threading.Thread(target=encode_worker, args=(queue,), name=f"encoder-{i}", daemon=True).start()
+
+    manifest = None
+    if args.manifest or args.scan_backlog:
+        entries = load_manifest(args.manifest) if args.manifest else []
+        if args.scan_backlog:
+            entries.extend(scan_backlog(iso_out_dir))
+        queued, discs = queue_backlog(entries, output_folders, queue)
+        print(f"Added {queued} image(s) to the encode queue.")
+        if discs:
+            manifest = DiscManifest(discs)
+            print(f"{len(manifest)} disc(s) in the manifest still need to be ripped.")
+
+    if (args.manifest or args.scan_backlog) and manifest is None:
+        # Nothing needs a drive, so the script exits once the queue has been encoded
+        while any(queue.jobs('pending', 'active')):
+            time.sleep(queue.poll_interval)
+        print("Finished encoding the backlog.")
+    else:
+        # DISC_DRIVE pins the script to a single drive, otherwise every drive MakeMKV can see gets a worker
+        drives = [] if disc_drive else discover_drives()
+        if drives:
+            print(f"Found {len(drives)} disc drive(s): {', '.join(drive['device'] for drive in drives)}")
+            run_drive_workers(drives, lambda drive: main(output_folders, queue, drive, manifest))
+        else:
+            # Blocks on drive events between discs, main is called once per insertion
+            for _ in watch_drive(disc_drive or 'E:\\'):
+                main(output_folders, queue, manifest=manifest)
@@ -0,0 +1,108 @@
+import re
+import json
+import tomllib
+import threading
+from pathlib import Path
+
+# Describes discs without asking anyone, so a backlog can be ripped and encoded unattended.
+# A manifest is a JSON or TOML file listing discs, e.g. in TOML:
+#
+#   [[discs]]
+#   title = "The Matrix"
+#   iso = "C:\\iso_movies\\The Matrix.iso"     # optional, discs without an image are ripped from the drive
+#
+#   [[discs]]
+#   title = "Friends"
+#   tv_show = true
+#   season = 1
+#   first_episode = 1
+#   episodes = 4
+#
+# JSON manifests use the same keys, either as a list or as {"discs": [...]}.
+# scan_backlog builds the same entries from the names of the images already in ISO_OUT_DIR.
+
+# The name main gives the image of a TV disc, e.g. 'Friends s01e05 - e08'
+TV_ISO_NAME = re.compile(r'^(?P<title>.+) s(?P<season>\d+)e(?P<first>\d+) - e(?P<last>\d+)$')
+
+def manifest_entry(entry):
+    """
+    Fills in the defaults of a manifest entry.
+
+    :raises ValueError: If the entry has no title.
+    """
+    if not entry.get('title'):
+        raise ValueError(f"Manifest entry has no title: {entry}")
+    tv_show = bool(entry.get('tv_show', False))
+    return {
+        'title': str(entry['title']).strip(),
+        'tv_show': tv_show,
+        'season': int(entry.get('season', 1)) if tv_show else None,
+        'first_episode': int(entry.get('first_episode', 1)) if tv_show else None,
+        'episodes': int(entry.get('episodes', 1)) if tv_show else None,
+        'iso': str(entry['iso']) if entry.get('iso') else None
+    }
+
+def load_manifest(manifest_file):
+    """
+    :param manifest_file: A .json or .toml file.
+    :return: A list of manifest entries.
+    """
+    manifest_file = Path(manifest_file)
+    if manifest_file.suffix.lower() == '.toml':
+        with open(manifest_file, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        with open(manifest_file) as f:
+            data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('discs', [])
+    return [manifest_entry(entry) for entry in data]
+
+def parse_iso_name(iso_filename):
+    """
+    Reads the title (and for TV shows the season and episodes) from the name of an image.
+
+    :return: A manifest entry for the image.
+    """
+    iso_filename = Path(iso_filename)
+    match = TV_ISO_NAME.match(iso_filename.stem)
+    if match is None:
+        return manifest_entry({'title': iso_filename.stem, 'iso': iso_filename})
+    first_episode = int(match.group('first'))
+    return manifest_entry({
+        'title': match.group('title'),
+        'tv_show': True,
+        'season': int(match.group('season')),
+        'first_episode': first_episode,
+        'episodes': int(match.group('last')) - first_episode + 1,
+        'iso': iso_filename
+    })
+
+def scan_backlog(iso_dir):
+    """
+    Finds every image in iso_dir (including the TV show and season folders).
+
+    :return: A list of manifest entries, sorted by path.
+    """
+    return [parse_iso_name(iso_filename) for iso_filename in sorted(Path(iso_dir).rglob('*.iso'))]
+
+class DiscManifest:
+    """
+    Hands out the manifest entries of discs that still need to be ripped, in order, one per inserted disc.
+    Shared by every drive worker, so two drives never take the same entry.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.lock = threading.Lock()
+
+    def next_disc(self):
+        """
+        :return: The next manifest entry, or None once every disc has been handed out.
+        """
+        with self.lock:
+            return self.entries.pop(0) if self.entries else None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
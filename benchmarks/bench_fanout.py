@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+# Compares the two ways rip_dvd_title can read a title from an image, using a synthetic image file:
+#   dual:   MakeMKV and HandBrake both read the image at the same time (ENCODE_SOURCE=iso)
+#   fanout: the image is read once to write the MKV, then the MKV is read by HandBrake (ENCODE_SOURCE=mkv)
+# fanout is measured warm (the MKV is still in the page cache, as when HandBrake starts right after MakeMKV) and
+# cold (the MKV is dropped from the cache first, as when memory is short or the encode waited in the queue).
+# Usage: python benchmarks/bench_fanout.py [--size-mb 2048] [--dir /path/on/the/disk/to/test]
+
+BLOCK_SIZE = 1024 * 1024
+
+def drop_cache(path):
+    # Without this the second read comes from memory and the benchmark only measures the page cache
+    if hasattr(os, 'posix_fadvise'):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def create_image(path, size_mb):
+    block = os.urandom(BLOCK_SIZE)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_file(path):
+    # Stands in for HandBrake reading its input
+    with open(path, 'rb') as f:
+        while f.read(BLOCK_SIZE):
+            pass
+
+def copy_file(source, destination):
+    # Stands in for MakeMKV extracting a title
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        while block := src.read(BLOCK_SIZE):
+            dst.write(block)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+def run_dual(image, mkv):
+    threads = [
+        threading.Thread(target=copy_file, args=(image, mkv)),
+        threading.Thread(target=read_file, args=(image,))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def run_fanout(image, mkv, cold=False):
+    copy_file(image, mkv)
+    if cold:
+        drop_cache(mkv)
+    read_file(mkv)
+
+def run_fanout_cold(image, mkv):
+    run_fanout(image, mkv, cold=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=2048, help='size of the synthetic image')
+    parser.add_argument('--dir', default=None, help='folder to write the test files to (defaults to the temp folder)')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as temp_dir:
+        image = os.path.join(temp_dir, 'image.iso')
+        mkv = os.path.join(temp_dir, 'title.mkv')
+        print(f"Creating a {args.size_mb} MB image in {temp_dir}...")
+        create_image(image, args.size_mb)
+
+        results = {}
+        for mode, run in (('dual', run_dual), ('fanout', run_fanout), ('fanout-cold', run_fanout_cold)):
+            timings = []
+            for _ in range(args.runs):
+                drop_cache(image)
+                if os.path.exists(mkv):
+                    os.remove(mkv)
+                start = time.perf_counter()
+                run(image, mkv)
+                timings.append(time.perf_counter() - start)
+            results[mode] = min(timings)
+            print(f"{mode:>11}: {results[mode]:.2f}s best of {args.runs}, {args.size_mb / results[mode]:.1f} MB/s of image")
+
+        print(f"fanout is {results['dual'] / results['fanout']:.2f}x (warm) and {results['dual'] / results['fanout-cold']:.2f}x (cold) the speed of dual")
+
+if __name__ == '__main__':
+    sys.exit(main())
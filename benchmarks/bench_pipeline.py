@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import importlib.util
+from pathlib import Path
+from tmdb_stub import TMDBStub
+
+# Runs whole discs through auto-rip.py without a drive, MakeMKV, HandBrake or a TMDB API key, so changes to the
+# pipeline can be measured and regressions caught. MakeMKV, HandBrake, ffprobe and ffmpeg are replaced by the fake_*.py
+# scripts (through the MAKEMKV, HANDBRAKE, FFPROBE and FFMPEG environment variables) and TMDB by tmdb_stub.py.
+# Each run is a separate process with its own temporary folders, so runs do not share caches or databases and the
+# peak memory of one run is not inflated by the last. Reports the wall time, the time of each stage (from the run
+# summary, see metrics.py), the TMDB requests and the peak memory of each scenario.
+# Usage: python benchmarks/bench_pipeline.py [--scenario movie --scenario tv] [--runs 3] [--rip-mode iso|direct]
+#        [--segments 0] [--size-scale 1] [--read-mbps 200] [--encode-speed 1200] [--tmdb-latency-ms 0] [--json results.json]
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+
+# The discs are the ones in test-movie.json and test-tvshow.json, with sizes scaled down so a run takes seconds
+SCENARIOS = {
+    'movie': {
+        'manifest': {'title': 'Inception'},
+        'disc': {
+            'name': 'Inception',
+            'volume_name': 'INCEPTION',
+            'titles': [
+                {'duration': 8903, 'chapters': 28, 'size_mb': 96},  # The film, 148 minutes on TMDB
+                {'duration': 154, 'chapters': 1, 'size_mb': 2},  # Trailer
+                {'duration': 852, 'chapters': 4, 'size_mb': 10}  # Featurette
+            ]
+        }
+    },
+    'tv': {
+        'manifest': {'title': 'Band of Brothers', 'tv_show': True, 'season': 1, 'first_episode': 1, 'episodes': 4},
+        'disc': {
+            'name': 'Band of Brothers',
+            'volume_name': 'BAND_OF_BROTHERS_D1',
+            'titles': [
+                {'duration': 14440, 'chapters': 32, 'size_mb': 160},  # Play all
+                {'duration': 3625, 'chapters': 8, 'size_mb': 40},
+                {'duration': 3560, 'chapters': 8, 'size_mb': 40},
+                {'duration': 3670, 'chapters': 8, 'size_mb': 40},
+                {'duration': 3585, 'chapters': 8, 'size_mb': 40},
+                {'duration': 301, 'chapters': 1, 'size_mb': 4}  # Previews
+            ]
+        }
+    }
+}
+
+def write_wrapper(folder, name, script):
+    """
+    :return: The path of an executable that runs script with this Python, for the MAKEMKV/HANDBRAKE/FFPROBE/FFMPEG variables.
+    """
+    if os.name == 'nt':
+        path = folder / f"{name}.cmd"
+        path.write_text(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = folder / name
+        path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        path.chmod(0o755)
+    return str(path)
+
+def peak_memory():
+    """
+    :return: The peak resident memory in bytes of this process and of its largest child (MakeMKV/HandBrake), or
+        None where the resource module is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def run_child(workdir):
+    """
+    Runs in the benchmark process: rips the fake disc with auto-rip.main, then encodes it with encode_worker.
+    """
+    workdir = Path(workdir)
+    with open(workdir / 'scenario.json') as f:
+        config = json.load(f)
+    os.chdir(workdir)
+    sys.path.insert(0, str(ROOT))
+
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('auto_rip', ROOT / 'auto-rip.py')
+    auto_rip = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(auto_rip)
+    from batch import DiscManifest, manifest_entry
+    # There is no tray to open
+    auto_rip.eject_dvd = lambda device=None: None
+    imported = time.perf_counter()
+
+    queue = auto_rip.JobQueue(os.environ['JOB_QUEUE_DIR'], poll_interval=0.2)
+    stop_event = threading.Event()
+    workers = [threading.Thread(target=auto_rip.encode_worker, args=(queue, stop_event), name=f"encoder-{i}")
+               for i in range(config['encode_workers'])]
+    for worker in workers:
+        worker.start()
+
+    auto_rip.main(config['output_folders'], queue, manifest=DiscManifest([manifest_entry(config['manifest'])]))
+    ripped = time.perf_counter()
+    while any(queue.jobs('pending', 'active')):
+        time.sleep(0.05)
+    stop_event.set()
+    for worker in workers:
+        worker.join()
+    finished = time.perf_counter()
+
+    totals = {}
+    for summary_file in Path(os.environ['RUN_SUMMARY_DIR']).glob('*.json'):
+        with open(summary_file) as f:
+            for stage, total in json.load(f)['totals'].items():
+                merged = totals.setdefault(stage, {'count': 0, 'seconds': 0.0, 'bytes': 0, 'failures': 0})
+                for key in merged:
+                    merged[key] += total[key]
+
+    outputs = [path for path in Path(config['output_folders']['mp4']).rglob('*.mp4') if not path.name.startswith('.')]
+    memory, tools_memory = peak_memory()
+    result = {
+        'import_seconds': round(imported - started, 3),
+        'rip_seconds': round(ripped - imported, 3),
+        'encode_seconds': round(finished - ripped, 3),
+        'wall_seconds': round(finished - imported, 3),
+        'stages': totals,
+        'failed_jobs': len(list(queue.jobs('failed'))),
+        'outputs': len(outputs),
+        'output_bytes': sum(path.stat().st_size for path in outputs),
+        'peak_memory_bytes': memory,
+        'tools_peak_memory_bytes': tools_memory
+    }
+    with open(workdir / 'result.json', 'w') as f:
+        json.dump(result, f, indent=2)
+    return 0
+
+def run_scenario(name, args, stub, tmdb_url, wrappers, base_dir):
+    """
+    Runs a scenario once in a new process.
+
+    :return: The result written by run_child, with the TMDB request counts added.
+    """
+    scenario = SCENARIOS[name]
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench-{name}-", dir=base_dir))
+    disc = dict(scenario['disc'], titles=[
+        dict(title, size_mb=max(1, round(title['size_mb'] * args.size_scale))) for title in scenario['disc']['titles']
+    ])
+    with open(workdir / 'disc.json', 'w') as f:
+        json.dump(disc, f, indent=2)
+    # The mounted disc, read by disc_index.disc_fingerprint
+    (workdir / 'disc' / 'VIDEO_TS').mkdir(parents=True)
+    (workdir / 'disc' / 'VIDEO_TS' / 'VIDEO_TS.IFO').write_text(json.dumps(disc))
+
+    output_folders = {'mp4': str(workdir / 'mp4'), 'mkv': str(workdir / 'mkv')}
+    if args.rip_mode == 'iso':
+        output_folders['iso'] = str(workdir / 'iso')
+    for folder in output_folders.values():
+        os.makedirs(folder, exist_ok=True)
+    os.makedirs(workdir / 'mkv' / 'Movies', exist_ok=True)
+    with open(workdir / 'scenario.json', 'w') as f:
+        json.dump({'manifest': scenario['manifest'], 'output_folders': output_folders, 'encode_workers': args.encode_workers}, f)
+
+    env = {key: value for key, value in os.environ.items() if key not in (
+        'ENCODE_COORDINATOR', 'COORDINATOR_PORT', 'METRICS_PORT', 'METRICS_TEXTFILE', 'TMDB_OFFLINE', 'NO_EJECT'
+    )}
+    env.update({
+        'MAKEMKV': wrappers['makemkvcon'],
+        'HANDBRAKE': wrappers['HandBrakeCLI'],
+        'FFPROBE': wrappers['ffprobe'],
+        'FFMPEG': wrappers['ffmpeg'],
+        'FAKE_DISC': str(workdir / 'disc.json'),
+        'FAKE_READ_MBPS': str(args.read_mbps),
+        'FAKE_ENCODE_SPEED': str(args.encode_speed),
+        'FAKE_SCAN_SECONDS': str(args.scan_seconds),
+        'TMDB_BASE_URL': tmdb_url,
+        'TMDB_API_KEY': 'benchmark',
+        'TMDB_CACHE_DIR': str(workdir / 'tmdb-cache'),
+        'MEDIA_DB': str(workdir / 'media-info.db'),
+        'JOB_QUEUE_DIR': str(workdir / 'jobs'),
+        'SCAN_CACHE_DIR': str(workdir / 'scan-cache'),
+        'RUN_SUMMARY_DIR': str(workdir / 'run-summaries'),
+        'LOG_DIR': str(workdir / 'logs'),
+        'STATUS_FILE': '',
+        'DISC_DRIVE': str(workdir / 'disc'),
+        'RIP_MODE': args.rip_mode,
+        'ENCODE_SEGMENTS': str(args.segments),
+        'PYTHONUNBUFFERED': '1'
+    })
+
+    stub.reset()
+    with open(workdir / 'output.log', 'w') as log:
+        process = subprocess.run([sys.executable, __file__, '--child', str(workdir)], env=env, stdout=log, stderr=subprocess.STDOUT)
+    if process.returncode != 0 or not (workdir / 'result.json').exists():
+        raise RuntimeError(f"the {name} scenario failed, see {workdir / 'output.log'}")
+    with open(workdir / 'result.json') as f:
+        result = json.load(f)
+    result['tmdb_requests'] = stub.request_counts()
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def format_megabytes(value):
+    return f"{value / 1024 / 1024:.1f} MB" if value is not None else 'n/a'
+
+def print_result(name, result, runs):
+    requests = result['tmdb_requests']
+    print(f"\n{name}: {result['wall_seconds']:.2f}s best of {runs} "
+          f"(rip {result['rip_seconds']:.2f}s, encode queue {result['encode_seconds']:.2f}s), "
+          f"{result['outputs']} MP4(s), {result['failed_jobs']} failed job(s)")
+    print(f"  peak memory {format_megabytes(result['peak_memory_bytes'])}, "
+          f"largest tool {format_megabytes(result['tools_peak_memory_bytes'])}")
+    print(f"  TMDB requests: {sum(requests.values())} "
+          f"({', '.join(f'{endpoint} {count}' for endpoint, count in sorted(requests.items())) or 'none'})")
+    print(f"  {'stage':<28} {'count':>5} {'seconds':>9} {'MB':>9}")
+    for stage, total in sorted(result['stages'].items(), key=lambda item: -item[1]['seconds']):
+        failures = f"  {total['failures']} failed" if total['failures'] else ''
+        print(f"  {stage:<28} {total['count']:>5} {total['seconds']:>9.2f} {total['bytes'] / 1024 / 1024:>9.1f}{failures}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='defaults to every scenario')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--rip-mode', choices=('iso', 'direct'), default='iso')
+    parser.add_argument('--encode-workers', type=int, default=1)
+    parser.add_argument('--segments', type=int, default=0, help='ENCODE_SEGMENTS, joined by the fake ffmpeg')
+    parser.add_argument('--size-scale', type=float, default=1.0, help='multiplies the sizes of the disc titles')
+    parser.add_argument('--read-mbps', type=float, default=200, help='speed the fake MakeMKV writes at')
+    parser.add_argument('--encode-speed', type=float, default=1200, help='fake HandBrake speed, as a multiple of real time')
+    parser.add_argument('--scan-seconds', type=float, default=0.5, help='time the fake MakeMKV takes to scan a disc')
+    parser.add_argument('--tmdb-latency-ms', type=float, default=0)
+    parser.add_argument('--dir', default=None, help='folder to run the scenarios in (defaults to the temp folder)')
+    parser.add_argument('--keep', action='store_true', help='keep the folder of each run, with its logs and outputs')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child)
+
+    stub = TMDBStub(latency=args.tmdb_latency_ms / 1000)
+    tmdb_url = stub.start()
+    base_dir = tempfile.mkdtemp(prefix='bench-pipeline-', dir=args.dir)
+    try:
+        wrappers = {
+            name: write_wrapper(Path(base_dir), name, BENCH_DIR / script)
+            for name, script in (('makemkvcon', 'fake_makemkvcon.py'), ('HandBrakeCLI', 'fake_handbrake.py'), ('ffprobe', 'fake_ffprobe.py'), ('ffmpeg', 'fake_ffmpeg.py'))
+        }
+        results = {}
+        for name in args.scenario or sorted(SCENARIOS):
+            print(f"Running {name} {args.runs} time(s)...")
+            runs = [run_scenario(name, args, stub, tmdb_url, wrappers, base_dir) for _ in range(args.runs)]
+            results[name] = min(runs, key=lambda result: result['wall_seconds'])
+            results[name]['runs'] = [result['wall_seconds'] for result in runs]
+            print_result(name, results[name], args.runs)
+    finally:
+        stub.stop()
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
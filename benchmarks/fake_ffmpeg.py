@@ -0,0 +1,37 @@
+import os
+import sys
+from fake_media import write_fake_video, read_fake_duration
+
+# Stands in for ffmpeg, selected with the FFMPEG environment variable, for the joins in segmented_encode.py.
+# Only the concat demuxer is supported: the output is a fake video as long as the listed files put together.
+
+def argument(argv, name):
+    return argv[argv.index(name) + 1] if name in argv else None
+
+def read_list(list_file):
+    paths = []
+    with open(list_file) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("file '") and line.endswith("'"):
+                paths.append(line[len("file '"):-1].replace("'\\''", "'"))
+    return paths
+
+def main(argv):
+    if argument(argv, '-f') != 'concat':
+        print("Only '-f concat' is supported", file=sys.stderr)
+        return 1
+    duration = 0
+    size_bytes = 0
+    for path in read_list(argument(argv, '-i')):
+        segment_duration = read_fake_duration(path)
+        if segment_duration is None:
+            print(f"{path}: Invalid data found when processing input", file=sys.stderr)
+            return 1
+        duration += segment_duration
+        size_bytes += os.path.getsize(path)
+    write_fake_video(argv[-1], duration, size_bytes, 1000)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
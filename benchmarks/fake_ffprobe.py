@@ -0,0 +1,22 @@
+import sys
+import json
+from fake_media import read_fake_duration
+
+# Stands in for ffprobe, selected with the FFPROBE environment variable, for the output checks in job_journal.py.
+
+def main(argv):
+    duration = read_fake_duration(argv[-1])
+    if duration is None:
+        print(f"{argv[-1]}: Invalid data found when processing input", file=sys.stderr)
+        return 1
+    print(json.dumps({
+        'streams': [
+            {'codec_type': 'video', 'duration': str(duration)},
+            {'codec_type': 'audio', 'duration': str(duration)}
+        ],
+        'format': {'duration': str(duration)}
+    }))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import time
+from fake_media import load_layout, write_fake_video, read_fake_duration
+
+# Stands in for HandBrakeCLI, selected with the HANDBRAKE environment variable.
+# Encodes run at FAKE_ENCODE_SPEED times real time (e.g. 600 encodes an hour of video in 6 seconds) and the
+# output is FAKE_ENCODE_RATIO times the size of the input. Progress is printed in the --json format.
+
+ENCODE_SPEED = float(os.getenv('FAKE_ENCODE_SPEED', 1200))
+ENCODE_RATIO = float(os.getenv('FAKE_ENCODE_RATIO', 0.25))
+FPS = 25
+
+def argument(argv, name, default=None):
+    return argv[argv.index(name) + 1] if name in argv else default
+
+def source_title(argv):
+    """
+    :return: The (duration, size in bytes, chapter count) of the title being encoded.
+    """
+    input_file = argument(argv, '-i')
+    duration = read_fake_duration(input_file) if os.path.isfile(input_file) else None
+    if duration is not None:
+        return duration, os.path.getsize(input_file), 1
+    # An image, the title is read from the disc layout (HandBrake titles start at 1)
+    title = load_layout()['titles'][int(argument(argv, '--title', 1)) - 1]
+    return title['duration'], title['size_mb'] * 1024 * 1024, title.get('chapters', 1)
+
+def scan(argv):
+    duration, _, chapter_count = source_title(argv)
+    chapter = duration // max(chapter_count, 1)
+    chapters = [{'Duration': {'Hours': chapter // 3600, 'Minutes': (chapter // 60) % 60, 'Seconds': chapter % 60}}] * chapter_count
+    print('JSON Title Set: ' + json.dumps({'TitleList': [{'ChapterList': chapters}]}, indent=4))
+
+def encode(argv):
+    duration, size_bytes, chapter_count = source_title(argv)
+    chapters = argument(argv, '--chapters')
+    if chapters:
+        first, last = (int(chapter) for chapter in chapters.split('-'))
+        duration = duration * (last - first + 1) // max(chapter_count, 1)
+        size_bytes = size_bytes * (last - first + 1) // max(chapter_count, 1)
+
+    output_size = int(size_bytes * ENCODE_RATIO)
+    encode_seconds = duration / ENCODE_SPEED
+    started = time.perf_counter()
+    print('Version: {\n    "Name": "HandBrake",\n    "Official": true\n}', flush=True)
+
+    def progress(written, total):
+        fraction = written / total
+        elapsed = time.perf_counter() - started
+        print('Progress: ' + json.dumps({
+            'State': 'WORKING',
+            'Working': {
+                'ETASeconds': int(encode_seconds * (1 - fraction)),
+                'Pass': 1,
+                'PassCount': 1,
+                'Progress': fraction,
+                'Rate': duration * FPS / encode_seconds,
+                'RateAvg': duration * FPS * fraction / elapsed if elapsed else 0.0
+            }
+        }, indent=4), flush=True)
+
+    write_fake_video(argument(argv, '-o'), duration, output_size, output_size / 1_000_000 / max(encode_seconds, 0.001), progress)
+    print('Progress: ' + json.dumps({'State': 'MUXING'}, indent=4), flush=True)
+
+def main(argv):
+    if '--scan' in argv:
+        scan(argv)
+    else:
+        encode(argv)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
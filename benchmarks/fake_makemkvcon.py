@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+from fake_media import load_layout, format_duration, write_fake_video
+
+# Stands in for makemkvcon, selected with the MAKEMKV environment variable. Supports the commands auto-rip.py uses:
+#   --robot info disc:9999                       lists the drives
+#   info <source> --robot                        prints the titles of the disc in FAKE_DISC
+#   mkv <source> <title> <folder> ...            writes title_tNN.mkv
+#   backup disc:<n> <folder> ...                 writes a VIDEO_TS folder
+# FAKE_READ_MBPS sets how quickly files are written and FAKE_SCAN_SECONDS how long a scan takes.
+# FAKE_DRIVES is a comma separated list of the devices in the drive list, e.g. temporary folders standing in for
+# the mount points of several drives.
+
+READ_MBPS = float(os.getenv('FAKE_READ_MBPS', 200))
+SCAN_SECONDS = float(os.getenv('FAKE_SCAN_SECONDS', 0.5))
+DRIVES = [device for device in os.getenv('FAKE_DRIVES', '/dev/sr0').split(',') if device]
+
+def robot_progress(operation):
+    print(f'PRGC:5018,0,"{operation}"', flush=True)
+    print(f'PRGT:5018,0,"{operation}"', flush=True)
+    last = [-1]
+
+    def progress(written, total):
+        value = written * 65536 // total
+        # MakeMKV prints progress a few hundred times per operation, not once per block
+        if value - last[0] >= 512 or written == total:
+            last[0] = value
+            print(f"PRGV:{value},{value},65536", flush=True)
+    return progress
+
+def drive_list():
+    layout = load_layout()
+    for index, device in enumerate(DRIVES):
+        print(f'DRV:{index},2,999,1,"BD-RE FAKE DRIVE {index}","{layout.get("volume_name", "")}","{device}"')
+    # MakeMKV always lists 16 indexes, the ones without a drive are empty
+    for index in range(len(DRIVES), 16):
+        print(f'DRV:{index},256,999,0,"","",""')
+
+def info():
+    layout = load_layout()
+    time.sleep(SCAN_SECONDS)
+    print('MSG:1005,0,1,"MakeMKV v1.17.5 linux(x64-release) started","%1 started","MakeMKV v1.17.5 linux(x64-release)"')
+    print(f'TCOUNT:{len(layout["titles"])}')
+    print(f'CINFO:1,6209,"DVD disc"')
+    print(f'CINFO:2,0,"{layout["name"]}"')
+    print(f'CINFO:32,0,"{layout.get("volume_name", "")}"')
+    for title_id, title in enumerate(layout['titles']):
+        size_bytes = title['size_mb'] * 1024 * 1024
+        print(f'TINFO:{title_id},2,0,"{layout["name"]}"')
+        print(f'TINFO:{title_id},8,0,"{title.get("chapters", 1)}"')
+        print(f'TINFO:{title_id},9,0,"{format_duration(title["duration"])}"')
+        print(f'TINFO:{title_id},10,0,"{size_bytes / 1024 ** 3:.1f} GB"')
+        print(f'TINFO:{title_id},11,0,"{size_bytes}"')
+        print(f'TINFO:{title_id},16,0,"{title_id + 1}.pgc"')
+        print(f'TINFO:{title_id},27,0,"title_t{title_id:02d}.mkv"')
+        print(f'SINFO:{title_id},0,1,6201,"Video"')
+        print(f'SINFO:{title_id},0,6,0,"Mpeg2"')
+        print(f'SINFO:{title_id},1,1,6202,"Audio"')
+        print(f'SINFO:{title_id},1,3,0,"eng"')
+        print(f'SINFO:{title_id},1,4,0,"English"')
+        print(f'SINFO:{title_id},1,6,0,"AC3"')
+        print(f'SINFO:{title_id},2,1,6203,"Subtitles"')
+        print(f'SINFO:{title_id},2,3,0,"eng"')
+    print(f'MSG:5011,0,0,"Operation successfully completed","Operation successfully completed"')
+
+def mkv(title_id, output_folder):
+    layout = load_layout()
+    title = layout['titles'][title_id]
+    os.makedirs(output_folder, exist_ok=True)
+    print(f'MSG:5014,0,1,"Saving 1 titles into directory {output_folder}","Saving %1 titles into directory %2","1","{output_folder}"', flush=True)
+    write_fake_video(
+        os.path.join(output_folder, f"title_t{title_id:02d}.mkv"), title['duration'],
+        title['size_mb'] * 1024 * 1024, READ_MBPS, robot_progress('Saving to MKV file')
+    )
+    print('MSG:5036,0,1,"Copy complete. 1 titles saved.","Copy complete. %1 titles saved.","1"', flush=True)
+
+def backup(output_folder):
+    layout = load_layout()
+    video_ts = os.path.join(output_folder, 'VIDEO_TS')
+    os.makedirs(video_ts, exist_ok=True)
+    for name in ('VIDEO_TS.IFO', 'VIDEO_TS.BUP'):
+        with open(os.path.join(video_ts, name), 'w') as f:
+            f.write(layout['name'])
+    # One VOB holding every title, the fake HandBrake reads the titles from FAKE_DISC
+    total_mb = sum(title['size_mb'] for title in layout['titles'])
+    duration = sum(title['duration'] for title in layout['titles'])
+    write_fake_video(os.path.join(video_ts, 'VTS_01_1.VOB'), duration, total_mb * 1024 * 1024, READ_MBPS, robot_progress('Backing up disc'))
+    print('MSG:5085,0,0,"Backup done","Backup done"', flush=True)
+
+def main(argv):
+    args = [arg for arg in argv if not arg.startswith('-')]
+    if args[:2] == ['info', 'disc:9999']:
+        drive_list()
+    elif args[0] == 'info':
+        info()
+    elif args[0] == 'mkv':
+        mkv(int(args[2]), args[3])
+    elif args[0] == 'backup':
+        backup(args[2])
+    else:
+        print(f"Unsupported command: {' '.join(argv)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,54 @@
+import os
+import json
+import time
+
+# Shared by the fake makemkvcon, HandBrakeCLI and ffprobe used by bench_pipeline.py.
+# The disc is described by a JSON layout file in FAKE_DISC:
+#   {"name": "Inception", "volume_name": "INCEPTION", "titles": [{"duration": 8880, "chapters": 28, "size_mb": 64}, ...]}
+# Fake videos start with a header line holding their duration, so the fake ffprobe can report it and the
+# output checks in job_journal.py pass, followed by padding up to the requested size.
+
+HEADER_PREFIX = b'FAKEVIDEO duration='
+BLOCK_SIZE = 1024 * 1024
+
+def load_layout():
+    with open(os.environ['FAKE_DISC']) as f:
+        return json.load(f)
+
+def format_duration(seconds):
+    return f"{seconds // 3600}:{(seconds // 60) % 60:02d}:{seconds % 60:02d}"
+
+def write_fake_video(path, duration, size_bytes, mb_per_s, progress=None):
+    """
+    Writes a fake video at mb_per_s, calling progress(written, total) after every block.
+    """
+    header = HEADER_PREFIX + str(duration).encode() + b'\n'
+    block = os.urandom(BLOCK_SIZE)
+    size_bytes = max(size_bytes, len(header))
+    started = time.perf_counter()
+    with open(path, 'wb') as f:
+        f.write(header)
+        written = len(header)
+        while written < size_bytes:
+            chunk = block[:min(BLOCK_SIZE, size_bytes - written)]
+            f.write(chunk)
+            written += len(chunk)
+            if progress:
+                progress(written, size_bytes)
+            # Sleeps until the time the write would have taken at the requested speed
+            delay = written / (mb_per_s * 1_000_000) - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+def read_fake_duration(path):
+    """
+    :return: The duration of a fake video in seconds, or None if it is not one.
+    """
+    try:
+        with open(path, 'rb') as f:
+            line = f.readline(64)
+    except OSError:
+        return None
+    if not line.startswith(HEADER_PREFIX):
+        return None
+    return int(line[len(HEADER_PREFIX):].strip())
@@ -0,0 +1,224 @@
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A local stand-in for the TMDB API, serving the media info in test-movie.json and test-tvshow.json.
+# The stored media info is turned back into the responses get_media_info.py parses, so a benchmark needs neither a
+# network connection nor an API key. Point TMDB_BASE_URL at http://127.0.0.1:<port> to use it.
+# Usage: python benchmarks/tmdb_stub.py [--port 8760] [--latency-ms 50]
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = (ROOT / 'test-movie.json', ROOT / 'test-tvshow.json')
+IMAGE_PREFIX = 'https://image.tmdb.org/t/p/w500'
+# The fixtures were stored before episode runtimes were kept, episodes without one are given this many minutes
+DEFAULT_EPISODE_RUNTIME = 60
+
+def image_path(url):
+    return url[len(IMAGE_PREFIX):] if url and url.startswith(IMAGE_PREFIX) else url
+
+def person(member):
+    return {
+        'name': member['name'],
+        'original_name': member['original_name'],
+        'id': member['tmdb_id'],
+        'profile_path': image_path(member['profile_path']),
+        'gender': member['gender'],
+        'credit_id': member['tmdb_credit_id']
+    }
+
+def credit(member):
+    return dict(person(member), character=member['character_name'], order=member['credit_order'])
+
+def director_crew(director):
+    return [dict(person(director), job='Director')] if director else []
+
+def movie_response(movie):
+    return {
+        'original_title': movie['title'],
+        'id': movie['tmdb_id'],
+        'imdb_id': movie['imdb_id'],
+        'genres': [{'name': genre} for genre in movie['genres']],
+        'release_date': movie['release_date'],
+        'overview': movie['overview'],
+        'poster_path': image_path(movie['poster_path']),
+        'backdrop_path': image_path(movie['backdrop_path']),
+        'vote_average': movie['rating'],
+        'runtime': movie['runtime'],
+        'credits': {
+            'crew': director_crew(movie['director']),
+            'cast': [dict(credit(member), cast_id=member['tmdb_cast_id']) for member in movie['cast']]
+        }
+    }
+
+def tv_seasons(tv_show):
+    seasons = list(tv_show['seasons'])
+    if tv_show['specials']:
+        seasons.insert(0, tv_show['specials'])
+    return seasons
+
+def tv_response(tv_show):
+    return {
+        'original_name': tv_show['title'],
+        'id': tv_show['tmdb_id'],
+        'genres': [{'name': genre} for genre in tv_show['genres']],
+        'first_air_date': tv_show['release_date'],
+        'overview': tv_show['overview'],
+        'poster_path': image_path(tv_show['poster_path']),
+        'backdrop_path': image_path(tv_show['backdrop_path']),
+        'vote_average': tv_show['rating'],
+        'number_of_seasons': tv_show['number_of_seasons'],
+        'number_of_episodes': tv_show['number_of_episodes'],
+        'seasons': [{
+            'season_number': season['season_number'],
+            'air_date': season['air_date'],
+            'overview': season['overview'],
+            'poster_path': image_path(season['poster_path']),
+            'id': season['season_id'],
+            'name': season['title'],
+            'vote_average': season['rating'],
+            'episode_count': len(season['episodes'])
+        } for season in tv_seasons(tv_show)],
+        'credits': {'crew': [], 'cast': []}
+    }
+
+def season_response(season, episode_runtime):
+    return {
+        'episodes': [{
+            'episode_number': episode['episode_number'],
+            'air_date': episode['air_date'],
+            'overview': episode['overview'],
+            'still_path': image_path(episode['still_path']),
+            'id': episode['tmdb_id'],
+            'runtime': episode.get('runtime') or episode_runtime,
+            'name': episode.get('episode_name', episode.get('name')),
+            'vote_average': episode['rating'],
+            'crew': director_crew(episode['director']),
+            'guest_stars': [credit(member) for member in episode['guest_stars']]
+        } for episode in season['episodes']]
+    }
+
+class TMDBStub:
+    """
+    Serves the fixtures from a background thread and counts the requests made to each endpoint.
+    """
+
+    def __init__(self, fixtures=FIXTURES, latency=0.0, episode_runtime=DEFAULT_EPISODE_RUNTIME):
+        """
+        :param latency: Seconds added to every response, to stand in for the round trip to TMDB.
+        """
+        self.latency = latency
+        self.episode_runtime = episode_runtime
+        self.movies = []
+        self.tv_shows = []
+        for fixture in fixtures:
+            with open(fixture) as f:
+                for media_info in json.load(f):
+                    (self.tv_shows if 'seasons' in media_info else self.movies).append(media_info)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.max_in_flight = 0
+
+    def request_counts(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def peak_concurrency(self):
+        """
+        :return: The most requests that were being answered at once since the last reset.
+        """
+        with self.lock:
+            return self.max_in_flight
+
+    def respond(self, path, query):
+        """
+        :return: The (endpoint, response) of a request, the response is None if nothing matches.
+        """
+        def search(items):
+            name = query.get('query', [''])[0].strip().lower()
+            return {'results': [{'id': item['tmdb_id']} for item in items if item['title'].lower() == name]}
+
+        if path == '/search/movie':
+            return 'search/movie', search(self.movies)
+        if path == '/search/tv':
+            return 'search/tv', search(self.tv_shows)
+        if match := re.fullmatch(r'/movie/(\d+)', path):
+            movie = next((movie for movie in self.movies if movie['tmdb_id'] == int(match[1])), None)
+            return 'movie', movie_response(movie) if movie else None
+        if match := re.fullmatch(r'/tv/(\d+)', path):
+            tv_show = next((tv_show for tv_show in self.tv_shows if tv_show['tmdb_id'] == int(match[1])), None)
+            return 'tv', tv_response(tv_show) if tv_show else None
+        if match := re.fullmatch(r'/tv/(\d+)/season/(\d+)', path):
+            tv_show = next((tv_show for tv_show in self.tv_shows if tv_show['tmdb_id'] == int(match[1])), None)
+            season = next((season for season in tv_seasons(tv_show) if season['season_number'] == int(match[2])), None) if tv_show else None
+            return 'tv/season', season_response(season, self.episode_runtime) if season else None
+        return 'unknown', None
+
+    def start(self, port=0, host='127.0.0.1'):
+        """
+        :return: The base URL of the stub, for TMDB_BASE_URL.
+        """
+        stub = self
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                endpoint, response = stub.respond(url.path, parse_qs(url.query))
+                with stub.lock:
+                    stub.counts[endpoint] = stub.counts.get(endpoint, 0) + 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+                data = json.dumps(response if response is not None else {'success': False, 'status_code': 34}).encode()
+                self.send_response(200 if response is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), StubHandler)
+        threading.Thread(target=self.server.serve_forever, name='tmdb-stub', daemon=True).start()
+        return f"http://{host}:{self.server.server_port}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves the test fixtures in place of the TMDB API.')
+    parser.add_argument('--port', type=int, default=8760)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    stub = TMDBStub(latency=args.latency_ms / 1000)
+    print(f"TMDB stub listening on {stub.start(args.port)}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"Requests: {stub.request_counts()}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
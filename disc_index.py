@@ -0,0 +1,154 @@
+import sys
+import json
+import time
+import ctypes
+import hashlib
+from pathlib import Path
+from contextlib import closing
+from media_store import MEDIA_DB, connect
+
+# Remembers every disc that has been ripped, so a disc that is inserted again (e.g. to re-rip after a failed
+# encode, or a second copy of the same disc) is ripped without asking the user anything, looking anything up
+# on TMDB or scanning it with MakeMKV. Discs are identified by a fingerprint of their volume label and the
+# navigation files (IFO/BUP on DVDs, index/MovieObject/playlists on Blu-rays), which differ between releases.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS discs (
+    fingerprint TEXT PRIMARY KEY,
+    volume_name TEXT NOT NULL,
+    record TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# The navigation files that are hashed, relative to the root of the disc
+NAVIGATION_PATTERNS = ('VIDEO_TS/*.IFO', 'VIDEO_TS/*.BUP', 'BDMV/index.bdmv', 'BDMV/MovieObject.bdmv', 'BDMV/PLAYLIST/*.mpls')
+
+# Unmounted discs (e.g. /dev/sr0) and images are read directly. The file system structures, including the
+# directory entries and sizes of the navigation files, are at the start of the disc after the volume descriptors
+SECTOR_SIZE = 2048
+VOLUME_DESCRIPTOR_OFFSET = 16 * SECTOR_SIZE
+FINGERPRINT_BYTES = 4 * 1024 * 1024
+
+def read_volume_name(path):
+    """
+    Reads the volume label of a disc or image.
+
+    :param path: A drive root (e.g. 'E:\\'), mount point, device (e.g. '/dev/sr0') or image file.
+    :return: The volume label, or '' if it could not be read.
+    """
+    if Path(path).is_dir():
+        if sys.platform == 'win32':
+            name = ctypes.create_unicode_buffer(261)
+            if ctypes.windll.kernel32.GetVolumeInformationW(str(path), name, len(name), None, None, None, None, 0):
+                return name.value
+            return ''
+        # Linux desktops mount discs at a folder named after the label, e.g. /media/user/BAND_OF_BROTHERS_D1
+        return Path(path).resolve().name
+    try:
+        with open(path, 'rb') as f:
+            f.seek(VOLUME_DESCRIPTOR_OFFSET)
+            descriptor = f.read(SECTOR_SIZE)
+    except OSError:
+        return ''
+    # The ISO 9660 primary volume descriptor, DVDs include one alongside UDF
+    if descriptor[0:1] != b'\x01' or descriptor[1:6] != b'CD001':
+        return ''
+    return descriptor[40:72].decode('ascii', errors='replace').strip()
+
+def disc_fingerprint(path):
+    """
+    :param path: A drive root (e.g. 'E:\\'), mount point, device (e.g. '/dev/sr0') or image file.
+    :return: A hex string identifying the disc, or None if it could not be read.
+    """
+    path = Path(path)
+    digest = hashlib.sha256()
+    digest.update(read_volume_name(path).encode())
+    try:
+        if path.is_dir():
+            files = sorted({file_path for pattern in NAVIGATION_PATTERNS for file_path in path.glob(pattern)})
+            if not files:
+                return None
+            for file_path in files:
+                digest.update(f"{file_path.relative_to(path).as_posix()}:{file_path.stat().st_size}".encode())
+                digest.update(file_path.read_bytes())
+        else:
+            with open(path, 'rb') as f:
+                f.seek(VOLUME_DESCRIPTOR_OFFSET)
+                data = f.read(FINGERPRINT_BYTES)
+            if not data.strip(b'\x00'):
+                return None
+            digest.update(data)
+    except OSError as e:
+        print(f"Error: could not read {path} to identify the disc: {e}")
+        return None
+    return digest.hexdigest()
+
+class DiscIndex:
+    def __init__(self, db_file=MEDIA_DB):
+        """
+        :param db_file: The SQLite database, shared with MediaStore.
+        """
+        self.db_file = db_file
+        with closing(connect(self.db_file)) as conn:
+            conn.executescript(SCHEMA)
+
+    def get(self, fingerprint):
+        """
+        :return: The record stored for the disc, or None if the disc has not been ripped before.
+        """
+        with closing(connect(self.db_file)) as conn:
+            row = conn.execute('SELECT record FROM discs WHERE fingerprint = ?', (fingerprint,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, fingerprint, volume_name, record):
+        """
+        Stores what is known about a disc, replacing anything stored before.
+
+        :param record: A JSON serialisable dict, e.g. the answers the user gave and the titles that were matched.
+        """
+        with closing(connect(self.db_file)) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO discs (fingerprint, volume_name, record, updated) VALUES (?, ?, ?, ?)',
+                (fingerprint, volume_name, json.dumps(record), time.time())
+            )
+
+    def update(self, fingerprint, **values):
+        """
+        Adds values to the record of a disc that is already stored.
+
+        :return: False if the disc is not stored.
+        """
+        with closing(connect(self.db_file)) as conn, conn:
+            row = conn.execute('SELECT record FROM discs WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            if row is None:
+                return False
+            record = json.loads(row[0])
+            record.update(values)
+            conn.execute(
+                'UPDATE discs SET record = ?, updated = ? WHERE fingerprint = ?',
+                (json.dumps(record), time.time(), fingerprint)
+            )
+        return True
+
+    def remove(self, fingerprint):
+        with closing(connect(self.db_file)) as conn, conn:
+            return conn.execute('DELETE FROM discs WHERE fingerprint = ?', (fingerprint,)).rowcount > 0
+
+    def list(self):
+        """
+        :return: A list of (fingerprint, volume_name, record) tuples, most recently updated first.
+        """
+        with closing(connect(self.db_file)) as conn:
+            rows = conn.execute('SELECT fingerprint, volume_name, record FROM discs ORDER BY updated DESC').fetchall()
+        return [(fingerprint, volume_name, json.loads(record)) for fingerprint, volume_name, record in rows]
+
+if __name__ == '__main__':
+    # Usage: python disc_index.py                    lists the known discs
+    #        python disc_index.py remove <fingerprint> forgets a disc, so the user is asked about it next time
+    index = DiscIndex()
+    if len(sys.argv) > 2 and sys.argv[1] == 'remove':
+        print('Removed' if index.remove(sys.argv[2]) else 'Not found')
+    else:
+        for fingerprint, volume_name, record in index.list():
+            print(f"{fingerprint[:16]}  {volume_name or '-':<32} {record.get('iso_name', '')}")
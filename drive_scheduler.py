@@ -0,0 +1,211 @@
+import os
+import re
+import sys
+import csv
+import threading
+import subprocess
+from pathlib import Path
+from drive_watcher import watch_drive, disc_present, device_has_disc
+
+# Runs one independent ripping worker per optical drive, so several discs can be ripped at once.
+
+# MakeMKV reports this drive state for indexes that do not have a drive attached
+DRIVE_STATE_NO_DRIVE = 256
+
+# The router installed by run_drive_workers, None while only a single drive is in use
+active_router = None
+
+def parse_drive_lines(makemkv_info):
+    """
+    Parses the DRV lines of 'makemkvcon --robot info' output.
+
+    The format of a DRV line is: DRV:index,state,enabled,flags,"drive name","disc name","device"
+
+    :param makemkv_info: The robot output from MakeMKV.
+    :return: A list of dicts, one per attached drive.
+    """
+    drives = []
+    for line in makemkv_info.splitlines():
+        if not line.startswith('DRV:'):
+            continue
+        fields = next(csv.reader([line[4:]]))
+        if len(fields) < 7:
+            continue
+        state = int(fields[1])
+        device = fields[6]
+        if state == DRIVE_STATE_NO_DRIVE or not device:
+            continue
+        drives.append({
+            'index': int(fields[0]),
+            'state': state,
+            'drive_name': fields[4],
+            'disc_name': fields[5],
+            'device': device
+        })
+    return drives
+
+def discover_drives(makemkv_cli_path=os.getenv('MAKEMKV', "C:\\Program Files (x86)\\MakeMKV\\makemkvcon")):
+    """
+    Lists every optical drive MakeMKV can see. disc:9999 does not exist, so MakeMKV only prints the
+    drive list and exits without scanning any disc.
+
+    :param makemkv_cli_path: Path to makemkvcon.
+    :return: A list of drive dicts, see parse_drive_lines.
+    """
+    info_command = [
+        makemkv_cli_path,
+        '--robot',
+        'info',
+        'disc:9999'
+    ]
+
+    try:
+        drive_info = subprocess.run(info_command, text=True, capture_output=True)
+        return parse_drive_lines(drive_info.stdout)
+    except FileNotFoundError:
+        print("Error: MakeMKV not found. Please check the path to MakeMKV.")
+        return []
+
+def drive_watch_path(device):
+    """
+    Returns the path to watch for disc insertions, for a MakeMKV device name.
+
+    :param device: The device name from a DRV line, e.g. 'E:' or '/dev/sr0'.
+    """
+    if re.match(r'^[A-Za-z]:$', device):
+        return device + '\\'
+    return device
+
+def drive_detector(watch_path):
+    """
+    Returns the detection function to use for a watch path, device nodes are queried directly
+    as they may never be mounted.
+    """
+    if watch_path.startswith('/dev/'):
+        return device_has_disc
+    return disc_present
+
+class DriveLogRouter:
+    """
+    Replacement for sys.stdout, which prefixes console output with the drive it came from and
+    copies it to a log file per drive. Output from threads that are not drive workers is
+    passed through unchanged.
+    """
+
+    def __init__(self, console, log_dir):
+        self.console = console
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.log_files = {}
+
+    def set_drive(self, drive_index):
+        """
+        Routes all output from the calling thread (and threads that inherit the setting via
+        bind_drive) to the log of the given drive.
+        """
+        self.local.drive_index = drive_index
+        self.local.pending = ''
+        with self.lock:
+            if drive_index not in self.log_files:
+                log_path = self.log_dir / f"drive-{drive_index}.log"
+                self.log_files[drive_index] = open(log_path, 'a', buffering=1)
+
+    def current_drive(self):
+        return getattr(self.local, 'drive_index', None)
+
+    def bind_drive(self, target):
+        """
+        Wraps a thread target so it logs to the same drive as the thread that created it.
+        """
+        drive_index = self.current_drive()
+        if drive_index is None:
+            return target
+
+        def bound(*args, **kwargs):
+            self.set_drive(drive_index)
+            return target(*args, **kwargs)
+        return bound
+
+    def write(self, text):
+        drive_index = self.current_drive()
+        if drive_index is None:
+            with self.lock:
+                return self.console.write(text)
+
+        # Buffers partial lines, so the prefix is only added at the start of a line
+        pending = self.local.pending + text
+        lines = pending.split('\n')
+        self.local.pending = lines.pop()
+        with self.lock:
+            for line in lines:
+                self.console.write(f"[drive {drive_index}] {line}\n")
+                self.log_files[drive_index].write(line + '\n')
+            # Prompts do not end with a newline, they still need to be shown straight away
+            if self.local.pending.endswith(': '):
+                self.console.write(f"[drive {drive_index}] {self.local.pending}")
+                self.log_files[drive_index].write(self.local.pending + '\n')
+                self.local.pending = ''
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self.console.flush()
+            for log_file in self.log_files.values():
+                log_file.flush()
+
+    def close(self):
+        with self.lock:
+            for log_file in self.log_files.values():
+                log_file.close()
+            self.log_files.clear()
+
+    def __getattr__(self, name):
+        return getattr(self.console, name)
+
+def bind_drive(target):
+    """
+    Wraps a thread target so its output goes to the log of the drive the calling thread belongs to.
+    Returns target unchanged when the drive workers are not running.
+    """
+    if active_router is None:
+        return target
+    return active_router.bind_drive(target)
+
+def run_drive_workers(drives, worker, log_dir=os.getenv('LOG_DIR', 'logs'), stop_event=None):
+    """
+    Starts one thread per drive, each thread waits for disc insertions in its drive and calls
+    worker(drive) once per disc. Blocks until every worker has stopped.
+
+    :param drives: A list of drive dicts, as returned by discover_drives.
+    :param worker: Function called with the drive dict each time a disc is inserted.
+    :param log_dir: The folder for the per drive log files.
+    :param stop_event: Optional threading.Event, used to stop all workers.
+    """
+    global active_router
+    router = DriveLogRouter(sys.stdout, log_dir)
+    active_router = router
+    sys.stdout = router
+
+    def drive_loop(drive):
+        router.set_drive(drive['index'])
+        watch_path = drive_watch_path(drive['device'])
+        print(f"Watching {drive['drive_name']} ({drive['device']}) for discs.")
+        for _ in watch_drive(watch_path, stop_event=stop_event, detect=drive_detector(watch_path)):
+            try:
+                worker(drive)
+            except Exception as e:
+                # A failure on one disc must not stop the drive from processing the next one
+                print(f"Error: ripping failed on drive {drive['index']}: {e}")
+
+    threads = [threading.Thread(target=drive_loop, args=(drive,), name=f"drive-{drive['index']}") for drive in drives]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.stdout = router.console
+        active_router = None
+        router.close()
@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Watches a disc drive mount point and yields once per disc insertion.
+# On Linux the watcher sleeps on kernel events (inotify on the mount point and its parent, plus
+# /proc/self/mountinfo which becomes readable whenever the mount table changes), so an idle
+# machine does not spin a core. Other platforms fall back to polling with exponential backoff.
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_NONBLOCK = 0x00000800
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT)
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+
+# linux/cdrom.h
+CDROM_DRIVE_STATUS = 0x5326
+CDSL_CURRENT = 0x7fffffff
+CDS_DISC_OK = 4
+
+# The longest the watcher sleeps on kernel events without checking whether it has been stopped
+STOP_CHECK_INTERVAL = 1.0
+
+def disc_present(drive_path):
+    """
+    Checks if a disc is mounted at the specified drive path.
+
+    On Windows the drive letter only exists while a disc is inserted, on Linux the mount point
+    usually exists all the time and is only populated while a disc is mounted.
+
+    :param drive_path: The path to the disc drive or mount point.
+    :return: True if a disc is present, False otherwise.
+    """
+    try:
+        with os.scandir(drive_path) as entries:
+            return any(True for _ in entries)
+    except OSError:
+        return False
+
+def device_has_disc(device_path):
+    """
+    Checks if a disc is loaded in an optical drive device node (e.g. /dev/sr0) on Linux, this works
+    even if the disc has not been mounted.
+
+    :param device_path: The path to the device node.
+    :return: True if the drive reports a disc, False otherwise.
+    """
+    if fcntl is None:
+        return False
+    try:
+        fd = os.open(device_path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return False
+    try:
+        return fcntl.ioctl(fd, CDROM_DRIVE_STATUS, CDSL_CURRENT) == CDS_DISC_OK
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+class _KernelEvents:
+    """
+    Waits on inotify and mount table events for a drive path. Watches are re-armed after each
+    wake up, as the mount point itself may be created or removed.
+    """
+
+    def __init__(self, drive_path, libc):
+        self.drive_path = os.path.abspath(drive_path)
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+        self.mountinfo = None
+        try:
+            self.mountinfo = open(MOUNTINFO_PATH, 'rb')
+            self.poller.register(self.mountinfo, select.POLLPRI | select.POLLERR)
+            # The first read arms the mount table notification
+            self.mountinfo.read()
+        except OSError:
+            self.mountinfo = None
+        self._rearm()
+
+    def _rearm(self):
+        # Adding a watch for an already watched path is a no-op, watches for removed directories
+        # are dropped by the kernel, so they never need to be removed here
+        for path in (self.drive_path, os.path.dirname(self.drive_path)):
+            if os.path.isdir(path):
+                self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+
+    def wait(self, timeout):
+        """
+        Blocks until a kernel event arrives or the timeout (in seconds) expires.
+
+        :return: True if woken by an event, False on timeout.
+        """
+        events = self.poller.poll(None if timeout is None else timeout * 1000)
+        woken = False
+        for fd, _ in events:
+            woken = True
+            if fd == self.fd:
+                self._drain()
+            elif self.mountinfo is not None:
+                self.mountinfo.seek(0)
+                self.mountinfo.read()
+        if woken:
+            self._rearm()
+        return woken
+
+    def _drain(self):
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        if self.mountinfo is not None:
+            self.mountinfo.close()
+        os.close(self.fd)
+
+def _wait_for_event(events, interval, stop_event):
+    """
+    Waits up to interval seconds for a kernel event, in steps of at most STOP_CHECK_INTERVAL when there is a
+    stop_event, so a long backoff does not delay shutting down.
+
+    :return: True if woken by an event, False on timeout or once stop_event is set.
+    """
+    if stop_event is None:
+        return events.wait(interval)
+    deadline = time.monotonic() + interval
+    while not stop_event.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if events.wait(min(remaining, STOP_CHECK_INTERVAL)):
+            return True
+    return False
+
+def _wait_for_state(drive_path, wanted, detect, events, min_interval, max_interval, stop_event):
+    """
+    Waits until detect(drive_path) equals wanted. Kernel events wake the loop immediately,
+    the interval between rechecks doubles up to max_interval, as some drives (e.g. Windows drive
+    letters, automounters) do not produce any events the watcher can see.
+    """
+    interval = min_interval
+    while detect(drive_path) != wanted:
+        if stop_event is not None and stop_event.is_set():
+            return False
+        if events is not None:
+            if _wait_for_event(events, interval, stop_event):
+                interval = min_interval
+                continue
+        elif stop_event is not None:
+            stop_event.wait(interval)
+        else:
+            time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+    return True
+
+def watch_drive(drive_path, min_interval=0.5, max_interval=30, settle_time=2, stop_event=None, detect=disc_present):
+    """
+    Yields drive_path once for every disc insertion.
+
+    After a disc has been yielded, the watcher waits for it to be removed before reporting another
+    insertion, so a disc that is still mounted after a rip is not processed twice.
+
+    :param drive_path: The path to the disc drive or mount point.
+    :param min_interval: The initial recheck interval in seconds.
+    :param max_interval: The upper limit for the exponential backoff in seconds.
+    :param settle_time: Seconds to wait after insertion, to give the drive time to finish mounting.
+    :param stop_event: Optional threading.Event, the generator returns once it is set.
+    :param detect: Function taking drive_path and returning True while a disc is present.
+    """
+    libc = _load_libc()
+    events = None
+    if libc is not None:
+        try:
+            events = _KernelEvents(drive_path, libc)
+        except OSError as e:
+            print(f"Kernel events unavailable ({e}), falling back to polling {drive_path}.")
+
+    try:
+        while True:
+            if not _wait_for_state(drive_path, True, detect, events, min_interval, max_interval, stop_event):
+                return
+            if settle_time:
+                if stop_event is None:
+                    time.sleep(settle_time)
+                elif stop_event.wait(settle_time):
+                    return
+            if not detect(drive_path):
+                continue
+            yield drive_path
+            if not _wait_for_state(drive_path, False, detect, events, min_interval, max_interval, stop_event):
+                return
+    finally:
+        if events is not None:
+            events.close()
@@ -0,0 +1,403 @@
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from progress import run_with_progress, HandBrakeProgress
+
+# Lets machines without disc drives encode for the ripping host. The ripping host runs a coordinator that
+# holds the encode jobs, workers on other machines claim jobs over HTTP, run HandBrake on the shared storage
+# and send heartbeats while they work. A job whose worker stops sending heartbeats is given to another worker.
+#
+# Coordinator: set COORDINATOR_PORT for auto-rip.py, or run 'python encode_cluster.py coordinator --port 8750'
+# Worker:      python encode_cluster.py worker http://ripping-host:8750
+#
+# The input and output paths must be reachable from every worker, --path-map translates them if the shared
+# storage is mounted somewhere else on the worker.
+# Every request carries COORDINATOR_TOKEN, which must be the same on the coordinator and every worker. The
+# coordinator only listens on COORDINATOR_HOST (localhost unless set, e.g. 0.0.0.0 for workers on other machines)
+# and only accepts jobs whose output is inside one of its output folders (the MP4 folder for auto-rip.py).
+
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', 10))
+HEARTBEAT_TIMEOUT = float(os.getenv('HEARTBEAT_TIMEOUT', 60))
+MAX_ATTEMPTS = int(os.getenv('ENCODE_MAX_ATTEMPTS', 3))
+COORDINATOR_HOST = os.getenv('COORDINATOR_HOST', '127.0.0.1')
+COORDINATOR_TOKEN = os.getenv('COORDINATOR_TOKEN')
+# How long finished jobs are kept for the workers and submitters to read their state
+FINISHED_JOB_SECONDS = float(os.getenv('FINISHED_JOB_SECONDS', 3600))
+
+HANDBRAKE_CLI = os.getenv('HANDBRAKE', "C:\\Program Files\\HandBrake\\HandBrakeCLI.exe")
+# The preset does not upscale, this is an upper limit of quality
+HANDBRAKE_PRESET = "Fast 1080p30"
+
+def handbrake_command(input_file, output_file, title_id=None, chapters=None, preset=HANDBRAKE_PRESET, handbrake_cli_path=HANDBRAKE_CLI):
+    """
+    The HandBrakeCLI command of an encode, the same whether it runs locally or on a worker.
+
+    :param chapters: Optional (first, last) tuple, to only encode a range of chapters.
+    """
+    command = [
+        handbrake_cli_path,
+        "-i", str(input_file),
+        "-o", str(output_file),
+        # "-f", "av_mp4",
+        "--preset", preset,
+        "--json" # Progress is printed as JSON, so it can be read by progress.HandBrakeProgress
+    ]
+    # HandBrake titles start at 1, MakeMKV titles start at 0
+    if title_id is not None:
+        command.extend(["--title", str(title_id + 1)])
+    if chapters:
+        command.extend(["--chapters", f"{chapters[0]}-{chapters[1]}"])
+    return command
+
+def _inside(path, folders):
+    path = os.path.realpath(path)
+    for folder in folders:
+        folder = os.path.realpath(folder)
+        if os.path.commonpath([path, folder]) == folder:
+            return True
+    return False
+
+class Coordinator:
+    """
+    Holds the encode jobs. A job is 'queued' until a worker claims it, 'running' while the worker sends
+    heartbeats, and then 'done' or 'failed'. Jobs are re-queued if their worker stops sending heartbeats.
+    """
+
+    def __init__(self, output_folders, heartbeat_timeout=HEARTBEAT_TIMEOUT, max_attempts=MAX_ATTEMPTS, finished_job_seconds=FINISHED_JOB_SECONDS):
+        """
+        :param output_folders: The folders encodes may be written to, jobs with an output anywhere else are refused.
+        """
+        self.output_folders = list(output_folders)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.finished_job_seconds = finished_job_seconds
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.jobs = {}
+        self.queue = []
+
+    def submit(self, job):
+        """
+        :param job: Dict containing 'input', 'output', 'preset' and optionally 'title_id' and 'chapters'.
+        :return: The ID of the job.
+        :raises ValueError: If the output is not inside one of the output folders.
+        """
+        if not isinstance(job.get('output'), str) or not isinstance(job.get('input'), str) or not _inside(job['output'], self.output_folders):
+            raise ValueError(f"the output must be inside {', '.join(self.output_folders) or 'an output folder'}")
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._prune()
+            self.jobs[job_id] = dict(job, id=job_id, state='queued', worker=None, attempts=0, heartbeat=None, error=None, finished=None)
+            self.queue.append(job_id)
+        return job_id
+
+    def claim(self, worker):
+        with self.lock:
+            self._requeue_dead()
+            if not self.queue:
+                return None
+            job = self.jobs[self.queue.pop(0)]
+            job.update(state='running', worker=worker, heartbeat=time.time())
+            job['attempts'] += 1
+            return dict(job)
+
+    def heartbeat(self, worker, job_id):
+        """
+        :return: False if the job is no longer assigned to the worker, so it should stop encoding.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['worker'] != worker or job['state'] != 'running':
+                return False
+            job['heartbeat'] = time.time()
+            return True
+
+    def complete(self, worker, job_id, ok, error=None):
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None or job['worker'] != worker or job['state'] != 'running':
+                return False
+            if ok:
+                job.update(state='done', error=None, finished=time.time())
+            elif job['attempts'] < self.max_attempts:
+                print(f"Encode of {job['output']} failed on {worker} ({error}), queuing it again.")
+                job.update(state='queued', worker=None, error=error)
+                self.queue.append(job_id)
+            else:
+                job.update(state='failed', error=error, finished=time.time())
+            self.changed.notify_all()
+            return True
+
+    def _requeue_dead(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job['state'] == 'running' and now - job['heartbeat'] > self.heartbeat_timeout:
+                print(f"Worker {job['worker']} stopped responding, queuing {job['output']} again.")
+                job.update(state='queued', worker=None, error='worker stopped responding')
+                # Jobs that were already running go to the front, they have waited the longest
+                self.queue.insert(0, job['id'])
+
+    def _prune(self):
+        # Finished jobs are only kept long enough for their submitter to read the result
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items() if job['finished'] and now - job['finished'] > self.finished_job_seconds]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            self._requeue_dead()
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, timeout=None):
+        """
+        Blocks until the job is done or failed.
+
+        :return: The job dict.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.changed:
+            while self.jobs[job_id]['state'] not in ('done', 'failed'):
+                self._requeue_dead()
+                remaining = self.heartbeat_timeout if deadline is None else min(self.heartbeat_timeout, deadline - time.time())
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            return dict(self.jobs[job_id])
+
+    def status(self):
+        with self.lock:
+            self._requeue_dead()
+            self._prune()
+            return [dict(job) for job in self.jobs.values()]
+
+def make_handler(coordinator, token):
+    class CoordinatorHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body=None):
+            data = json.dumps(body).encode() if body is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def _authorised(self):
+            if hmac.compare_digest(self.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()):
+                return True
+            self._reply(401, {'error': 'invalid token'})
+            return False
+
+        def do_GET(self):
+            if not self._authorised():
+                return
+            if self.path == '/jobs':
+                return self._reply(200, coordinator.status())
+            if self.path.startswith('/jobs/'):
+                job = coordinator.get(self.path[len('/jobs/'):])
+                return self._reply(200, job) if job else self._reply(404, {'error': 'unknown job'})
+            self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if not self._authorised():
+                return
+            try:
+                body = self._body()
+            except json.JSONDecodeError:
+                return self._reply(400, {'error': 'invalid JSON'})
+            if self.path == '/jobs':
+                try:
+                    return self._reply(201, {'id': coordinator.submit(body)})
+                except ValueError as e:
+                    return self._reply(400, {'error': str(e)})
+            if self.path == '/claim':
+                job = coordinator.claim(body['worker'])
+                return self._reply(200, job) if job else self._reply(204)
+            if self.path == '/heartbeat':
+                ok = coordinator.heartbeat(body['worker'], body['id'])
+                return self._reply(200 if ok else 410, {'ok': ok})
+            if self.path == '/complete':
+                ok = coordinator.complete(body['worker'], body['id'], body['ok'], body.get('error'))
+                return self._reply(200 if ok else 410, {'ok': ok})
+            self._reply(404, {'error': 'not found'})
+
+    return CoordinatorHandler
+
+def start_coordinator(port, output_folders=(), host=COORDINATOR_HOST, token=COORDINATOR_TOKEN, coordinator=None):
+    """
+    Starts the coordinator's HTTP server on a background thread.
+
+    :param output_folders: The folders encodes may be written to, not used if coordinator is given.
+    :return: A tuple of (coordinator, server), call server.shutdown() to stop it.
+    :raises ValueError: If no token is set.
+    """
+    if not token:
+        raise ValueError("COORDINATOR_TOKEN must be set to start the encode coordinator")
+    coordinator = coordinator or Coordinator(output_folders)
+    server = ThreadingHTTPServer((host, port), make_handler(coordinator, token))
+    threading.Thread(target=server.serve_forever, name='coordinator', daemon=True).start()
+    print(f"Encode coordinator listening on {host}:{server.server_port}")
+    return coordinator, server
+
+def _request(url, body=None, timeout=30, token=COORDINATOR_TOKEN):
+    data = json.dumps(body).encode() if body is not None else None
+    headers = {'Content-Type': 'application/json', 'Authorization': f"Bearer {token or ''}"}
+    request = urllib.request.Request(url, data=data, headers=headers, method='POST' if data else 'GET')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            content = response.read()
+            return response.status, json.loads(content) if content else None
+    except urllib.error.HTTPError as e:
+        content = e.read()
+        return e.code, json.loads(content) if content else None
+
+def submit_and_wait(coordinator_url, job, poll_interval=5, token=COORDINATOR_TOKEN):
+    """
+    Sends an encode job to the coordinator and waits for a worker to finish it.
+
+    :return: The finished job dict, its 'state' is 'done' or 'failed'.
+    :raises OSError: If the coordinator cannot be reached (urllib.error.URLError), refuses the job, or stops
+        answering for longer than HEARTBEAT_TIMEOUT while the job runs.
+    """
+    status, reply = _request(f"{coordinator_url}/jobs", job, token=token)
+    if status != 201:
+        raise OSError(f"the coordinator refused the job: {(reply or {}).get('error', status)}")
+    job_id = reply['id']
+    last_reply = time.time()
+    while True:
+        try:
+            status, job = _request(f"{coordinator_url}/jobs/{job_id}", token=token)
+            last_reply = time.time()
+        except OSError:
+            if time.time() - last_reply > HEARTBEAT_TIMEOUT:
+                raise
+            status = None
+        if status == 200 and job['state'] in ('done', 'failed'):
+            return job
+        if status == 404:
+            raise OSError(f"the coordinator no longer knows job {job_id}")
+        time.sleep(poll_interval)
+
+def map_paths(job, path_map):
+    for key in ('input', 'output'):
+        for prefix, replacement in path_map:
+            if job[key].startswith(prefix):
+                job[key] = replacement + job[key][len(prefix):]
+                break
+    return job
+
+def run_worker(coordinator_url, worker_name=None, path_map=(), poll_interval=5, stop_event=None,
+               handbrake_cli_path=HANDBRAKE_CLI, token=COORDINATOR_TOKEN):
+    """
+    Claims and encodes jobs from the coordinator until stop_event is set.
+
+    :param coordinator_url: e.g. 'http://ripping-host:8750'
+    :param worker_name: The name reported to the coordinator, defaults to the host name and process ID.
+    :param path_map: A list of (prefix, replacement) tuples, applied to the input and output paths.
+    """
+    worker_name = worker_name or f"{socket.gethostname()}-{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    print(f"Worker {worker_name} taking jobs from {coordinator_url}")
+
+    while not stop_event.is_set():
+        try:
+            status, job = _request(f"{coordinator_url}/claim", {'worker': worker_name}, token=token)
+        except OSError as e:
+            print(f"Error: could not reach the coordinator: {e}")
+            stop_event.wait(poll_interval)
+            continue
+        if status != 200:
+            stop_event.wait(poll_interval)
+            continue
+
+        job = map_paths(job, path_map)
+        output_file = job['output']
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        # The encode is written to a name of its own, so a worker that was wrongly thought dead cannot
+        # overwrite the file another worker is writing. HandBrake picks the container from the extension
+        base, extension = os.path.splitext(os.path.basename(output_file))
+        job['output'] = os.path.join(os.path.dirname(output_file), f".{base}.{worker_name}.partial{extension}")
+        print(f"Encoding {output_file}")
+        finished = threading.Event()
+        # Set when the job has been given to another worker, HandBrake is stopped instead of encoding for nothing
+        cancelled = threading.Event()
+
+        def send_heartbeats():
+            while not finished.wait(HEARTBEAT_INTERVAL):
+                try:
+                    status, _ = _request(f"{coordinator_url}/heartbeat", {'worker': worker_name, 'id': job['id']}, token=token)
+                except OSError:
+                    continue
+                if status == 410:
+                    print(f"Encode of {output_file} was given to another worker, stopping HandBrake.")
+                    cancelled.set()
+                    return
+
+        heartbeat_thread = threading.Thread(target=send_heartbeats, daemon=True)
+        heartbeat_thread.start()
+        error = None
+        try:
+            command = handbrake_command(job['input'], job['output'], job.get('title_id'), job.get('chapters'), job.get('preset', HANDBRAKE_PRESET), handbrake_cli_path)
+            run_with_progress(command, f"Encode {os.path.basename(output_file)}", HandBrakeProgress(), output_path=job['output'], stop_event=cancelled)
+        except FileNotFoundError:
+            error = 'HandBrakeCLI not found'
+        except subprocess.CalledProcessError as e:
+            error = 'given to another worker' if cancelled.is_set() else f"HandBrakeCLI failed with error code {e.returncode}"
+        finally:
+            finished.set()
+            heartbeat_thread.join()
+
+        try:
+            status, _ = _request(f"{coordinator_url}/heartbeat", {'worker': worker_name, 'id': job['id']}, token=token)
+            # Only the worker the job is still assigned to keeps its output
+            if error is None and status == 200:
+                os.replace(job['output'], output_file)
+            _request(f"{coordinator_url}/complete", {'worker': worker_name, 'id': job['id'], 'ok': error is None, 'error': error}, token=token)
+        except OSError as e:
+            print(f"Error: could not report the result to the coordinator: {e}")
+        if os.path.exists(job['output']):
+            os.remove(job['output'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    coordinator_parser = subparsers.add_parser('coordinator')
+    coordinator_parser.add_argument('--port', type=int, default=int(os.getenv('COORDINATOR_PORT', 8750)))
+    coordinator_parser.add_argument('--host', default=COORDINATOR_HOST, help='e.g. 0.0.0.0 to accept workers on other machines')
+    coordinator_parser.add_argument('--output-folder', action='append', default=[], help='a folder encodes may be written to, may be repeated (default MP4_OUT_DIR)')
+    worker_parser = subparsers.add_parser('worker')
+    worker_parser.add_argument('url')
+    worker_parser.add_argument('--name', default=None)
+    worker_parser.add_argument('--path-map', action='append', default=[], help='PREFIX=REPLACEMENT, may be repeated')
+    args = parser.parse_args()
+
+    if args.mode == 'coordinator':
+        output_folders = args.output_folder or [os.getenv('MP4_OUT_DIR', 'C:\\mp4_movies\\')]
+        _, server = start_coordinator(args.port, output_folders, args.host)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        path_map = [tuple(mapping.split('=', 1)) for mapping in args.path_map]
+        try:
+            run_worker(args.url.rstrip('/'), args.name, path_map)
+        except KeyboardInterrupt:
+            sys.exit(0)
@@ -0,0 +1,39 @@
+import os
+import time
+
+# The least recently used eviction shared by the on-disk caches (scan_cache.py and tmdb_cache.py).
+# Each entry is one file in the cache folder and its modification time records when it was last used,
+# so reading an entry calls mark_used and no index has to be kept alongside the files.
+
+def mark_used(entry_path):
+    os.utime(entry_path)
+
+def cache_entries(cache_dir, pattern='*.json'):
+    """
+    :return: A list of (last used, size, path) tuples, one per entry in cache_dir.
+    """
+    entries = []
+    for entry_path in cache_dir.glob(pattern):
+        try:
+            stat = entry_path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry_path))
+    return entries
+
+def evict(cache_dir, max_bytes, max_age=None, pattern='*.json'):
+    """
+    Removes the least recently used entries until the cache is at most max_bytes, and every entry that has not
+    been used for max_age seconds. Callers hold their own lock, other processes may remove entries at the same time.
+    """
+    entries = sorted(cache_entries(cache_dir, pattern))
+    total_bytes = sum(size for _, size, _ in entries)
+    now = time.time()
+    for last_used, size, entry_path in entries:
+        if total_bytes <= max_bytes and (max_age is None or now - last_used <= max_age):
+            break
+        try:
+            entry_path.unlink()
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
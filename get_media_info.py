@@ -1,6 +1,10 @@
 import requests
 import os
-import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from tmdb_cache import CachedSession
+from media_store import MediaStore
+from metrics import timed
 
 # https://developer.themoviedb.org/docs/getting-started
 
@@ -8,24 +12,23 @@ import json
 
 # https://medium.com/@mcasciato/no-imdb-api-check-out-these-options-75917d0fe923
 
-def store_media_info(movie_info, output_file='movie-info.json'):
-    # Load existing movies or create new array
-    try:
-        with open(output_file, 'r') as f:
-            movies = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        movies = []
-    
-    for movie in movies:
-        if movie['title'] == movie_info['title']:
-            print(f"Movie {movie_info['title']} has already been added")
-            return None
+TMDB_BASE_URL = os.getenv('TMDB_BASE_URL', "https://api.themoviedb.org/3")
+# The maximum number of requests sent to TMDB at the same time
+TMDB_MAX_CONCURRENCY = int(os.getenv('TMDB_MAX_CONCURRENCY', 4))
 
-    # Append new movie info
-    movies.append(movie_info)
+@timed('store_media_info')
+def store_media_info(movie_info, db_file=os.getenv('MEDIA_DB', 'media-info.db')):
+    """
+    Adds the media info to the library, see media_store.MediaStore. A library in the old movie-info.json
+    format is imported the first time this is called. Use 'python media_store.py' to export the library as JSON.
 
-    with open(output_file, 'w') as f:
-        json.dump(movies, f, indent=2)
+    :param movie_info: The dict returned by tmdb_movie_info or tmdb_tv_info.
+    :param db_file: The path to the library database.
+    :return: True if anything was added, False otherwise.
+    """
+    if movie_info is None:
+        return False
+    return MediaStore(db_file, legacy_json='movie-info.json').add(movie_info)
 
 def get_director(crew):
     for crew_member in crew:
@@ -41,21 +44,103 @@ def get_director(crew):
             }
     return None
 
-def tmdb_tv_info(tv_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None)):
+def format_episode(episode_data):
+    """
+    Flattens an episode from the TMDB season endpoint into the format stored in the media info.
+    """
+    guest_stars = []
+    for guest_star in episode_data['guest_stars']:
+        guest_stars.append({
+            'name': guest_star['name'],
+            'original_name': guest_star['original_name'],
+            'tmdb_id': guest_star['id'],
+            'profile_path': f"https://image.tmdb.org/t/p/w500{guest_star['profile_path']}" if guest_star['profile_path'] else None,
+            'gender': guest_star['gender'],
+            'tmdb_credit_id': guest_star['credit_id'],
+            'character_name': guest_star['character'],
+            'credit_order': guest_star['order']
+        })
+
+    return {
+        'episode_number': episode_data['episode_number'],
+        'air_date': episode_data['air_date'],
+        'overview': episode_data['overview'],
+        'still_path': f"https://image.tmdb.org/t/p/w500{episode_data['still_path']}" if episode_data['still_path'] else None,
+        'tmdb_id': episode_data['id'],
+        'runtime': episode_data['runtime'],
+        'episode_name': episode_data['name'],
+        'rating': episode_data['vote_average'],
+        'director': get_director(episode_data['crew']),
+        'guest_stars': guest_stars
+    }
+
+def tmdb_session(max_concurrency=TMDB_MAX_CONCURRENCY):
+    """
+    Creates a session whose connection pool is large enough for max_concurrency requests in flight at once.
+    Responses are cached on disk, see tmdb_cache.CachedSession.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return CachedSession(session)
+
+@timed('fetch_tv_seasons')
+def fetch_tv_seasons(tv_info, season_numbers, tmdb_api_key=os.getenv('TMDB_API_KEY', None), session=None, max_concurrency=TMDB_MAX_CONCURRENCY):
+    """
+    Adds the episodes of the given seasons to a TV show returned by tmdb_tv_info.
+    Each season is a single request to the TMDB season endpoint and up to max_concurrency seasons are fetched at once.
+
+    :param tv_info: The TV show information, the episodes are added to its seasons (or specials for season 0).
+    :param season_numbers: The season numbers to fetch.
+    :param tmdb_api_key: Your TMDB API key.
+    :param session: The requests session to use, one is created if not provided.
+    :param max_concurrency: The maximum number of requests in flight at once.
+    :return: The updated tv_info.
+    """
+    series_id = tv_info['tmdb_id']
+    flatten_seasons = {season['season_number']: season for season in tv_info['seasons']}
+    if tv_info['specials']:
+        flatten_seasons[0] = tv_info['specials']
+    season_numbers = [season_number for season_number in season_numbers if season_number in flatten_seasons]
+    if not season_numbers:
+        return tv_info
+
+    def fetch_season(season_number):
+        season_url = f"{TMDB_BASE_URL}/tv/{series_id}/season/{season_number}?api_key={tmdb_api_key}"
+        season_response = season_session.get(season_url)
+        if season_response.status_code != 200:
+            print(f"Error: {season_response.status_code} fetching season {season_number}")
+            return season_number, []
+        return season_number, [format_episode(episode_data) for episode_data in season_response.json()['episodes']]
+
+    season_session = session or tmdb_session(max_concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(season_numbers))) as executor:
+            for season_number, episodes in executor.map(fetch_season, season_numbers):
+                flatten_seasons[season_number]['episodes'] = episodes
+    finally:
+        if session is None:
+            season_session.close()
+    return tv_info
+
+@timed('tmdb_tv_info', ok=lambda result: result is not None)
+def tmdb_tv_info(tv_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None), season_numbers=None):
     """
     Fetches TV show information from TMDB API.
 
     :param tv_name: Name of the TV show to search for.
     :param api_key: Your TMDB API key.
+    :param season_numbers: The seasons to fetch the episodes of, all seasons (including specials) if None.
+        The other seasons are still listed, but without any episodes.
     :return: Dictionary containing TV show information or None if not found.
     """
     if tmdb_api_key is None:
         print("TMDB API key not provided.")
         return None
     
-    with requests.Session() as session:
-        base_url = "https://api.themoviedb.org/3"
-        query_url = f"{base_url}/search/tv?api_key={tmdb_api_key}&query={tv_name}"
+    with tmdb_session() as session:
+        query_url = f"{TMDB_BASE_URL}/search/tv?api_key={tmdb_api_key}&query={tv_name}"
         query_response = session.get(query_url)
 
         if query_response.status_code == 200:
@@ -63,83 +148,54 @@ def tmdb_tv_info(tv_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None)):
             if data['results']:
                 query_result = data['results'][0]  # Return the first result
                 tmdb_id = query_result['id']
-                tv_url = f"{base_url}/tv/{tmdb_id}?api_key={tmdb_api_key}&append_to_response=credits"
+                tv_url = f"{TMDB_BASE_URL}/tv/{tmdb_id}?api_key={tmdb_api_key}&append_to_response=credits"
                 tv_response = session.get(tv_url)
-                if tv_response.status_code == 200:
-                    tv_data = tv_response.json()
-                    series_id = tv_data['id']
-                    tv_info = {
-                        'title': tv_data['original_name'],
-                        'tmdb_id': series_id,
-                        'genres': [genre['name'] for genre in tv_data['genres']],
-						'release_date': tv_data['first_air_date'],
-                        'overview': tv_data['overview'],
-                        'poster_path': f"https://image.tmdb.org/t/p/w500{tv_data['poster_path']}",
-                        'backdrop_path': f"https://image.tmdb.org/t/p/w500{tv_data['backdrop_path']}",
-                        'rating': tv_data['vote_average'],
-                        'number_of_seasons': tv_data['number_of_seasons'],
-                        'number_of_episodes': tv_data['number_of_episodes'],
-                        'seasons': [],
-                        'specials': {}
+                if tv_response.status_code != 200:
+                    print(f"Error: {tv_response.status_code}")
+                    return None
+
+                tv_data = tv_response.json()
+                series_id = tv_data['id']
+                tv_info = {
+                    'title': tv_data['original_name'],
+                    'tmdb_id': series_id,
+                    'genres': [genre['name'] for genre in tv_data['genres']],
+                    'release_date': tv_data['first_air_date'],
+                    'overview': tv_data['overview'],
+                    'poster_path': f"https://image.tmdb.org/t/p/w500{tv_data['poster_path']}",
+                    'backdrop_path': f"https://image.tmdb.org/t/p/w500{tv_data['backdrop_path']}",
+                    'rating': tv_data['vote_average'],
+                    'number_of_seasons': tv_data['number_of_seasons'],
+                    'number_of_episodes': tv_data['number_of_episodes'],
+                    'seasons': [],
+                    'specials': {}
+                }
+
+                seasons = []
+
+                for season in tv_data['seasons']:
+                    season_number = season['season_number']
+                    flatten_season = {
+                        'season_number': season_number,
+                        'air_date': season['air_date'], # convert to datetime object
+                        'overview': season['overview'],
+                        'poster_path': f"https://image.tmdb.org/t/p/w500{season['poster_path']}" if season['poster_path'] else None,
+                        'season_id': season['id'],
+                        'episodes': [],
+                        'title': season['name'],
+                        'rating': season['vote_average']
                     }
 
-                    seasons = []
-
-                    for season in tv_data['seasons']:
-                        season_number = season['season_number']
-                        episodes = []
-
-                        for i in range(season['episode_count']):
-                            episode_url = f"{base_url}/tv/{series_id}/season/{season_number}/episode/{i+1}?api_key={tmdb_api_key}"
-                            episode_response = session.get(episode_url)
-                            if episode_response.status_code == 200:
-                                episode_data = episode_response.json()
-                                guest_stars = []
-                                for guest_star in episode_data['guest_stars']:
-                                    guest_stars.append({
-                                        'name': guest_star['name'],
-                                        'original_name': guest_star['original_name'],
-                                        'tmdb_id': guest_star['id'],
-                                        'profile_path': f"https://image.tmdb.org/t/p/w500{guest_star['profile_path']}" if guest_star['profile_path'] else None,
-                                        'gender': guest_star['gender'],
-                                        'tmdb_credit_id': guest_star['credit_id'],
-                                        'character_name': guest_star['character'],
-                                        'credit_order': guest_star['order']
-                                    })
-                                    
-                                episodes.append({
-                                    'episode_number': episode_data['episode_number'],
-                                    'air_date': episode_data['air_date'],
-                                    'overview': episode_data['overview'],
-                                    'still_path': f"https://image.tmdb.org/t/p/w500{episode_data['still_path']}" if episode_data['still_path'] else None,
-                                    'tmdb_id': episode_data['id'],
-                                    'runtime': episode_data['runtime'],
-                                    'episode_name': episode_data['name'],
-                                    'rating': episode_data['vote_average'],
-                                    'director': get_director(episode_data['crew']),
-                                    'guest_stars': guest_stars
-                                })
-                        
-                        flatten_season = {
-                            'season_number': season_number,
-                            'air_date': season['air_date'], # convert to datetime object
-                            'overview': season['overview'],
-                            'poster_path': f"https://image.tmdb.org/t/p/w500{season['poster_path']}" if season['poster_path'] else None,
-                            'season_id': season['id'],
-                            'episodes': episodes,
-                            'title': season['name'],
-                            'rating': season['vote_average']
-                        }
-                        
-                        flatten_season['episodes'] = episodes
-
-                        # Season Number 0, contains information about specials and is stored separately from the rest of the seasons
-                        if season_number == 0:
-                            tv_info['specials'] = flatten_season
-                        else:
-                            seasons.append(flatten_season)
-                    tv_info['seasons'] = seasons
-                return tv_info
+                    # Season Number 0, contains information about specials and is stored separately from the rest of the seasons
+                    if season_number == 0:
+                        tv_info['specials'] = flatten_season
+                    else:
+                        seasons.append(flatten_season)
+                tv_info['seasons'] = seasons
+
+                if season_numbers is None:
+                    season_numbers = [season['season_number'] for season in tv_data['seasons']]
+                return fetch_tv_seasons(tv_info, season_numbers, tmdb_api_key, session=session)
             else:
                 print("No results found.")
                 return None
@@ -147,6 +203,7 @@ def tmdb_tv_info(tv_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None)):
             print(f"Error: {query_response.status_code}")
             return None
 
+@timed('tmdb_movie_info', ok=lambda result: result is not None)
 def tmdb_movie_info(movie_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None)):
     """
     Fetches movie information from TMDB API.
@@ -159,9 +216,8 @@ def tmdb_movie_info(movie_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None)):
         print("TMDB API key not provided.")
         return None
     
-    with requests.Session() as session:
-        base_url = "https://api.themoviedb.org/3"
-        query_url = f"{base_url}/search/movie?api_key={tmdb_api_key}&query={movie_name}"
+    with tmdb_session() as session:
+        query_url = f"{TMDB_BASE_URL}/search/movie?api_key={tmdb_api_key}&query={movie_name}"
         query_response = session.get(query_url)
 
         if query_response.status_code == 200:
@@ -169,7 +225,7 @@ def tmdb_movie_info(movie_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None)):
             if data['results']:
                 query_result = data['results'][0]  # Return the first result
                 tmdb_id = query_result['id']
-                movie_url = f"{base_url}/movie/{tmdb_id}?api_key={tmdb_api_key}&append_to_response=credits"
+                movie_url = f"{TMDB_BASE_URL}/movie/{tmdb_id}?api_key={tmdb_api_key}&append_to_response=credits"
                 movie_response = session.get(movie_url)
 
                 if movie_response.status_code == 200:
@@ -211,12 +267,17 @@ def tmdb_movie_info(movie_name, tmdb_api_key=os.getenv('TMDB_API_KEY', None)):
             return None
 
 if __name__ == '__main__':
-    tv = tmdb_tv_info("Band of Brothers")
-    print(tv)
-    store_media_info(tv, 'test-tvshow.json')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tv = tmdb_tv_info("Band of Brothers")
+        print(tv)
+        tv_store = MediaStore(os.path.join(temp_dir, 'tv.db'), legacy_json='test-tvshow.json')
+        tv_store.add(tv)
+        tv_store.export_json('test-tvshow.json')
 
-    print()
+        print()
 
-    movie = tmdb_movie_info("Inception")
-    print(movie)
-    store_media_info(movie, 'test-movie.json')
+        movie = tmdb_movie_info("Inception")
+        print(movie)
+        movie_store = MediaStore(os.path.join(temp_dir, 'movie.db'), legacy_json='test-movie.json')
+        movie_store.add(movie)
+        movie_store.export_json('test-movie.json')
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+
+# Records the stages of an encode job in its job file, so a job that was interrupted (e.g. by a crash or
+# power loss) resumes at the first stage that did not complete, instead of starting again from the backup.
+# A stage only counts as complete once its output has been written under a temporary name, checked and
+# renamed, so a truncated file is never mistaken for a finished one.
+
+STAGES = ('backup', 'scan', 'match', 'extract', 'encode', 'metadata')
+
+FFPROBE = os.getenv('FFPROBE', 'ffprobe')
+
+# Encoded and extracted titles may be a little shorter or longer than the title on the disc
+DURATION_TOLERANCE = float(os.getenv('DURATION_TOLERANCE', 0.02))
+MIN_DURATION_TOLERANCE = 5
+
+# ffprobe missing is only reported once, not for every output that is checked
+_ffprobe_missing_reported = threading.Event()
+
+def ffprobe_available():
+    return shutil.which(FFPROBE) is not None
+
+def stream_durations(path):
+    """
+    :return: A dict with the 'video' and 'audio' duration of a file in seconds (None if it has no such stream)
+        and the 'format' (container) duration, None if the file cannot be read, or False if ffprobe is not
+        installed, so the durations cannot be checked.
+    """
+    command = [FFPROBE, '-v', 'error', '-show_entries', 'stream=codec_type,duration:format=duration', '-of', 'json', str(path)]
+    try:
+        probe = subprocess.run(command, text=True, capture_output=True, check=True)
+        data = json.loads(probe.stdout)
+        durations = {'video': None, 'audio': None, 'format': float(data['format']['duration'])}
+    except FileNotFoundError:
+        if not _ffprobe_missing_reported.is_set():
+            _ffprobe_missing_reported.set()
+            print("Error: ffprobe not found, only the size of outputs is checked. Please check the path to ffprobe.")
+        return False
+    except (subprocess.CalledProcessError, json.JSONDecodeError, KeyError, ValueError):
+        return None
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') in ('video', 'audio') and durations[stream['codec_type']] is None and 'duration' in stream:
+            durations[stream['codec_type']] = float(stream['duration'])
+    return durations
+
+def container_duration(path):
+    """
+    :return: The duration of a video file in seconds, None if the file cannot be read,
+        or False if ffprobe is not installed, so the duration cannot be checked.
+    """
+    durations = stream_durations(path)
+    return durations['format'] if durations else durations
+
+def verify_output(path, expected_duration=None):
+    """
+    Checks an output is complete: it exists, it is not empty and its container is as long as the title.
+
+    :param path: The MKV or MP4 file.
+    :param expected_duration: The length of the title in seconds, from the MakeMKV scan.
+    :return: True if the output is complete.
+    """
+    path = Path(path)
+    if not path.is_file() or path.stat().st_size == 0:
+        return False
+    duration = container_duration(path)
+    if duration is False:
+        # Without ffprobe only the size can be checked, which still catches outputs that were never written
+        return True
+    if duration is None:
+        print(f"{path.name} cannot be read, it is incomplete.")
+        return False
+    if expected_duration:
+        tolerance = max(expected_duration * DURATION_TOLERANCE, MIN_DURATION_TOLERANCE)
+        if abs(duration - expected_duration) > tolerance:
+            print(f"{path.name} is {duration:.0f}s long, expected {expected_duration:.0f}s, it is incomplete.")
+            return False
+    return True
+
+def remove_output(path):
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        path.unlink()
+
+class JobJournal:
+    """
+    The stages of one job, stored in job['journal'] and saved with JobQueue.update every time a stage changes.
+    Stages of a single title are named '<stage>:<file name>', e.g. 'encode:Friends - s01e01 - Pilot'.
+    """
+
+    def __init__(self, job, queue=None, job_id=None):
+        """
+        :param job: The job dict, its 'journal' is created if it does not exist.
+        :param queue: The JobQueue the job is active in, without one the journal is only kept in memory.
+        """
+        self.job = job
+        self.queue = queue
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        job.setdefault('journal', {})
+
+    def _save(self):
+        if self.queue is not None:
+            self.queue.update(self.job_id, self.job)
+
+    def start(self, stage):
+        with self.lock:
+            entry = self.job['journal'].setdefault(stage, {})
+            entry.update(state='started', updated=time.time())
+            self._save()
+
+    def complete(self, stage, **details):
+        """
+        Marks a stage complete, details (which must be JSON serialisable) are kept for when the job resumes.
+        """
+        with self.lock:
+            self.job['journal'][stage] = dict(details, state='complete', updated=time.time())
+            self._save()
+
+    def is_complete(self, stage):
+        with self.lock:
+            return self.job['journal'].get(stage, {}).get('state') == 'complete'
+
+    def details(self, stage):
+        with self.lock:
+            return dict(self.job['journal'].get(stage, {}))
+
+    def output_complete(self, stage, path, expected_duration=None):
+        """
+        Checks whether the output of a stage is already complete. An output that was recorded by this journal
+        only has its size checked, anything else (e.g. from a run before the journal existed) is fully verified.
+        An incomplete output is removed so the stage starts again from nothing.
+
+        :return: True if the stage can be skipped.
+        """
+        path = Path(path)
+        recorded = self.details(stage)
+        if recorded.get('state') == 'complete' and path.is_file() and path.stat().st_size == recorded.get('size'):
+            return True
+        if path.exists() and verify_output(path, expected_duration):
+            self.complete(stage, path=str(path), size=path.stat().st_size)
+            return True
+        if path.exists():
+            print(f"Removing incomplete output: {path}")
+            remove_output(path)
+        return False
+
+    def resume_stage(self):
+        """
+        :return: The first of STAGES that has not completed for every title, or None if the job is finished.
+        """
+        with self.lock:
+            journal = self.job['journal']
+            for stage in STAGES:
+                entries = [entry for name, entry in journal.items() if name == stage or name.startswith(f"{stage}:")]
+                if not entries or any(entry.get('state') != 'complete' for entry in entries):
+                    return stage
+            return None
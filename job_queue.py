@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import uuid
+import threading
+from pathlib import Path
+from atomic_file import atomic_write
+
+# A durable job queue stored as one JSON file per job. A job moves between the folders
+# pending -> active -> done/failed using os.replace, which is atomic, so a crash never loses
+# or duplicates a job and several processes can safely share the same queue folder.
+
+QUEUE_STATES = ('pending', 'active', 'done', 'failed')
+
+class JobQueue:
+    def __init__(self, queue_dir=os.getenv('JOB_QUEUE_DIR', 'jobs'), poll_interval=30):
+        """
+        :param queue_dir: The folder the queue is stored in, it is created if it does not exist.
+        :param poll_interval: How often (in seconds) waiting workers check for jobs added by other processes.
+        """
+        self.queue_dir = Path(queue_dir)
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        for state in QUEUE_STATES:
+            (self.queue_dir / state).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state, job_id):
+        return self.queue_dir / state / f"{job_id}.json"
+
+    def _write(self, path, job):
+        # Written to a temporary file first, so a half written job is never picked up
+        with atomic_write(path, fsync=True) as f:
+            json.dump(job, f, indent=2)
+
+    def put(self, job):
+        """
+        Adds a job to the queue.
+
+        :param job: A JSON serialisable dict describing the job.
+        :return: The ID of the new job.
+        """
+        # The timestamp prefix keeps the jobs in the order they were added
+        job_id = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        self._write(self._path('pending', job_id), job)
+        with self.condition:
+            self.condition.notify()
+        return job_id
+
+    def claim(self):
+        """
+        Takes the oldest pending job.
+
+        :return: A tuple of (job_id, job), or None if there are no pending jobs.
+        """
+        for path in sorted((self.queue_dir / 'pending').glob('*.json')):
+            job_id = path.stem
+            try:
+                # Deferred jobs are left in the queue until their retry time
+                with open(path) as f:
+                    if json.load(f).get('not_before', 0) > time.time():
+                        continue
+                os.replace(path, self._path('active', job_id))
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+            with open(self._path('active', job_id)) as f:
+                return job_id, json.load(f)
+        return None
+
+    def wait_for_job(self, stop_event=None):
+        """
+        Blocks until a job can be claimed.
+
+        :param stop_event: Optional threading.Event, None is returned once it is set.
+        :return: A tuple of (job_id, job), or None if stopped.
+        """
+        while stop_event is None or not stop_event.is_set():
+            claimed = self.claim()
+            if claimed is not None:
+                return claimed
+            with self.condition:
+                self.condition.wait(self.poll_interval)
+        return None
+
+    def update(self, job_id, job):
+        """
+        Saves changes to an active job, e.g. progress that should survive a restart.
+        """
+        self._write(self._path('active', job_id), job)
+
+    def complete(self, job_id):
+        os.replace(self._path('active', job_id), self._path('done', job_id))
+
+    def defer(self, job_id, delay):
+        """
+        Returns an active job to the pending folder, it is not claimed again for delay seconds.
+        """
+        path = self._path('active', job_id)
+        with open(path) as f:
+            job = json.load(f)
+        job['not_before'] = time.time() + delay
+        self._write(path, job)
+        os.replace(path, self._path('pending', job_id))
+
+    def fail(self, job_id, error):
+        path = self._path('active', job_id)
+        with open(path) as f:
+            job = json.load(f)
+        job['error'] = str(error)
+        self._write(path, job)
+        os.replace(path, self._path('failed', job_id))
+
+    def recover(self):
+        """
+        Returns jobs that were active when the process last stopped back to the pending folder.
+        Must only be called when no other worker is using the queue.
+
+        :return: The number of jobs that were recovered.
+        """
+        recovered = 0
+        for path in (self.queue_dir / 'active').glob('*.json'):
+            os.replace(path, self._path('pending', path.stem))
+            recovered += 1
+        return recovered
+
+    def jobs(self, *states):
+        """
+        Lists the jobs in the given states, oldest first.
+
+        :return: A generator of (job_id, job) tuples.
+        """
+        for state in states or QUEUE_STATES:
+            for path in sorted((self.queue_dir / state).glob('*.json')):
+                try:
+                    with open(path) as f:
+                        yield path.stem, json.load(f)
+                except FileNotFoundError:
+                    # Moved to another state while listing
+                    continue
+
+    def pending_count(self):
+        return len(list((self.queue_dir / 'pending').glob('*.json')))
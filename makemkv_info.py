@@ -0,0 +1,287 @@
+from dataclasses import dataclass, field, asdict
+
+# Parses the output of 'makemkvcon info --robot' and matches the titles on a disc to the expected runtimes.
+# The attribute IDs come from MakeMKV's apdefs.h, see https://www.makemkv.com/developers/usage.txt
+
+ATTR_TYPE = 1
+ATTR_NAME = 2
+ATTR_LANG_CODE = 3
+ATTR_LANG_NAME = 4
+ATTR_CODEC_SHORT = 6
+ATTR_CHAPTER_COUNT = 8
+ATTR_DURATION = 9
+ATTR_DISK_SIZE_BYTES = 11
+ATTR_SOURCE_FILE_NAME = 16
+ATTR_OUTPUT_FILE_NAME = 27
+ATTR_VOLUME_NAME = 32
+
+# Cost given to pairs outside the runtime threshold, it is larger than any real runtime deviation
+NO_MATCH_COST = 10 ** 9
+
+@dataclass
+class StreamInfo:
+    stream_id: int
+    type: str = ''
+    codec: str = ''
+    language: str = ''
+    language_name: str = ''
+
+@dataclass
+class TitleInfo:
+    title_id: int
+    name: str = ''
+    duration: int = 0 # In seconds
+    chapter_count: int = 0
+    size_bytes: int = 0
+    source_file: str = ''
+    output_file: str = ''
+    video_streams: list = field(default_factory=list)
+    audio_streams: list = field(default_factory=list)
+    subtitle_streams: list = field(default_factory=list)
+
+    @property
+    def runtime(self):
+        """
+        The runtime rounded down to whole minutes, to compare against the runtimes from TMDB.
+        """
+        return self.duration // 60
+
+@dataclass
+class DiscInfo:
+    name: str = ''
+    volume_name: str = ''
+    title_count: int = 0
+    titles: dict = field(default_factory=dict) # title_id -> TitleInfo
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a DiscInfo from the output of to_dict, e.g. after it has been stored as JSON.
+        """
+        titles = {}
+        for title_id, title in data['titles'].items():
+            title = dict(title)
+            for key in ('video_streams', 'audio_streams', 'subtitle_streams'):
+                title[key] = [StreamInfo(**stream) for stream in title[key]]
+            titles[int(title_id)] = TitleInfo(**title)
+        return cls(name=data['name'], volume_name=data['volume_name'], title_count=data['title_count'], titles=titles)
+
+def parse_duration(duration):
+    """
+    Converts a MakeMKV duration in the format H:MM:SS (or M:SS) into seconds.
+
+    :return: The duration in seconds, or 0 if the duration could not be read.
+    """
+    try:
+        parts = [int(part) for part in duration.split(':')]
+    except ValueError:
+        return 0
+    seconds = 0
+    for part in parts:
+        seconds = (seconds * 60) + part
+    return seconds
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1].replace('\\"', '"')
+    return value
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+def parse_robot_output(makemkv_info):
+    """
+    Parses the robot output of 'makemkvcon info' into a DiscInfo, in a single pass over the output.
+
+    :param makemkv_info: The robot output from MakeMKV.
+    :return: A DiscInfo containing every title on the disc.
+    """
+    disc = DiscInfo()
+    titles = disc.titles
+    streams = {} # (title_id, stream_id) -> StreamInfo
+
+    for line in makemkv_info.splitlines():
+        prefix, _, data = line.partition(':')
+        if prefix == 'TINFO':
+            title_id, attr_id, _, value = data.split(',', 3)
+            title_id = int(title_id)
+            attr_id = int(attr_id)
+            value = _unquote(value)
+            title = titles.get(title_id)
+            if title is None:
+                title = titles[title_id] = TitleInfo(title_id)
+            if attr_id == ATTR_DURATION:
+                title.duration = parse_duration(value)
+            elif attr_id == ATTR_CHAPTER_COUNT:
+                title.chapter_count = _to_int(value)
+            elif attr_id == ATTR_DISK_SIZE_BYTES:
+                title.size_bytes = _to_int(value)
+            elif attr_id == ATTR_NAME:
+                title.name = value
+            elif attr_id == ATTR_SOURCE_FILE_NAME:
+                title.source_file = value
+            elif attr_id == ATTR_OUTPUT_FILE_NAME:
+                title.output_file = value
+        elif prefix == 'SINFO':
+            title_id, stream_id, attr_id, _, value = data.split(',', 4)
+            key = (int(title_id), int(stream_id))
+            stream = streams.get(key)
+            if stream is None:
+                stream = streams[key] = StreamInfo(key[1])
+            attr_id = int(attr_id)
+            value = _unquote(value)
+            if attr_id == ATTR_TYPE:
+                stream.type = value
+            elif attr_id == ATTR_CODEC_SHORT:
+                stream.codec = value
+            elif attr_id == ATTR_LANG_CODE:
+                stream.language = value
+            elif attr_id == ATTR_LANG_NAME:
+                stream.language_name = value
+        elif prefix == 'CINFO':
+            attr_id, _, value = data.split(',', 2)
+            attr_id = int(attr_id)
+            if attr_id == ATTR_NAME:
+                disc.name = _unquote(value)
+            elif attr_id == ATTR_VOLUME_NAME:
+                disc.volume_name = _unquote(value)
+        elif prefix == 'TCOUNT':
+            disc.title_count = _to_int(data)
+
+    # Streams are only sorted into their titles once every attribute (including the type) has been read
+    for (title_id, _), stream in sorted(streams.items()):
+        title = titles.get(title_id)
+        if title is None:
+            title = titles[title_id] = TitleInfo(title_id)
+        if stream.type == 'Video':
+            title.video_streams.append(stream)
+        elif stream.type == 'Audio':
+            title.audio_streams.append(stream)
+        elif stream.type == 'Subtitles':
+            title.subtitle_streams.append(stream)
+
+    return disc
+
+def _min_cost_assignment(cost):
+    """
+    Solves the assignment problem with the Hungarian algorithm, in O(n^2 * m) time.
+
+    :param cost: A list of n rows, each containing m costs, where n <= m.
+    :return: A list containing the column assigned to each row.
+    """
+    n = len(cost)
+    m = len(cost[0])
+    infinity = float('inf')
+    # Potentials and matching use 1-based indexes, column 0 is a dummy column
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    row_of_column = [0] * (m + 1)
+    way = [0] * (m + 1)
+
+    for row in range(1, n + 1):
+        row_of_column[0] = row
+        column = 0
+        min_value = [infinity] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[column] = True
+            current_row = row_of_column[column]
+            delta = infinity
+            next_column = 0
+            row_cost = cost[current_row - 1]
+            u_row = u[current_row]
+            for j in range(1, m + 1):
+                if not used[j]:
+                    reduced = row_cost[j - 1] - u_row - v[j]
+                    if reduced < min_value[j]:
+                        min_value[j] = reduced
+                        way[j] = column
+                    if min_value[j] < delta:
+                        delta = min_value[j]
+                        next_column = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[row_of_column[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_value[j] -= delta
+            column = next_column
+            if row_of_column[column] == 0:
+                break
+        while column:
+            previous_column = way[column]
+            row_of_column[column] = row_of_column[previous_column]
+            column = previous_column
+
+    assignment = [0] * n
+    for j in range(1, m + 1):
+        if row_of_column[j]:
+            assignment[row_of_column[j] - 1] = j - 1
+    return assignment
+
+def match_titles(disc_info, expected_runtimes, runtime_threshold=10):
+    """
+    Assigns a title to each expected runtime, minimising the total runtime deviation across all of them.
+    Unlike taking the first title that fits, this still finds the right titles when several episodes
+    have similar runtimes.
+
+    Runtimes that have no title within the threshold fall back to the longest title that has not been used.
+
+    :param disc_info: The DiscInfo of the disc.
+    :param expected_runtimes: A list of runtimes in minutes, e.g. one per episode.
+    :param runtime_threshold: The maximum difference in minutes between a title and its expected runtime.
+    :return: A list with the title_id for each expected runtime, -1 if no title could be found.
+    """
+    titles = sorted((title for title in disc_info.titles.values() if title.duration > 0), key=lambda title: title.title_id)
+    if not titles or not expected_runtimes:
+        return [-1] * len(expected_runtimes)
+
+    threshold = runtime_threshold * 60
+    cost = []
+    for expected_runtime in expected_runtimes:
+        expected = expected_runtime * 60
+        row = []
+        for index, title in enumerate(titles):
+            deviation = abs(title.duration - expected)
+            # The title index breaks ties in favour of the lower title_id, as the original titles come before
+            # the decoys on discs with playlist obfuscation
+            row.append(deviation + index * 1e-6 if deviation <= threshold else NO_MATCH_COST)
+        cost.append(row)
+
+    # The assignment needs at least as many titles as runtimes, dummy titles soak up the rest
+    padding = len(expected_runtimes) - len(titles)
+    if padding > 0:
+        for row in cost:
+            row.extend([NO_MATCH_COST] * padding)
+
+    assignment = _min_cost_assignment(cost)
+    title_ids = []
+    used = set()
+    for expected_runtime, row, column in zip(expected_runtimes, cost, assignment):
+        if row[column] < NO_MATCH_COST:
+            title = titles[column]
+            print(f"Found matching runtime title: {title.title_id}, runtime: {title.runtime} minutes (expected {expected_runtime} minutes)")
+            title_ids.append(title.title_id)
+            used.add(title.title_id)
+        else:
+            title_ids.append(-1)
+
+    for index, expected_runtime in enumerate(expected_runtimes):
+        if title_ids[index] != -1:
+            continue
+        remaining = [title for title in titles if title.title_id not in used]
+        if not remaining:
+            print(f"No matching title found for runtime: {expected_runtime} minutes")
+            continue
+        longest = max(remaining, key=lambda title: title.duration)
+        print(f"No exact match found for runtime {expected_runtime} minutes, using highest runtime title: {longest.title_id}, runtime: {longest.runtime} minutes")
+        title_ids[index] = longest.title_id
+        used.add(longest.title_id)
+
+    return title_ids
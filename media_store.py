@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import sqlite3
+from contextlib import closing
+from atomic_file import atomic_write
+
+# Stores the media info of everything that has been ripped in SQLite, indexed by TMDB ID.
+# Adding a title only touches its own rows, instead of rewriting the whole library, and SQLite's
+# journal means a crash part way through a write cannot corrupt the library.
+# export_json still produces the original movie-info.json format.
+# The same database also holds the disc index (disc_index.py) and the image retention (storage.py).
+
+MEDIA_DB = os.getenv('MEDIA_DB', 'media-info.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    kind TEXT NOT NULL,
+    tmdb_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    info TEXT NOT NULL,
+    PRIMARY KEY (kind, tmdb_id)
+);
+CREATE TABLE IF NOT EXISTS seasons (
+    tmdb_id INTEGER NOT NULL,
+    season_number INTEGER NOT NULL,
+    info TEXT NOT NULL,
+    PRIMARY KEY (tmdb_id, season_number)
+);
+"""
+
+def connect(db_file):
+    """
+    Opens a connection to the shared database, close it with contextlib.closing.
+    WAL lets the drive and encode threads (and other processes) read while one of them writes.
+    """
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+def media_kind(media_info):
+    """
+    :return: 'tv' for TV shows and 'movie' for movies, as TMDB IDs are only unique within each kind.
+    """
+    return 'tv' if 'seasons' in media_info else 'movie'
+
+def merge_episodes(stored_episodes, new_episodes):
+    """
+    Combines two episode lists by episode number, the new episodes replace the stored ones.
+    """
+    episodes = {episode['episode_number']: episode for episode in stored_episodes}
+    episodes.update({episode['episode_number']: episode for episode in new_episodes})
+    return [episodes[episode_number] for episode_number in sorted(episodes)]
+
+class MediaStore:
+    def __init__(self, db_file=MEDIA_DB, legacy_json=None):
+        """
+        :param db_file: The path to the SQLite database, it is created if it does not exist.
+        :param legacy_json: A movie-info.json file to import while no media is stored yet.
+        """
+        self.db_file = db_file
+        with closing(connect(self.db_file)) as conn:
+            conn.executescript(SCHEMA)
+            # The database may already exist without any media, DiscIndex and IsoRetention share it
+            empty = conn.execute('SELECT NOT EXISTS (SELECT 1 FROM media)').fetchone()[0]
+        if empty and legacy_json and os.path.exists(legacy_json):
+            imported = self.import_json(legacy_json)
+            print(f"Imported {imported} title(s) from {legacy_json}")
+
+    def add(self, media_info):
+        """
+        Adds a movie or TV show. Movies that are already stored are left unchanged, for TV shows any
+        seasons or episodes that are not stored yet are added (e.g. when a disc of a new season is ripped).
+
+        :param media_info: The dict returned by tmdb_movie_info or tmdb_tv_info.
+        :return: True if anything was added, False otherwise.
+        """
+        kind = media_kind(media_info)
+        # The seasons are stored in their own rows, so adding a season does not rewrite the show
+        show_info = {key: value for key, value in media_info.items() if key not in ('seasons', 'specials')}
+        seasons = list(media_info.get('seasons', []))
+        if media_info.get('specials'):
+            seasons.append(media_info['specials'])
+
+        with closing(connect(self.db_file)) as conn, conn:
+            exists = conn.execute(
+                'SELECT 1 FROM media WHERE kind = ? AND tmdb_id = ?', (kind, media_info['tmdb_id'])
+            ).fetchone()
+            if not exists:
+                conn.execute(
+                    'INSERT INTO media (kind, tmdb_id, title, info) VALUES (?, ?, ?, ?)',
+                    (kind, media_info['tmdb_id'], media_info['title'], json.dumps(show_info))
+                )
+            elif kind == 'movie':
+                print(f"Movie {media_info['title']} has already been added")
+                return False
+
+            added = not exists
+            for season in seasons:
+                row = conn.execute(
+                    'SELECT info FROM seasons WHERE tmdb_id = ? AND season_number = ?',
+                    (media_info['tmdb_id'], season['season_number'])
+                ).fetchone()
+                if row is not None:
+                    stored_season = json.loads(row[0])
+                    episodes = merge_episodes(stored_season['episodes'], season['episodes'])
+                    if episodes == stored_season['episodes']:
+                        continue
+                    season = dict(season, episodes=episodes)
+                conn.execute(
+                    'INSERT OR REPLACE INTO seasons (tmdb_id, season_number, info) VALUES (?, ?, ?)',
+                    (media_info['tmdb_id'], season['season_number'], json.dumps(season))
+                )
+                added = True
+
+        if not added:
+            print(f"TV show {media_info['title']} has already been added")
+        return added
+
+    def get(self, kind, tmdb_id):
+        """
+        :param kind: 'movie' or 'tv'.
+        :return: The stored media info in the same format as tmdb_movie_info/tmdb_tv_info, or None if it is not stored.
+        """
+        with closing(connect(self.db_file)) as conn:
+            row = conn.execute('SELECT info FROM media WHERE kind = ? AND tmdb_id = ?', (kind, tmdb_id)).fetchone()
+            if row is None:
+                return None
+            return self._build(conn, kind, tmdb_id, row[0])
+
+    def _build(self, conn, kind, tmdb_id, info):
+        media_info = json.loads(info)
+        if kind != 'tv':
+            return media_info
+        media_info['seasons'] = []
+        media_info['specials'] = {}
+        for (season_info,) in conn.execute(
+            'SELECT info FROM seasons WHERE tmdb_id = ? ORDER BY season_number', (tmdb_id,)
+        ):
+            season = json.loads(season_info)
+            if season['season_number'] == 0:
+                media_info['specials'] = season
+            else:
+                media_info['seasons'].append(season)
+        return media_info
+
+    def export_json(self, output_file='movie-info.json'):
+        """
+        Writes every stored title to a JSON file, in the format store_media_info used to write.
+        The file is written to a temporary name first, so a crash never leaves a half written export.
+        """
+        with closing(connect(self.db_file)) as conn:
+            media = [
+                self._build(conn, kind, tmdb_id, info)
+                for kind, tmdb_id, info in conn.execute('SELECT kind, tmdb_id, info FROM media ORDER BY rowid').fetchall()
+            ]
+        with atomic_write(output_file) as f:
+            json.dump(media, f, indent=2)
+        return len(media)
+
+    def import_json(self, input_file):
+        """
+        Adds every title from a JSON file in the movie-info.json format.
+
+        :return: The number of titles that were added.
+        """
+        with open(input_file) as f:
+            media = json.load(f)
+        return sum(1 for media_info in media if self.add(media_info))
+
+if __name__ == '__main__':
+    # Usage: python media_store.py <output json file>
+    output_file = sys.argv[1] if len(sys.argv) > 1 else 'movie-info.json'
+    exported = MediaStore().export_json(output_file)
+    print(f"Exported {exported} title(s) to {output_file}")
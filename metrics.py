@@ -0,0 +1,305 @@
+import os
+import re
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from progress import path_size, add_progress_listener
+from atomic_file import atomic_write
+
+# Times every stage of the pipeline (backup, scan, extraction, encode, TMDB lookups...), so it can be seen
+# whether the drives, MakeMKV, HandBrake or TMDB limit the throughput. The totals are exported in the
+# Prometheus text format, to METRICS_TEXTFILE (for the node_exporter textfile collector) and/or on
+# http://<host>:METRICS_PORT/metrics, and every disc gets a JSON summary of its stages in RUN_SUMMARY_DIR.
+# The metrics server only listens on METRICS_HOST (localhost unless set, e.g. 0.0.0.0 for a Prometheus server
+# on another machine).
+
+METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+RUN_SUMMARY_DIR = os.getenv('RUN_SUMMARY_DIR', 'run-summaries')
+
+# Stages range from TMDB requests (well under a second) to encodes of long films (hours)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+
+METRIC_HELP = {
+    'autorip_stage_duration_seconds': ('histogram', 'Time taken by each stage of the pipeline.'),
+    'autorip_stage_runs_total': ('counter', 'Number of times each stage has run, by status.'),
+    'autorip_stage_bytes_total': ('counter', 'Bytes written by each stage.'),
+    'autorip_process_exits_total': ('counter', 'Exit codes of the MakeMKV and HandBrake processes.'),
+    'autorip_process_cpu_seconds_total': ('counter', 'CPU time used by the MakeMKV and HandBrake processes.'),
+    'autorip_discs_total': ('counter', 'Discs that finished encoding, by status.')
+}
+
+class Registry:
+    """
+    Holds the counters and histograms, and renders them in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in pairs]
+            return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self.histograms.items()}
+
+        lines = []
+        for name, (kind, help_text) in METRIC_HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric_name, labels), value in sorted(counters.items()):
+                    if metric_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+            else:
+                for (metric_name, labels), histogram in sorted(histograms.items()):
+                    if metric_name != name:
+                        continue
+                    # The bucket counts are already cumulative, as each value is counted in every bucket it fits
+                    for bound, count in zip(self.buckets, histogram['buckets']):
+                        lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+class Run:
+    """
+    The stages of one disc, written to RUN_SUMMARY_DIR as JSON when the disc is finished.
+    """
+
+    def __init__(self, name=None, stages=None, started=None, processes=None):
+        """
+        :param stages: Stages recorded earlier, e.g. while the disc was being ripped before it was queued.
+        :param processes: The processes recorded with those stages.
+        """
+        self.name = name
+        self.stages = list(stages or [])
+        self.processes = list(processes or [])
+        self.started = started or time.time()
+        self.lock = threading.Lock()
+
+    def record(self, stage):
+        with self.lock:
+            self.stages.append(stage)
+
+    def record_process(self, process):
+        with self.lock:
+            self.processes.append(process)
+
+    def to_dict(self):
+        with self.lock:
+            stages = list(self.stages)
+            processes = list(self.processes)
+        totals = {}
+        for stage in stages:
+            total = totals.setdefault(stage['stage'], {'count': 0, 'seconds': 0.0, 'bytes': 0, 'failures': 0})
+            total['count'] += 1
+            total['seconds'] = round(total['seconds'] + stage['seconds'], 3)
+            total['bytes'] += stage['bytes'] or 0
+            total['failures'] += stage['status'] != 'ok'
+        return {
+            'name': self.name,
+            'started': self.started,
+            'finished': time.time(),
+            'wall_seconds': round(time.time() - self.started, 3),
+            'stages': stages,
+            'totals': totals,
+            'processes': processes
+        }
+
+    def write(self, summary_dir=RUN_SUMMARY_DIR):
+        """
+        :return: The path of the summary file.
+        """
+        os.makedirs(summary_dir, exist_ok=True)
+        safe_name = re.sub(r'[^\w\- ]', '_', self.name or 'disc')
+        summary_file = os.path.join(summary_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}.json")
+        with atomic_write(summary_file) as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return summary_file
+
+_local = threading.local()
+
+def current_run():
+    return getattr(_local, 'run', None)
+
+@contextmanager
+def active_run(run):
+    """
+    Records the stages timed by the calling thread (and threads started with bind_run) in run.
+    """
+    previous = current_run()
+    _local.run = run
+    try:
+        yield run
+    finally:
+        _local.run = previous
+
+def bind_run(target):
+    """
+    Wraps a thread target so its stages are recorded in the same run as the thread that created it.
+    """
+    run = current_run()
+    if run is None:
+        return target
+
+    @functools.wraps(target)
+    def bound(*args, **kwargs):
+        with active_run(run):
+            return target(*args, **kwargs)
+    return bound
+
+class StageTimer:
+    def __init__(self, name, subject=None):
+        self.name = name
+        self.subject = subject
+        self.status = 'ok'
+        self.bytes = None
+
+    def fail(self):
+        self.status = 'failed'
+
+@contextmanager
+def timed_stage(name, subject=None, output_path=None):
+    """
+    Times a stage. The stage is 'ok' unless timer.fail() is called, or it raises an exception ('error').
+
+    :param name: The stage, e.g. 'convert_to_mp4_handbrake'.
+    :param subject: What the stage worked on (e.g. a file name), shown in the run summary.
+    :param output_path: The file or folder the stage writes, its size is recorded as the bytes processed.
+    """
+    timer = StageTimer(name, subject)
+    started = time.time()
+    try:
+        yield timer
+    except BaseException:
+        timer.status = 'error'
+        raise
+    finally:
+        seconds = time.time() - started
+        if timer.bytes is None and output_path:
+            timer.bytes = path_size(output_path)
+        registry.observe('autorip_stage_duration_seconds', {'stage': name}, seconds)
+        registry.inc('autorip_stage_runs_total', {'stage': name, 'status': timer.status})
+        if timer.bytes:
+            registry.inc('autorip_stage_bytes_total', {'stage': name}, timer.bytes)
+        run = current_run()
+        if run is not None:
+            run.record({
+                'stage': name,
+                'subject': str(subject) if subject is not None else None,
+                'status': timer.status,
+                'started': started,
+                'seconds': round(seconds, 3),
+                'bytes': timer.bytes
+            })
+        write_textfile()
+
+def timed(name, ok=lambda result: True):
+    """
+    Decorator version of timed_stage, for functions that report failure through their return value.
+
+    :param ok: Called with the return value, the stage is 'failed' if it returns False.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed_stage(name) as timer:
+                result = function(*args, **kwargs)
+                if not ok(result):
+                    timer.fail()
+                return result
+        return wrapper
+    return decorator
+
+def record_disc(status):
+    registry.inc('autorip_discs_total', {'status': status})
+    write_textfile()
+
+def _record_exit(job):
+    # Called by the progress tracker, the returncode is only set once the process has exited
+    if job['state'] in ('done', 'failed') and 'returncode' in job:
+        registry.inc('autorip_process_exits_total', {'kind': job['kind'], 'returncode': job['returncode']})
+        if job.get('cpu_seconds') is not None:
+            registry.inc('autorip_process_cpu_seconds_total', {'kind': job['kind']}, job['cpu_seconds'])
+        # The tracker calls listeners from the thread that ran the process, so this is the run of its disc.
+        # The CPU use against the cores each process was given shows how the cores should be split (see resources.py)
+        run = current_run()
+        if run is not None:
+            run.record_process({
+                key: job.get(key) for key in (
+                    'name', 'kind', 'returncode', 'started', 'updated', 'cores', 'threads', 'nice',
+                    'cpu_seconds', 'cpu_percent', 'cpu_utilisation'
+                )
+            })
+
+add_progress_listener(_record_exit)
+
+_textfile_lock = threading.Lock()
+
+def write_textfile(textfile=None):
+    textfile = textfile or METRICS_TEXTFILE
+    if not textfile:
+        return
+    # Written to a temporary file first, the textfile collector must never read a half written file
+    with _textfile_lock:
+        try:
+            with atomic_write(textfile) as f:
+                f.write(registry.render())
+        except OSError as e:
+            print(f"Error: could not write the metrics file: {e}")
+
+def start_metrics_server(port, host=METRICS_HOST):
+    """
+    Serves the metrics on http://host:port/metrics from a background thread.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"Metrics available on http://{host}:{server.server_port}/metrics")
+    return server
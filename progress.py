@@ -0,0 +1,269 @@
+import os
+import re
+import csv
+import json
+import time
+import threading
+import subprocess
+from pathlib import Path
+from resources import manager as resource_manager, ProcessUsage
+from atomic_file import atomic_write
+
+# Runs MakeMKV and HandBrake while reading their output line by line, so the progress of every job
+# (percent, MB/s, fps and ETA) can be seen while it runs. Progress is passed to the listeners added with
+# add_progress_listener and written to STATUS_FILE every STATUS_INTERVAL seconds.
+
+STATUS_FILE = os.getenv('STATUS_FILE', 'rip-status.json')
+STATUS_INTERVAL = float(os.getenv('STATUS_INTERVAL', 5))
+
+# A progress line is printed every time a job passes another step of this many percent
+PRINT_STEP = 5
+
+def path_size(path):
+    """
+    :return: The size in bytes of a file, or of every file in a folder, 0 if it does not exist.
+    """
+    path = Path(path)
+    try:
+        if path.is_dir():
+            return sum(file_path.stat().st_size for file_path in path.rglob('*') if file_path.is_file())
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+def format_eta(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{(seconds // 60) % 60:02d}:{seconds % 60:02d}"
+
+class ProgressTracker:
+    def __init__(self, status_file=STATUS_FILE, interval=STATUS_INTERVAL):
+        self.status_file = status_file
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.listeners = []
+        self.last_write = 0
+        self.next_id = 0
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def start(self, name, kind, output_path=None):
+        with self.lock:
+            self.next_id += 1
+            job = {
+                'id': self.next_id,
+                'name': name,
+                'kind': kind,
+                'state': 'running',
+                'operation': '',
+                'percent': 0.0,
+                'mb_per_s': None,
+                'fps': None,
+                'eta_seconds': None,
+                'bytes_written': 0,
+                'started': time.time(),
+                'updated': time.time(),
+                'output_path': str(output_path) if output_path else None
+            }
+            self.jobs[job['id']] = job
+        self._publish(job, force=True)
+        return job
+
+    def update(self, job, **metrics):
+        now = time.time()
+        with self.lock:
+            job.update(metrics)
+            job['updated'] = now
+            # The read/write speed comes from how quickly the output grows, as neither tool reports it
+            if job['output_path'] and now - job.get('_sampled', 0) >= 1:
+                size = path_size(job['output_path'])
+                if '_sampled' in job:
+                    job['mb_per_s'] = round((size - job['bytes_written']) / (now - job['_sampled']) / 1_000_000, 2)
+                job['bytes_written'] = size
+                job['_sampled'] = now
+            # MakeMKV does not report an ETA, so it is estimated from the progress so far
+            if 'eta_seconds' not in metrics and 0 < job['percent'] < 100:
+                elapsed = now - job['started']
+                job['eta_seconds'] = elapsed / job['percent'] * (100 - job['percent'])
+        self._publish(job)
+
+    def finish(self, job, returncode):
+        with self.lock:
+            job['state'] = 'done' if returncode == 0 else 'failed'
+            job['returncode'] = returncode
+            job['updated'] = time.time()
+            if returncode == 0:
+                job['percent'] = 100.0
+                job['eta_seconds'] = 0
+            self.jobs.pop(job['id'], None)
+        self._publish(job, force=True)
+
+    def snapshot(self):
+        with self.lock:
+            return [self._public(job) for job in self.jobs.values()]
+
+    def _public(self, job):
+        return {key: value for key, value in job.items() if not key.startswith('_')}
+
+    def _publish(self, job, force=False):
+        public_job = self._public(job)
+        for listener in list(self.listeners):
+            try:
+                listener(public_job)
+            except Exception as e:
+                print(f"Error: progress listener failed: {e}")
+
+        now = time.time()
+        if not self.status_file or (not force and now - self.last_write < self.interval):
+            return
+        self.last_write = now
+        status = {'updated': now, 'jobs': self.snapshot()}
+        try:
+            with atomic_write(self.status_file) as f:
+                json.dump(status, f, indent=2)
+        except OSError as e:
+            print(f"Error: could not write the status file: {e}")
+
+tracker = ProgressTracker()
+
+def add_progress_listener(listener):
+    """
+    Registers a function that is called with the job dict every time the progress of a job changes.
+    The dict contains 'name', 'kind', 'state', 'operation', 'percent', 'mb_per_s', 'fps', 'eta_seconds' and 'bytes_written'.
+    """
+    tracker.add_listener(listener)
+
+def remove_progress_listener(listener):
+    tracker.remove_listener(listener)
+
+class MakeMKVProgress:
+    """
+    Reads MakeMKV robot output (enabled with --robot --progress=-same).
+    PRGV:current,total,max gives the progress, PRGC/PRGT name the current operation and MSG lines are printed.
+    """
+    kind = 'makemkv'
+
+    def feed(self, line, job):
+        prefix, _, data = line.partition(':')
+        if prefix == 'PRGV':
+            _, total, maximum = data.split(',')
+            if int(maximum):
+                tracker.update(job, percent=round(int(total) * 100 / int(maximum), 1))
+        elif prefix in ('PRGC', 'PRGT'):
+            operation = data.split(',', 2)[-1].strip('"')
+            tracker.update(job, operation=operation)
+        elif prefix == 'MSG':
+            # MSG:code,flags,count,message,format,params... the message and its parameters may contain quoted commas
+            fields = next(csv.reader([data]), [])
+            if len(fields) > 3:
+                print(fields[3])
+
+class HandBrakeProgress:
+    """
+    Reads HandBrake --json output, which prints blocks such as 'Progress: {...}' spread over several lines.
+    """
+    kind = 'handbrake'
+
+    def __init__(self):
+        self.block_name = None
+        self.block_lines = []
+
+    def feed(self, line, job):
+        if self.block_name is None:
+            match = re.match(r'^(\w[\w ]*): \{$', line.strip())
+            if match:
+                self.block_name = match.group(1)
+                self.block_lines = ['{']
+            return
+
+        self.block_lines.append(line)
+        # A block ends with a closing brace at the start of a line
+        if line.rstrip() != '}':
+            return
+        block_name = self.block_name
+        self.block_name = None
+        if block_name != 'Progress':
+            return
+        try:
+            state = json.loads('\n'.join(self.block_lines))
+        except json.JSONDecodeError:
+            return
+        working = state.get('Working')
+        if state.get('State') == 'WORKING' and working:
+            # Progress is for the current pass only, so multi-pass encodes are combined into one percentage
+            pass_count = max(working.get('PassCount', 1), 1)
+            pass_number = min(max(working.get('Pass', 1), 1), pass_count)
+            percent = ((pass_number - 1) + working.get('Progress', 0)) * 100 / pass_count
+            tracker.update(
+                job,
+                operation=f"Encoding pass {pass_number} of {pass_count}",
+                percent=round(percent, 1),
+                fps=working.get('RateAvg') or working.get('Rate'),
+                eta_seconds=working.get('ETASeconds')
+            )
+        elif state.get('State') == 'MUXING':
+            tracker.update(job, operation='Muxing')
+
+def _terminate_when_set(stop_event, process):
+    # Returns once the process has exited by itself, so the thread never outlives it
+    while not stop_event.wait(0.5):
+        if process.poll() is not None:
+            return
+    if process.poll() is None:
+        process.terminate()
+
+def run_with_progress(command, name, parser, output_path=None, stop_event=None):
+    """
+    Runs a command, reading its standard output line by line with parser.
+
+    :param command: The command to run.
+    :param name: The name of the job, shown in the progress and status file.
+    :param parser: A MakeMKVProgress or HandBrakeProgress, to read the output of the command.
+    :param output_path: The file or folder the command writes to, used to measure MB/s.
+    :param stop_event: Optional threading.Event, the process is terminated when it is set.
+    :raises FileNotFoundError: If the program does not exist.
+    :raises subprocess.CalledProcessError: If the command fails, the same as subprocess.run with check=True.
+    """
+    job = tracker.start(name, parser.kind, output_path)
+    last_printed = -PRINT_STEP
+    returncode = -1
+    try:
+        # The cores, threads and priority of the process depend on its kind, see resources.py
+        with resource_manager.lease(parser.kind) as lease, \
+                subprocess.Popen(lease.command(command), stdout=subprocess.PIPE, text=True, bufsize=1, errors='replace',
+                                 **lease.popen_options()) as process:
+            lease.apply(process)
+            if stop_event is not None:
+                threading.Thread(target=_terminate_when_set, args=(stop_event, process), daemon=True).start()
+            usage = ProcessUsage(process.pid, lease.cores)
+            tracker.update(job, **lease.details())
+            for line in process.stdout:
+                parser.feed(line.rstrip('\n'), job)
+                cpu = usage.sample(time.time())
+                if cpu:
+                    tracker.update(job, **cpu)
+                if job['percent'] >= last_printed + PRINT_STEP:
+                    last_printed = job['percent'] - (job['percent'] % PRINT_STEP)
+                    details = [f"{job['percent']:.1f}%"]
+                    if job['mb_per_s'] is not None:
+                        details.append(f"{job['mb_per_s']} MB/s")
+                    if job['fps']:
+                        details.append(f"{job['fps']:.1f} fps")
+                    details.append(f"ETA {format_eta(job['eta_seconds'])}")
+                    print(f"{name}: {' '.join(details)}")
+            # The output has closed, so the process has (nearly) finished, its CPU time can still be read until it is waited for
+            cpu = usage.sample(time.time(), force=True)
+            if cpu:
+                tracker.update(job, **cpu)
+            returncode = process.wait()
+    finally:
+        tracker.finish(job, returncode)
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
@@ -0,0 +1,248 @@
+import os
+import sys
+import time
+import shutil
+import threading
+import subprocess
+from contextlib import contextmanager
+
+# Shares the CPU between the MakeMKV and HandBrake processes. Without it every encode spreads over every core and
+# the decryption feeding the drive is starved, so the drive drops out of streaming mode and has to seek back.
+#   - DISC_CORES are kept free of encodes, MakeMKV may use every core but HandBrake never uses these
+#   - ENCODE_CORES are split between the HandBrake slots (MAX_HANDBRAKE_JOBS), so concurrent encodes do not
+#     share cores, and HandBrake is told to use as many threads as it was given cores (HANDBRAKE_THREADS)
+#   - MakeMKV runs at a normal priority, HandBrake at a lower CPU (nice) and disk (ionice) priority, so reads
+#     from the drive always come first
+# Cores are written as in taskset, e.g. '0' or '0-1,4'. RESOURCE_MANAGER=0 runs every process as before.
+# The CPU time of each process is sampled from /proc/<pid>/stat and added to its progress job (and from there to
+# the run summary and metrics), so the split can be tuned: a cpu_utilisation well below 1 means an encode was
+# given more cores than it can use.
+
+RESOURCE_MANAGER = os.getenv('RESOURCE_MANAGER', '1').lower() not in ('0', 'false', 'no')
+DISC_CORES = os.getenv('DISC_CORES')
+ENCODE_CORES = os.getenv('ENCODE_CORES')
+# 'auto' uses the number of cores given to the encode, 0 leaves it to HandBrake (e.g. when the preset sets its
+# own encoder options, as -x replaces them)
+HANDBRAKE_THREADS = os.getenv('HANDBRAKE_THREADS', 'auto')
+
+# The CPU priority (nice) and ionice class/level of each kind of process, see 'man ionice'
+PRIORITIES = {
+    'makemkv': {'nice': int(os.getenv('MAKEMKV_NICE', 0)), 'io_class': 2, 'io_level': 0},
+    'handbrake': {'nice': int(os.getenv('HANDBRAKE_NICE', 10)), 'io_class': 2, 'io_level': 7}
+}
+
+# How often (in seconds) the CPU time of a running process is read
+SAMPLE_INTERVAL = 1.0
+
+def parse_cores(value):
+    """
+    :param value: A core list such as '0-3,6'.
+    :return: The sorted core numbers.
+    """
+    cores = set()
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cores.update(range(int(first), int(last or first) + 1))
+    return sorted(cores)
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def split_cores(cores, parts):
+    """
+    Splits cores into parts contiguous slices whose sizes differ by at most one.
+    """
+    parts = max(1, min(parts, len(cores)))
+    size, extra = divmod(len(cores), parts)
+    slices = []
+    start = 0
+    for index in range(parts):
+        end = start + size + (index < extra)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+def _tasks(pid):
+    # On Linux the affinity and nice value belong to each thread, so every thread the process has started is changed
+    try:
+        return [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        return [pid]
+
+class ProcessUsage:
+    """
+    Samples the CPU time of a process (and the children it has waited for) from /proc/<pid>/stat.
+    Only available on Linux, sample returns None elsewhere.
+    """
+
+    def __init__(self, pid, cores=None):
+        self.pid = pid
+        self.cores = cores
+        self.started = time.time()
+        self.last_sample = 0
+        self.cpu_seconds = None
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def read(self):
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            return None
+        # The process name is in brackets and may contain spaces, the fields after it start with the state (field 3)
+        fields = stat.rsplit(')', 1)[1].split()
+        utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+        return (utime + stime + cutime + cstime) / self.ticks
+
+    def sample(self, now, force=False):
+        """
+        :param now: time.time(), the sample is skipped if the last one was less than SAMPLE_INTERVAL ago.
+        :return: A dict with the 'cpu_seconds', 'cpu_percent' (of one core) and 'cpu_utilisation' (of the cores
+            the process was given) so far, or None if nothing was sampled.
+        """
+        if not force and now - self.last_sample < SAMPLE_INTERVAL:
+            return None
+        self.last_sample = now
+        cpu_seconds = self.read()
+        if cpu_seconds is None:
+            return None
+        self.cpu_seconds = cpu_seconds
+        elapsed = max(now - self.started, 0.001)
+        usage = {'cpu_seconds': round(cpu_seconds, 2), 'cpu_percent': round(cpu_seconds / elapsed * 100, 1)}
+        if self.cores:
+            usage['cpu_utilisation'] = round(cpu_seconds / elapsed / len(self.cores), 3)
+        return usage
+
+class CoreLease:
+    """
+    The cores, threads and priority one process runs with, see ResourceManager.lease.
+    """
+
+    def __init__(self, kind, cores=None, threads=None, nice=0, io_class=None, io_level=None):
+        self.kind = kind
+        self.cores = cores
+        self.threads = threads
+        self.nice = nice
+        self.io_class = io_class
+        self.io_level = io_level
+
+    def command(self, command):
+        """
+        :return: command with the HandBrake thread count added.
+        """
+        if self.kind != 'handbrake' or not self.threads:
+            return command
+        command = list(command)
+        for option in ('-x', '--encopts'):
+            if option in command:
+                index = command.index(option) + 1
+                if 'threads=' not in command[index]:
+                    command[index] = f"{command[index]}:threads={self.threads}"
+                return command
+        return command + ['-x', f"threads={self.threads}"]
+
+    def popen_options(self):
+        # Windows has no nice values, the priority class is set when the process is created
+        if sys.platform != 'win32' or not self.nice:
+            return {}
+        if self.nice > 0:
+            return {'creationflags': subprocess.IDLE_PRIORITY_CLASS if self.nice >= 19 else subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+        return {'creationflags': subprocess.ABOVE_NORMAL_PRIORITY_CLASS}
+
+    def apply(self, process):
+        """
+        Sets the affinity, nice value and ionice class of a started process. Failures are printed, the process
+        still runs, just without the limits.
+        """
+        try:
+            if self.cores and hasattr(os, 'sched_setaffinity'):
+                for tid in _tasks(process.pid):
+                    os.sched_setaffinity(tid, self.cores)
+            elif self.cores and sys.platform == 'win32':
+                import ctypes
+                mask = sum(1 << core for core in self.cores)
+                ctypes.windll.kernel32.SetProcessAffinityMask(int(process._handle), mask)
+            if self.nice and hasattr(os, 'setpriority'):
+                for tid in _tasks(process.pid):
+                    os.setpriority(os.PRIO_PROCESS, tid, self.nice)
+        except OSError as e:
+            # e.g. the process has already exited, or a negative nice value without the permission to set it
+            print(f"Error: could not set the CPU limits of {self.kind}: {e}")
+        if self.io_class is not None and sys.platform.startswith('linux') and shutil.which('ionice'):
+            subprocess.run(['ionice', '-c', str(self.io_class), '-n', str(self.io_level), '-p', str(process.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def details(self):
+        """
+        :return: The limits, added to the progress job of the process.
+        """
+        return {'cores': self.cores, 'threads': self.threads, 'nice': self.nice}
+
+class ResourceManager:
+    """
+    Hands out the cores of each process. The encode cores are split into one slice per HandBrake slot, an encode
+    takes a free slice for as long as it runs, or every encode core if more encodes run than there are slots.
+    """
+
+    def __init__(self, enabled=RESOURCE_MANAGER, disc_cores=DISC_CORES, encode_cores=ENCODE_CORES, encode_slots=1,
+                 handbrake_threads=HANDBRAKE_THREADS):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.handbrake_threads = handbrake_threads
+        cores = available_cores()
+        if disc_cores is not None:
+            self.disc_cores = parse_cores(disc_cores)
+        else:
+            # One core is enough for the decryption of a single drive, machines with few cores keep all of them for encodes
+            self.disc_cores = cores[:1] if len(cores) >= 4 else []
+        self.encode_cores = parse_cores(encode_cores) if encode_cores else [core for core in cores if core not in self.disc_cores] or cores
+        self.all_cores = sorted(set(cores) | set(self.disc_cores) | set(self.encode_cores))
+        self.configure(encode_slots)
+
+    def configure(self, encode_slots):
+        """
+        :param encode_slots: The most HandBrake processes that run at once, e.g. MAX_HANDBRAKE_JOBS.
+        """
+        with self.lock:
+            self.slices = split_cores(self.encode_cores, encode_slots)
+            self.free_slices = list(range(len(self.slices)))
+
+    @contextmanager
+    def lease(self, kind):
+        """
+        :param kind: The kind of process, 'makemkv' or 'handbrake' (the kind of the progress parser).
+        """
+        if not self.enabled or kind not in PRIORITIES:
+            yield CoreLease(kind)
+            return
+
+        slice_index = None
+        if kind == 'handbrake':
+            with self.lock:
+                slice_index = self.free_slices.pop(0) if self.free_slices else None
+            cores = self.slices[slice_index] if slice_index is not None else self.encode_cores
+            if self.handbrake_threads == 'auto':
+                threads = len(cores)
+            else:
+                threads = int(self.handbrake_threads) or None
+        else:
+            # MakeMKV may use every core, its higher priority keeps it ahead of the encodes on the shared ones
+            cores = self.all_cores
+            threads = None
+        try:
+            yield CoreLease(kind, cores, threads, **PRIORITIES[kind])
+        finally:
+            if slice_index is not None:
+                with self.lock:
+                    self.free_slices.append(slice_index)
+                    self.free_slices.sort()
+
+manager = ResourceManager()
+
+def configure(encode_slots):
+    manager.configure(encode_slots)
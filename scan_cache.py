@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from makemkv_info import DiscInfo
+from file_cache import cache_entries, evict, mark_used
+from atomic_file import atomic_write
+
+# Caches parsed MakeMKV scans of disc images, so encoding an existing ISO again does not need a new scan.
+# Entries are keyed by a fingerprint of the image, so a changed image never matches its old entry.
+
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 64 * 1024
+
+def _sample_file(hasher, path, size):
+    # Hashes evenly spaced blocks instead of the whole file, which would take as long as the scan itself
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_COUNT * SAMPLE_SIZE:
+            hasher.update(f.read())
+            return
+        step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+        for i in range(SAMPLE_COUNT):
+            f.seek(i * step)
+            hasher.update(f.read(SAMPLE_SIZE))
+
+def image_fingerprint(iso_filename):
+    """
+    Fingerprints a disc image from its path, size, modification time and a sample of its content.
+    MakeMKV backups can also be folders, in which case every file in the folder is included.
+
+    :param iso_filename: The path to the image file or backup folder.
+    :return: The fingerprint as a hex string, or None if the image does not exist.
+    """
+    path = Path(iso_filename).resolve()
+    hasher = hashlib.sha256(str(path).encode())
+    try:
+        if path.is_dir():
+            for file_path in sorted(p for p in path.rglob('*') if p.is_file()):
+                stat = file_path.stat()
+                hasher.update(f"{file_path.relative_to(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+                # The IFO files describe the titles, so their content is what the scan depends on
+                if file_path.suffix.upper() in ('.IFO', '.BUP', '.MPLS'):
+                    _sample_file(hasher, file_path, stat.st_size)
+        else:
+            stat = path.stat()
+            hasher.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+            _sample_file(hasher, path, stat.st_size)
+    except OSError:
+        return None
+    return hasher.hexdigest()
+
+class ScanCache:
+    def __init__(self, cache_dir=os.getenv('SCAN_CACHE_DIR', 'scan-cache'),
+                 max_bytes=int(os.getenv('SCAN_CACHE_MAX_BYTES', 50 * 1024 * 1024)),
+                 max_age_days=float(os.getenv('SCAN_CACHE_MAX_AGE_DAYS', 90))):
+        """
+        :param cache_dir: The folder the cached scans are stored in.
+        :param max_bytes: The total size of the cache, the least recently used scans are removed past this.
+        :param max_age_days: Scans that have not been used for this many days are removed.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.lock = threading.Lock()
+
+    def get(self, iso_filename):
+        """
+        :return: The cached DiscInfo for the image, or None if it has not been scanned or has changed since.
+        """
+        fingerprint = image_fingerprint(iso_filename)
+        if fingerprint is None:
+            return None
+        entry_path = self.cache_dir / f"{fingerprint}.json"
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        mark_used(entry_path)
+        print(f"Using cached MakeMKV scan of {iso_filename}.")
+        return DiscInfo.from_dict(entry['disc_info'])
+
+    def put(self, iso_filename, disc_info):
+        """
+        Stores the scan of an image, replacing any older scan of the same path.
+        """
+        fingerprint = image_fingerprint(iso_filename)
+        if fingerprint is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {
+            'iso_filename': str(Path(iso_filename).resolve()),
+            'created': time.time(),
+            'disc_info': disc_info.to_dict()
+        }
+        entry_path = self.cache_dir / f"{fingerprint}.json"
+        with atomic_write(entry_path) as f:
+            json.dump(entry, f)
+
+        with self.lock:
+            self._remove_stale(entry['iso_filename'], entry_path)
+            evict(self.cache_dir, self.max_bytes, self.max_age)
+
+    def _remove_stale(self, iso_filename, current_path):
+        # Older scans of the same path can never be used again, as the image has changed
+        for _, _, entry_path in cache_entries(self.cache_dir):
+            if entry_path == current_path:
+                continue
+            try:
+                with open(entry_path) as f:
+                    if json.load(f)['iso_filename'] == iso_filename:
+                        entry_path.unlink()
+            except (OSError, ValueError, KeyError):
+                continue
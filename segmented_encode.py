@@ -0,0 +1,178 @@
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from job_journal import stream_durations, ffprobe_available
+from encode_cluster import HANDBRAKE_CLI
+
+# Encodes a long title as several chapter ranges in parallel and joins them into one MP4 without re-encoding.
+# Each range is encoded by its own HandBrake process, so a single movie can use every core on the machine.
+
+FFMPEG = os.getenv('FFMPEG', 'ffmpeg')
+
+# The largest difference (in seconds) allowed between the audio and video of a segment, and between
+# the joined file and the sum of the segments
+SYNC_TOLERANCE = float(os.getenv('SEGMENT_SYNC_TOLERANCE', 0.25))
+
+def chapter_durations(input_file, title_id=None, handbrake_cli_path=HANDBRAKE_CLI):
+    """
+    Reads the length of each chapter of a title with a HandBrake scan.
+
+    :param title_id: The MakeMKV title ID, None for single title inputs such as MKV files.
+    :return: A list of chapter durations in seconds, or None if the scan failed.
+    """
+    command = [handbrake_cli_path, "-i", str(input_file), "--scan", "--json"]
+    command.extend(["--title", str(title_id + 1 if title_id is not None else 1)])
+    try:
+        scan = subprocess.run(command, text=True, capture_output=True, errors='replace')
+    except FileNotFoundError:
+        return None
+
+    start = scan.stdout.find('JSON Title Set: ')
+    if start == -1:
+        return None
+    try:
+        title_set, _ = json.JSONDecoder().raw_decode(scan.stdout, start + len('JSON Title Set: '))
+        chapters = title_set['TitleList'][0]['ChapterList']
+    except (json.JSONDecodeError, KeyError, IndexError):
+        return None
+    return [
+        chapter['Duration']['Hours'] * 3600 + chapter['Duration']['Minutes'] * 60 + chapter['Duration']['Seconds']
+        for chapter in chapters
+    ]
+
+def plan_segments(durations, segment_count):
+    """
+    Splits the chapters into at most segment_count ranges of consecutive chapters, keeping the longest range
+    as short as possible so the segments finish at about the same time.
+
+    :param durations: The duration of each chapter.
+    :return: A list of (first_chapter, last_chapter) tuples, numbered from 1 as HandBrake expects.
+    """
+    chapter_count = len(durations)
+    segment_count = max(1, min(segment_count, chapter_count))
+    prefix = [0]
+    for duration in durations:
+        prefix.append(prefix[-1] + duration)
+
+    # best[k][i] is the smallest possible longest segment when the first i chapters are split into k segments
+    infinity = float('inf')
+    best = [[infinity] * (chapter_count + 1) for _ in range(segment_count + 1)]
+    split = [[0] * (chapter_count + 1) for _ in range(segment_count + 1)]
+    best[0][0] = 0
+    for k in range(1, segment_count + 1):
+        for i in range(k, chapter_count + 1):
+            for j in range(k - 1, i):
+                longest = max(best[k - 1][j], prefix[i] - prefix[j])
+                if longest < best[k][i]:
+                    best[k][i] = longest
+                    split[k][i] = j
+
+    segments = []
+    i = chapter_count
+    for k in range(segment_count, 0, -1):
+        j = split[k][i]
+        segments.append((j + 1, i))
+        i = j
+    return segments[::-1]
+
+def segment_in_sync(path):
+    """
+    Checks the audio and video of a segment end together, a gap at the end of a segment becomes a
+    growing offset after the segments are joined.
+    """
+    durations = stream_durations(path)
+    if not durations or durations['video'] is None:
+        return False
+    if durations['audio'] is None:
+        return True
+    drift = abs(durations['video'] - durations['audio'])
+    if drift > SYNC_TOLERANCE:
+        print(f"Audio and video of {Path(path).name} differ by {drift:.3f}s")
+        return False
+    return True
+
+def concat_segments(segment_files, output_file):
+    """
+    Joins the segments into output_file with ffmpeg, copying the streams without re-encoding them.
+    """
+    list_file = Path(segment_files[0]).with_name('segments.txt')
+    with open(list_file, 'w') as f:
+        for segment_file in segment_files:
+            escaped = str(Path(segment_file).resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    command = [FFMPEG, '-v', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', str(list_file),
+               '-map', '0', '-c', 'copy', '-movflags', '+faststart', str(output_file)]
+    try:
+        subprocess.run(command, check=True)
+        return True
+    except FileNotFoundError:
+        print("Error: ffmpeg not found. Please check the path to ffmpeg.")
+    except subprocess.CalledProcessError as e:
+        print(f"Error: ffmpeg failed with error code {e.returncode}.")
+    return False
+
+def segmented_encode(input_file, output_file, encode, title_id=None, chapter_count=0, segment_count=2):
+    """
+    Encodes a title as chapter ranges in parallel and joins them into output_file.
+
+    :param input_file: The image or MKV file to encode.
+    :param output_file: The MP4 file to create.
+    :param encode: The function that encodes one range, called as encode(input_file, output_file, title_id=..., chapters=(first, last)).
+    :param title_id: The MakeMKV title ID, None for MKV files.
+    :param chapter_count: The number of chapters in the title, from the MakeMKV scan.
+    :param segment_count: The number of ranges to encode in parallel.
+    :return: True if output_file was created and the joins were verified, False if the title should be encoded in one piece.
+    """
+    # The segments cannot be checked or joined without ffmpeg and ffprobe, so nothing is encoded
+    missing = [FFMPEG] if shutil.which(FFMPEG) is None else []
+    if not ffprobe_available():
+        missing.append('ffprobe')
+    if missing:
+        print(f"Error: {' and '.join(missing)} not found, {Path(output_file).name} cannot be encoded in segments.")
+        return False
+
+    durations = chapter_durations(input_file, title_id)
+    if not durations or (chapter_count and len(durations) != chapter_count):
+        # Without chapter lengths every chapter is assumed to be the same length
+        durations = [1] * chapter_count
+    segments = plan_segments(durations, segment_count)
+    if len(segments) < 2:
+        return False
+
+    print(f"Encoding {Path(output_file).name} as {len(segments)} segments: {', '.join(f'{first}-{last}' for first, last in segments)}")
+    output_file = Path(output_file)
+    segment_folder = tempfile.mkdtemp(prefix=f".{output_file.stem}.segments.", dir=output_file.parent)
+    try:
+        segment_files = [os.path.join(segment_folder, f"segment{index:03d}.mp4") for index in range(len(segments))]
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix='segment') as executor:
+            futures = [
+                executor.submit(encode, input_file, segment_file, title_id=title_id, chapters=chapters)
+                for segment_file, chapters in zip(segment_files, segments)
+            ]
+            for future in futures:
+                future.result()
+
+        for segment_file in segment_files:
+            if not os.path.exists(segment_file) or not segment_in_sync(segment_file):
+                print(f"Segment {Path(segment_file).name} is missing or out of sync.")
+                return False
+
+        joined_file = os.path.join(segment_folder, 'joined.mp4')
+        if not concat_segments(segment_files, joined_file):
+            return False
+
+        # The joined file must be as long as its parts, otherwise a join dropped or repeated part of a segment
+        expected = sum(stream_durations(segment_file)['format'] for segment_file in segment_files)
+        joined = stream_durations(joined_file)
+        if not joined or abs(joined['format'] - expected) > SYNC_TOLERANCE * len(segments) or not segment_in_sync(joined_file):
+            print(f"Joined file is {joined['format'] if joined else 0:.2f}s long, expected {expected:.2f}s.")
+            return False
+
+        os.replace(joined_file, output_file)
+        return True
+    finally:
+        shutil.rmtree(segment_folder, ignore_errors=True)
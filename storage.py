@@ -0,0 +1,326 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import closing, contextmanager
+from progress import path_size
+from media_store import MEDIA_DB, connect
+from job_queue import JobQueue
+
+# Keeps the iso, mkv and mp4 folders from filling up part way through a disc.
+# Before a disc is backed up, extracted or encoded, the size of its outputs is estimated (the image from the disc,
+# the MKVs from the title sizes MakeMKV reports and the MP4s from the title durations at PRESET_BITRATE_KBPS) and
+# reserved on the volume of each folder. A job that does not fit (leaving MIN_FREE_BYTES free) waits until it does,
+# instead of failing after hours of encoding.
+# With ISO_RETENTION_MAX_BYTES set the images in the iso folder are kept as a cache of that size: the least
+# recently used images are deleted, also when space is needed for a new job. An image is only deleted once every
+# encode of it has been verified (its job is done), and not while another job of it is queued.
+# A job that can never fit (larger than the volume, or nothing running that could free space) fails instead of waiting.
+
+# Fast 1080p30 is a constant quality preset, this is an upper bound of its video and audio bitrate for DVD sources
+PRESET_BITRATE_KBPS = float(os.getenv('PRESET_BITRATE_KBPS', 4000))
+MIN_FREE_BYTES = int(os.getenv('MIN_FREE_BYTES', 1024 ** 3))
+# 0 keeps every image
+ISO_RETENTION_MAX_BYTES = int(os.getenv('ISO_RETENTION_MAX_BYTES', 0))
+# Used for the image when the size of the disc cannot be read, a dual layer DVD
+DISC_SIZE_ESTIMATE = int(os.getenv('DISC_SIZE_ESTIMATE', 8_547_991_552))
+# How long a job that did not fit waits before it is tried again
+ADMISSION_RETRY_SECONDS = float(os.getenv('ADMISSION_RETRY_SECONDS', 300))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS iso_usage (
+    path TEXT PRIMARY KEY,
+    last_used REAL NOT NULL,
+    encoded INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+class InsufficientSpace(Exception):
+    """
+    Raised when the outputs of a job do not fit. The job should be tried again later if retryable is True,
+    otherwise it can never fit (e.g. it is larger than the volume) and should fail.
+    """
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+def estimate_title_bytes(size_bytes, duration, bitrate_kbps=PRESET_BITRATE_KBPS):
+    """
+    :param size_bytes: The size of the title on the disc, from MakeMKV (0 if unknown).
+    :param duration: The length of the title in seconds.
+    :return: A tuple of the estimated (MKV, MP4) sizes in bytes.
+    """
+    mp4_bytes = int((duration or 0) * bitrate_kbps * 1000 / 8)
+    # An encode is never much larger than its source, MakeMKV copies the streams so the MKV is the size of the title
+    if size_bytes:
+        mp4_bytes = min(mp4_bytes, size_bytes)
+    return size_bytes or mp4_bytes, mp4_bytes
+
+def disc_size(path):
+    """
+    :param path: A mounted disc (its files are added up), a device or an image.
+    :return: The size in bytes, or None if it cannot be read.
+    """
+    try:
+        if os.path.isdir(path):
+            return path_size(path) or None
+        with open(path, 'rb') as f:
+            return f.seek(0, os.SEEK_END) or None
+    except OSError:
+        return None
+
+def _existing(folder):
+    # The folders of a new TV season may not exist yet, the space is that of the folder they will be created in
+    folder = Path(folder).absolute()
+    while not folder.exists() and folder.parent != folder:
+        folder = folder.parent
+    return folder
+
+def volume(folder):
+    return os.stat(_existing(folder)).st_dev
+
+def free_bytes(folder):
+    return shutil.disk_usage(_existing(folder)).free
+
+def _normalise(path):
+    return os.path.normcase(os.path.abspath(path))
+
+class IsoRetention:
+    """
+    Deletes the least recently used images once the iso folder is larger than max_bytes.
+    An image can only be deleted once mark_encoded has been called for it, i.e. when its job is done, and while
+    no other job in the queue uses it (e.g. the same disc was inserted again before its first encode finished).
+    """
+
+    def __init__(self, iso_dir, max_bytes=ISO_RETENTION_MAX_BYTES, db_file=MEDIA_DB, queue=None):
+        """
+        :param db_file: The SQLite database the use of each image is stored in, shared with MediaStore.
+        :param queue: The JobQueue, images of its pending and active jobs are never evictable.
+        """
+        self.iso_dir = Path(iso_dir)
+        self.max_bytes = max_bytes
+        self.db_file = db_file
+        self.queue = queue
+        self.lock = threading.Lock()
+        with closing(connect(self.db_file)) as conn:
+            conn.executescript(SCHEMA)
+            # Databases made before evictability was stored
+            if 'encoded' not in [column[1] for column in conn.execute('PRAGMA table_info(iso_usage)')]:
+                conn.execute('ALTER TABLE iso_usage ADD COLUMN encoded INTEGER NOT NULL DEFAULT 0')
+
+    def outstanding_jobs(self):
+        """
+        :return: A Counter of the pending and active jobs in the queue per image.
+        """
+        if self.queue is None:
+            return Counter()
+        return Counter(_normalise(job['iso_filename']) for _, job in self.queue.jobs('pending', 'active') if job.get('iso_filename'))
+
+    def touch(self, path):
+        """
+        Marks an image as used and not evictable, when it is written, queued or its encode starts.
+        """
+        with self.lock, closing(connect(self.db_file)) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO iso_usage (path, last_used, encoded) VALUES (?, ?, 0)', (_normalise(path), time.time()))
+
+    def mark_encoded(self, path):
+        """
+        Marks an image as evictable once its job is done, unless other jobs of it are still in the queue
+        (the last of them to finish marks it). Call it after the job has left the queue.
+
+        :return: True if the image is now evictable.
+        """
+        with self.lock:
+            # Counted under the lock, a job queued after this is touched after this too
+            if self.outstanding_jobs()[_normalise(path)]:
+                return False
+            with closing(connect(self.db_file)) as conn, conn:
+                conn.execute('INSERT OR REPLACE INTO iso_usage (path, last_used, encoded) VALUES (?, ?, 1)', (_normalise(path), time.time()))
+        return True
+
+    def images(self):
+        """
+        :return: A list of dicts with the 'path', 'size', 'last_used' and 'evictable' of every image, least recently used first.
+        """
+        with closing(connect(self.db_file)) as conn:
+            usage = {path: (last_used, encoded) for path, last_used, encoded in conn.execute('SELECT path, last_used, encoded FROM iso_usage')}
+        outstanding = self.outstanding_jobs()
+
+        images = []
+        # MakeMKV backups are folders named like an image, images made by other tools are files
+        for path in self.iso_dir.rglob('*.iso'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            # Images that were never encoded here are not known to be complete and are kept
+            last_used, encoded = usage.get(_normalise(path), (stat.st_mtime, 0))
+            images.append({
+                'path': str(path),
+                'size': path_size(path),
+                'last_used': last_used,
+                'evictable': bool(encoded) and not outstanding[_normalise(path)]
+            })
+        return sorted(images, key=lambda image: image['last_used'])
+
+    def evict(self, bytes_needed=0, device=None):
+        """
+        Deletes evictable images, least recently used first, until the folder is within max_bytes and at least
+        bytes_needed have been freed.
+
+        :param device: Only delete images on this volume (os.stat().st_dev), the one space is needed on.
+        :return: The number of bytes freed.
+        """
+        if not self.max_bytes:
+            return 0
+        with self.lock:
+            images = self.images()
+            to_free = max(sum(image['size'] for image in images) - self.max_bytes, bytes_needed)
+            freed = 0
+            for image in images:
+                if freed >= to_free:
+                    break
+                if not image['evictable'] or (device is not None and volume(image['path']) != device):
+                    continue
+                try:
+                    if os.path.isdir(image['path']):
+                        shutil.rmtree(image['path'])
+                    else:
+                        os.remove(image['path'])
+                except OSError as e:
+                    print(f"Error: could not delete {image['path']}: {e}")
+                    continue
+                with closing(connect(self.db_file)) as conn, conn:
+                    conn.execute('DELETE FROM iso_usage WHERE path = ?', (_normalise(image['path']),))
+                freed += image['size']
+                print(f"Deleted {Path(image['path']).name} ({image['size'] / 1024 ** 3:.1f} GB), it was last used {time.ctime(image['last_used'])}.")
+        return freed
+
+class AdmissionController:
+    """
+    Reserves space for the outputs of the jobs that are running, so two jobs never count on the same free space.
+    """
+
+    def __init__(self, min_free=MIN_FREE_BYTES, retention=None):
+        """
+        :param retention: Optional IsoRetention, images are deleted to make room before a job is deferred.
+        """
+        self.min_free = min_free
+        self.retention = retention
+        self.lock = threading.Lock()
+        # One list of (volume, bytes, outputs) per job that holds a reservation
+        self.reservations = []
+
+    def _outstanding(self, device):
+        # What has been written is already missing from the free space, so only the rest of each reservation counts
+        outstanding = 0
+        for reservation in self.reservations:
+            for reserved_device, needed, outputs in reservation:
+                if reserved_device == device:
+                    written = sum(path_size(path) for pattern in outputs for path in glob.glob(pattern))
+                    outstanding += max(needed - written, 0)
+        return outstanding
+
+    def _shortfalls(self, by_volume):
+        shortfalls = {}
+        for device, (folder, needed, _) in by_volume.items():
+            available = free_bytes(folder) - self._outstanding(device) - self.min_free
+            if needed > available:
+                shortfalls[device] = (folder, needed - available)
+        return shortfalls
+
+    def _acquire(self, needs, name):
+        by_volume = {}
+        for folder, needed, outputs in needs:
+            if needed > 0:
+                device = volume(folder)
+                first_folder, total, all_outputs = by_volume.get(device, (folder, 0, []))
+                by_volume[device] = (first_folder, total + needed, all_outputs + list(outputs))
+
+        with self.lock:
+            for folder, needed, _ in by_volume.values():
+                capacity = shutil.disk_usage(_existing(folder)).total
+                if needed > capacity - self.min_free:
+                    raise InsufficientSpace(f"{name} needs {needed / 1024 ** 3:.1f} GB in {folder}, more than the whole volume", retryable=False)
+
+            shortfalls = self._shortfalls(by_volume)
+            freed = 0
+            if shortfalls and self.retention is not None:
+                for device, (_, missing) in shortfalls.items():
+                    freed += self.retention.evict(missing, device)
+                shortfalls = self._shortfalls(by_volume)
+            if shortfalls:
+                missing = ', '.join(f"{missing / 1024 ** 3:.1f} GB more in {folder}" for folder, missing in shortfalls.values())
+                # Space can only come back from the jobs holding reservations (their estimates are upper bounds
+                # and their images become evictable), without them and without anything to delete it never will
+                busy = any(reserved_device in shortfalls for reservation in self.reservations for reserved_device, _, _ in reservation)
+                raise InsufficientSpace(f"{name} needs {missing}", retryable=busy or freed > 0)
+            reservation = [(device, needed, outputs) for device, (_, needed, outputs) in by_volume.items()]
+            self.reservations.append(reservation)
+        return reservation
+
+    def _release(self, reservation):
+        with self.lock:
+            self.reservations.remove(reservation)
+
+    @contextmanager
+    def reserve(self, needs, name):
+        """
+        Holds the space for a job while it runs. The space its outputs have already taken is not counted twice.
+
+        :param needs: A list of (folder, bytes, outputs) tuples, outputs are the paths (or glob patterns) the
+            bytes are written to, including temporary names. Folders on the same volume are added together.
+        :param name: The job, for the messages.
+        :raises InsufficientSpace: If the outputs do not fit, even after deleting images.
+        """
+        reservation = self._acquire(needs, name)
+        try:
+            yield
+        finally:
+            self._release(reservation)
+
+    @contextmanager
+    def wait(self, needs, name, interval=30):
+        """
+        The same as reserve, but waits until the outputs fit, for stages that cannot be put back in the queue
+        (e.g. the backup of a disc that is in the drive). Encodes finishing can make images evictable meanwhile.
+
+        :raises InsufficientSpace: If the outputs can never fit, nothing is running that could free space.
+        """
+        waiting = False
+        while True:
+            try:
+                reservation = self._acquire(needs, name)
+                break
+            except InsufficientSpace as e:
+                if not e.retryable:
+                    raise
+                if not waiting:
+                    print(f"Waiting for space: {e}.")
+                    waiting = True
+                time.sleep(interval)
+        if waiting:
+            print(f"There is now space for {name}.")
+        try:
+            yield
+        finally:
+            self._release(reservation)
+
+if __name__ == '__main__':
+    # Usage: python storage.py          lists the images in ISO_OUT_DIR, least recently used first
+    #        python storage.py evict    deletes images until ISO_OUT_DIR is within ISO_RETENTION_MAX_BYTES
+    retention = IsoRetention(os.getenv('ISO_OUT_DIR', 'C:\\iso_movies\\'), queue=JobQueue())
+    if len(sys.argv) > 1 and sys.argv[1] == 'evict':
+        print(f"Freed {retention.evict() / 1024 ** 3:.1f} GB")
+    else:
+        images = retention.images()
+        for image in images:
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(image['last_used']))}  {image['size'] / 1024 ** 3:6.1f} GB  "
+                  f"{'evictable' if image['evictable'] else 'kept':<9}  {image['path']}")
+        print(f"{len(images)} image(s), {sum(image['size'] for image in images) / 1024 ** 3:.1f} GB, the limit is "
+              f"{f'{ISO_RETENTION_MAX_BYTES / 1024 ** 3:.1f} GB' if ISO_RETENTION_MAX_BYTES else 'not set'}")
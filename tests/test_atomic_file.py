@@ -0,0 +1,51 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from atomic_file import atomic_write, FILE_MODE
+
+class AtomicWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.path = self.folder / 'status.json'
+
+    def test_writers_of_the_same_file(self):
+        barrier = threading.Barrier(8)
+
+        def write(index):
+            barrier.wait()
+            for _ in range(20):
+                with atomic_write(self.path) as f:
+                    json.dump({'writer': index, 'padding': 'x' * 100_000}, f)
+
+        writers = [threading.Thread(target=write, args=(index,)) for index in range(8)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        # One writer's complete file, and no temporary files left behind
+        self.assertIn(json.loads(self.path.read_text())['writer'], range(8))
+        self.assertEqual([path.name for path in self.folder.iterdir()], ['status.json'])
+
+    def test_failed_write_keeps_the_old_file(self):
+        self.path.write_text('old')
+        with self.assertRaises(ValueError):
+            with atomic_write(self.path) as f:
+                f.write('new')
+                raise ValueError
+        self.assertEqual(self.path.read_text(), 'old')
+        self.assertEqual([path.name for path in self.folder.iterdir()], ['status.json'])
+
+    @unittest.skipIf(os.name == 'nt', 'Windows only has a read-only permission')
+    def test_usual_permissions(self):
+        with atomic_write(self.path, 'wb', fsync=True) as f:
+            f.write(b'data')
+        self.assertEqual(self.path.stat().st_mode & 0o777, FILE_MODE)
+
+if __name__ == '__main__':
+    unittest.main()
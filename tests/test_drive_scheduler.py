@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BENCH_DIR = Path(__file__).resolve().parent.parent / 'benchmarks'
+sys.path.insert(0, str(BENCH_DIR))
+
+from drive_scheduler import discover_drives, parse_drive_lines, run_drive_workers, bind_drive
+from bench_pipeline import write_wrapper
+
+class ParseDriveLinesTest(unittest.TestCase):
+    def test_skips_indexes_without_a_drive(self):
+        drives = parse_drive_lines('DRV:0,2,999,1,"BD-RE DRIVE","BAND_OF_BROTHERS, D1","/dev/sr0"\n'
+                                   'DRV:1,256,999,0,"","",""\n'
+                                   'MSG:5010,0,0,"Failed to open disc","Failed to open disc"\n')
+        self.assertEqual(drives, [{'index': 0, 'state': 2, 'drive_name': 'BD-RE DRIVE', 'disc_name': 'BAND_OF_BROTHERS, D1', 'device': '/dev/sr0'}])
+
+class DriveWorkersTest(unittest.TestCase):
+    """
+    Runs a worker per drive of the fake makemkvcon, the drives are temporary folders standing in for mount points.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.mount_points = [self.folder / f"sr{index}" for index in range(3)]
+        for mount_point in self.mount_points:
+            mount_point.mkdir()
+        disc = self.folder / 'disc.json'
+        disc.write_text(json.dumps({'name': 'Inception', 'volume_name': 'INCEPTION', 'titles': []}))
+        makemkv = write_wrapper(self.folder, 'makemkvcon', BENCH_DIR / 'fake_makemkvcon.py')
+        with mock.patch.dict(os.environ, {'FAKE_DISC': str(disc), 'FAKE_DRIVES': ','.join(map(str, self.mount_points))}):
+            self.drives = discover_drives(makemkv)
+        self.log_dir = self.folder / 'logs'
+        self.stop_event = threading.Event()
+
+    def test_drives_are_listed(self):
+        self.assertEqual([drive['device'] for drive in self.drives], [str(mount_point) for mount_point in self.mount_points])
+        self.assertEqual([drive['index'] for drive in self.drives], [0, 1, 2])
+
+    def test_discs_are_ripped_at_the_same_time(self):
+        lock = threading.Lock()
+        ripping = []
+        finished = []
+
+        def worker(drive):
+            with lock:
+                ripping.append((drive['index'], time.monotonic()))
+            print(f"Ripping the disc in {drive['device']}")
+            # Output from threads started by the worker goes to the same log
+            helper = threading.Thread(target=bind_drive(lambda: print(f"Extracting from {drive['device']}")))
+            helper.start()
+            helper.join()
+            time.sleep(1)
+            with lock:
+                finished.append((drive['index'], time.monotonic()))
+
+        console = sys.stdout
+        workers = threading.Thread(target=run_drive_workers, args=(self.drives, worker, self.log_dir, self.stop_event))
+        workers.start()
+        self.addCleanup(workers.join, 10)
+        self.addCleanup(self.stop_event.set)
+        for mount_point in self.mount_points:
+            (mount_point / 'VIDEO_TS').mkdir()
+        deadline = time.monotonic() + 20
+        while len(finished) < len(self.drives) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.stop_event.set()
+        workers.join(10)
+        self.assertFalse(workers.is_alive())
+        self.assertIs(sys.stdout, console)
+
+        self.assertEqual(sorted(index for index, _ in finished), [0, 1, 2])
+        # Every disc was being ripped before the first one finished
+        self.assertLess(max(started for _, started in ripping), min(ended for _, ended in finished))
+        for drive in self.drives:
+            log = (self.log_dir / f"drive-{drive['index']}.log").read_text().splitlines()
+            self.assertIn(f"Ripping the disc in {drive['device']}", log)
+            self.assertIn(f"Extracting from {drive['device']}", log)
+            for other in self.drives:
+                if other is not drive:
+                    self.assertFalse([line for line in log if other['device'] in line], log)
+
+if __name__ == '__main__':
+    unittest.main()
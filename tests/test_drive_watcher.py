@@ -0,0 +1,87 @@
+import time
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import drive_watcher
+from drive_watcher import watch_drive
+
+class WatchDriveTest(unittest.TestCase):
+    """
+    Simulates a disc being mounted and unmounted by filling and emptying a temporary mount point.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.mount_point = self.folder / 'cdrom'
+        self.mount_point.mkdir()
+        self.stop_event = threading.Event()
+        self.insertions = queue.Queue()
+
+    def start(self, **kwargs):
+        def watch():
+            for drive_path in watch_drive(str(self.mount_point), stop_event=self.stop_event, **kwargs):
+                self.insertions.put(drive_path)
+
+        self.thread = threading.Thread(target=watch, daemon=True)
+        self.thread.start()
+        self.addCleanup(self.stop_event.set)
+
+    def mount(self):
+        (self.mount_point / 'VIDEO_TS').mkdir()
+
+    def unmount(self):
+        (self.mount_point / 'VIDEO_TS').rmdir()
+
+    def stop(self):
+        """
+        :return: How long the watcher took to return once it was stopped.
+        """
+        started = time.monotonic()
+        self.stop_event.set()
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        return time.monotonic() - started
+
+    def check_insertions(self):
+        self.mount()
+        self.assertEqual(self.insertions.get(timeout=5), str(self.mount_point))
+        # A disc that stays mounted is only reported once
+        with self.assertRaises(queue.Empty):
+            self.insertions.get(timeout=0.5)
+        self.unmount()
+        time.sleep(0.2)
+        self.mount()
+        self.assertEqual(self.insertions.get(timeout=5), str(self.mount_point))
+
+    def test_mount_and_unmount(self):
+        self.start(min_interval=0.05, max_interval=30, settle_time=0.1)
+        self.check_insertions()
+        self.assertLess(self.stop(), 2)
+
+    def test_polling_fallback(self):
+        with mock.patch.object(drive_watcher, '_load_libc', return_value=None):
+            self.start(min_interval=0.05, max_interval=0.2, settle_time=0.1)
+            self.check_insertions()
+        self.assertLess(self.stop(), 2)
+
+    def test_stop_during_a_long_backoff(self):
+        # With nothing mounted the backoff reaches max_interval, the stop is still noticed within STOP_CHECK_INTERVAL
+        self.start(min_interval=5, max_interval=30, settle_time=0)
+        time.sleep(0.5)
+        self.assertLess(self.stop(), drive_watcher.STOP_CHECK_INTERVAL + 1)
+
+    def test_stop_while_settling(self):
+        self.start(min_interval=0.05, settle_time=30)
+        self.mount()
+        time.sleep(0.5)
+        self.assertLess(self.stop(), 2)
+        self.assertTrue(self.insertions.empty())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import shutil
+import time
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BENCH_DIR = Path(__file__).resolve().parent.parent / 'benchmarks'
+sys.path.insert(0, str(BENCH_DIR))
+
+import progress
+import encode_cluster
+from encode_cluster import Coordinator, start_coordinator, submit_and_wait, run_worker, handbrake_command, _request
+from bench_pipeline import write_wrapper
+from fake_media import write_fake_video, read_fake_duration
+
+TOKEN = 'test-token'
+
+class CoordinatorTest(unittest.TestCase):
+    def test_refuses_outputs_outside_the_output_folders(self):
+        coordinator = Coordinator(['/srv/mp4'])
+        coordinator.submit({'input': '/srv/iso/a.iso', 'output': '/srv/mp4/a.mp4'})
+        for output in ('/etc/passwd', '/srv/mp4/../iso/a.mp4', '/srv/mp4-other/a.mp4'):
+            with self.assertRaises(ValueError):
+                coordinator.submit({'input': '/srv/iso/a.iso', 'output': output})
+
+    def test_finished_jobs_are_pruned(self):
+        coordinator = Coordinator(['/srv/mp4'], finished_job_seconds=0)
+        job_id = coordinator.submit({'input': '/srv/iso/a.iso', 'output': '/srv/mp4/a.mp4'})
+        coordinator.claim('worker')
+        coordinator.complete('worker', job_id, True)
+        time.sleep(0.01)
+        self.assertEqual(coordinator.status(), [])
+
+    def test_handbrake_command(self):
+        command = handbrake_command('a.iso', 'a.mp4', title_id=2, chapters=(3, 5), handbrake_cli_path='HandBrakeCLI')
+        self.assertEqual(command, ['HandBrakeCLI', '-i', 'a.iso', '-o', 'a.mp4', '--preset', 'Fast 1080p30', '--json', '--title', '3', '--chapters', '3-5'])
+
+class ClusterTest(unittest.TestCase):
+    """
+    Runs a coordinator and several workers on localhost, with the fake HandBrake from the benchmarks.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.mp4_folder = self.folder / 'mp4'
+        self.mp4_folder.mkdir()
+        self.handbrake = write_wrapper(self.folder, 'HandBrakeCLI', BENCH_DIR / 'fake_handbrake.py')
+        patches = [
+            mock.patch.object(progress.tracker, 'status_file', str(self.folder / 'status.json')),
+            mock.patch.object(encode_cluster, 'HEARTBEAT_INTERVAL', 0.2)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.coordinator, self.server = start_coordinator(0, [str(self.mp4_folder)], '127.0.0.1', TOKEN)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.stop_event = threading.Event()
+
+    def start_workers(self, count):
+        workers = []
+        for index in range(count):
+            worker = threading.Thread(target=run_worker, args=(self.url, f"worker-{index}"),
+                                      kwargs={'poll_interval': 0.1, 'stop_event': self.stop_event, 'handbrake_cli_path': self.handbrake, 'token': TOKEN},
+                                      daemon=True)
+            worker.start()
+            workers.append(worker)
+
+        def stop():
+            self.stop_event.set()
+            for worker in workers:
+                worker.join(10)
+        self.addCleanup(stop)
+
+    def source(self, name, duration):
+        path = self.folder / f"{name}.mkv"
+        write_fake_video(path, duration, 1024 * 1024, 1000)
+        return str(path)
+
+    def test_several_workers(self):
+        self.start_workers(3)
+        jobs = {}
+
+        def submit(index):
+            output = self.mp4_folder / f"episode-{index}.mp4"
+            jobs[index] = submit_and_wait(self.url, {'input': self.source(f"episode-{index}", 600 + index), 'output': str(output), 'preset': 'Fast 1080p30'},
+                                          poll_interval=0.1, token=TOKEN)
+
+        with mock.patch.dict(os.environ, {'FAKE_ENCODE_SPEED': '600'}):
+            submitters = [threading.Thread(target=submit, args=(index,)) for index in range(6)]
+            for submitter in submitters:
+                submitter.start()
+            for submitter in submitters:
+                submitter.join(60)
+
+        self.assertEqual(sorted(jobs), list(range(6)))
+        for index, job in jobs.items():
+            self.assertEqual(job['state'], 'done', job['error'])
+            self.assertEqual(read_fake_duration(self.mp4_folder / f"episode-{index}.mp4"), 600 + index)
+        self.assertGreater(len({job['worker'] for job in jobs.values()}), 1)
+        # Only the final outputs are left, every worker removed its partial file
+        self.assertEqual(sorted(path.name for path in self.mp4_folder.iterdir()), [f"episode-{index}.mp4" for index in range(6)])
+
+    def test_requests_need_the_token(self):
+        self.assertEqual(_request(f"{self.url}/jobs", token='wrong')[0], 401)
+        self.assertEqual(_request(f"{self.url}/jobs", token=TOKEN)[0], 200)
+
+    def test_submit_outside_the_output_folders(self):
+        with self.assertRaises(OSError):
+            submit_and_wait(self.url, {'input': self.source('movie', 60), 'output': str(self.folder / 'movie.mp4')}, token=TOKEN)
+
+    def test_reassigned_job_stops_handbrake(self):
+        started = threading.Event()
+        finished = []
+
+        def listener(job):
+            if job['name'] == 'Encode movie.mp4':
+                started.set()
+                if job['state'] != 'running':
+                    finished.append(job)
+        progress.tracker.add_listener(listener)
+        self.addCleanup(progress.tracker.remove_listener, listener)
+
+        self.start_workers(1)
+        output = self.mp4_folder / 'movie.mp4'
+        # About a minute to encode, unless the worker stops HandBrake
+        with mock.patch.dict(os.environ, {'FAKE_ENCODE_SPEED': '100'}):
+            job_id = self.coordinator.submit({'input': self.source('movie', 6000), 'output': str(output), 'preset': 'Fast 1080p30'})
+            self.assertTrue(started.wait(10))
+            # The coordinator gives the job to another worker, the next heartbeat gets a 410
+            with self.coordinator.lock:
+                self.coordinator.jobs[job_id]['worker'] = 'another-worker'
+            deadline = time.time() + 10
+            while not finished and time.time() < deadline:
+                time.sleep(0.05)
+        self.assertEqual(len(finished), 1)
+        self.assertNotEqual(finished[0]['returncode'], 0)
+        self.assertFalse(output.exists())
+
+if __name__ == '__main__':
+    unittest.main()
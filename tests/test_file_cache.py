@@ -0,0 +1,40 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from file_cache import evict, mark_used
+
+class EvictTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        now = time.time()
+        # a was used the longest ago, c most recently
+        for age, name in ((300, 'a'), (200, 'b'), (100, 'c')):
+            path = self.folder / f"{name}.json"
+            path.write_bytes(b'x' * 100)
+            os.utime(path, (now - age, now - age))
+
+    def remaining(self):
+        return sorted(path.stem for path in self.folder.glob('*.json'))
+
+    def test_least_recently_used_first(self):
+        mark_used(self.folder / 'a.json')
+        evict(self.folder, 200)
+        self.assertEqual(self.remaining(), ['a', 'c'])
+
+    def test_max_age(self):
+        evict(self.folder, 10_000, max_age=150)
+        self.assertEqual(self.remaining(), ['c'])
+
+    def test_other_files_are_kept(self):
+        (self.folder / '.a.json.tmp').write_bytes(b'x' * 1000)
+        evict(self.folder, 0)
+        self.assertEqual(self.remaining(), [])
+        self.assertTrue((self.folder / '.a.json.tmp').exists())
+
+if __name__ == '__main__':
+    unittest.main()
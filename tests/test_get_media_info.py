@@ -0,0 +1,91 @@
+import sys
+import copy
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+import get_media_info
+from get_media_info import fetch_tv_seasons
+from tmdb_cache import CachedSession
+from tmdb_stub import TMDBStub
+
+def without_episodes(tv_show):
+    tv_info = copy.deepcopy(tv_show)
+    for season in tv_info['seasons'] + [tv_info['specials']]:
+        season['episodes'] = []
+    return tv_info
+
+def stored_episode(episode, runtime):
+    # test-tvshow.json was stored before episode runtimes were kept and when the name was stored as 'name'
+    episode = dict(episode, runtime=runtime, episode_name=episode['name'])
+    del episode['name']
+    return episode
+
+class FetchTVSeasonsTest(unittest.TestCase):
+    """
+    Fetches the seasons of the show in test-tvshow.json from benchmarks/tmdb_stub.py.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        with open(ROOT / 'test-tvshow.json') as f:
+            self.tv_show = json.load(f)[0]
+
+    def start_stub(self, tv_show, latency=0.0):
+        fixture = self.folder / 'fixture.json'
+        fixture.write_text(json.dumps([tv_show]))
+        stub = TMDBStub([fixture], latency=latency)
+        base_url = stub.start()
+        self.addCleanup(stub.stop)
+        patch = mock.patch.object(get_media_info, 'TMDB_BASE_URL', base_url)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return stub
+
+    def session(self):
+        # A cache of its own, so nothing is answered from an earlier test
+        session = CachedSession(requests.Session(), cache_dir=self.folder / 'cache')
+        self.addCleanup(session.close)
+        return session
+
+    def test_same_shape_as_the_stored_show(self):
+        stub = self.start_stub(self.tv_show)
+        tv_info = fetch_tv_seasons(without_episodes(self.tv_show), [0, 1], tmdb_api_key='key', session=self.session())
+
+        expected = copy.deepcopy(self.tv_show)
+        for season in expected['seasons'] + [expected['specials']]:
+            season['episodes'] = [stored_episode(episode, stub.episode_runtime) for episode in season['episodes']]
+        self.assertEqual(tv_info, expected)
+        self.assertEqual(stub.request_counts(), {'tv/season': 2})
+
+    def test_only_the_requested_seasons(self):
+        stub = self.start_stub(self.tv_show)
+        tv_info = fetch_tv_seasons(without_episodes(self.tv_show), [1, 7], tmdb_api_key='key', session=self.session())
+        self.assertEqual(len(tv_info['seasons'][0]['episodes']), len(self.tv_show['seasons'][0]['episodes']))
+        self.assertEqual(tv_info['specials']['episodes'], [])
+        # Season 7 does not exist, so it is not requested
+        self.assertEqual(stub.request_counts(), {'tv/season': 1})
+
+    def test_concurrency_limit(self):
+        tv_show = copy.deepcopy(self.tv_show)
+        tv_show['seasons'] = [dict(tv_show['seasons'][0], season_number=number, season_id=number) for number in range(1, 7)]
+        stub = self.start_stub(tv_show, latency=0.2)
+
+        tv_info = fetch_tv_seasons(without_episodes(tv_show), range(7), tmdb_api_key='key', session=self.session(), max_concurrency=2)
+        # One request per season, never more than two at once
+        self.assertEqual(stub.request_counts(), {'tv/season': 7})
+        self.assertEqual(stub.peak_concurrency(), 2)
+        for season in tv_info['seasons']:
+            self.assertEqual(len(season['episodes']), len(self.tv_show['seasons'][0]['episodes']))
+
+if __name__ == '__main__':
+    unittest.main()
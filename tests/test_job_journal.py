@@ -0,0 +1,102 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import job_journal
+from job_journal import JobJournal, verify_output
+from job_queue import JobQueue
+
+class VerifyOutputTest(unittest.TestCase):
+    """
+    Checks outputs with the duration ffprobe would report patched in.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.output = self.folder / 'Inception.mp4'
+        self.output.write_bytes(b'\0' * 1024)
+
+    def verify(self, duration, expected_duration=None):
+        with mock.patch.object(job_journal, 'container_duration', return_value=duration):
+            return verify_output(self.output, expected_duration)
+
+    def test_missing_or_empty(self):
+        self.assertFalse(verify_output(self.folder / 'missing.mp4'))
+        empty = self.folder / 'empty.mp4'
+        empty.touch()
+        self.assertFalse(verify_output(empty))
+
+    def test_duration_tolerance(self):
+        # 2% of the title, at least 5 seconds
+        self.assertTrue(self.verify(8880 - 170, 8880))
+        self.assertFalse(self.verify(8880 - 180, 8880))
+        self.assertTrue(self.verify(8880 + 170, 8880))
+        self.assertTrue(self.verify(96, 100))
+        self.assertFalse(self.verify(94, 100))
+        self.assertTrue(self.verify(10, None))
+
+    def test_unreadable_or_without_ffprobe(self):
+        self.assertFalse(self.verify(None, 8880))
+        # Without ffprobe only the size is checked
+        self.assertTrue(self.verify(False, 8880))
+
+class JobJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.queue = JobQueue(self.folder / 'jobs', poll_interval=0.1)
+
+    def test_resumes_at_the_first_incomplete_stage(self):
+        journal = JobJournal({'name': 'Friends'})
+        self.assertEqual(journal.resume_stage(), 'backup')
+        for stage in ('backup', 'scan', 'match'):
+            journal.complete(stage)
+        journal.complete('extract:Friends - s01e01')
+        journal.start('extract:Friends - s01e02')
+        self.assertEqual(journal.resume_stage(), 'extract')
+
+        journal.complete('extract:Friends - s01e02')
+        journal.complete('encode:Friends - s01e01')
+        journal.start('encode:Friends - s01e02')
+        self.assertEqual(journal.resume_stage(), 'encode')
+        journal.complete('encode:Friends - s01e02')
+        journal.complete('metadata')
+        self.assertIsNone(journal.resume_stage())
+
+    def test_saved_with_the_job(self):
+        self.queue.put({'name': 'Inception'})
+        job_id, job = self.queue.claim()
+        journal = JobJournal(job, self.queue, job_id)
+        journal.complete('backup', path='Inception.iso', size=1024)
+        journal.start('scan')
+
+        # After a crash the job is claimed again with its journal
+        self.queue.recover()
+        job_id, job = self.queue.claim()
+        journal = JobJournal(job, self.queue, job_id)
+        self.assertEqual(journal.resume_stage(), 'scan')
+        self.assertEqual(journal.details('backup')['size'], 1024)
+
+    def test_output_complete(self):
+        journal = JobJournal({'name': 'Inception'})
+        output = self.folder / 'Inception.mp4'
+        output.write_bytes(b'\0' * 1024)
+        # Not recorded by the journal, so it is verified, and recorded once it passes
+        with mock.patch.object(job_journal, 'container_duration', return_value=8880) as container_duration:
+            self.assertTrue(journal.output_complete('encode:Inception', output, 8880))
+            self.assertTrue(journal.is_complete('encode:Inception'))
+            # Recorded outputs of the same size are not probed again
+            self.assertTrue(journal.output_complete('encode:Inception', output, 8880))
+        self.assertEqual(container_duration.call_count, 1)
+
+        # Truncated after it was recorded
+        output.write_bytes(b'\0' * 512)
+        with mock.patch.object(job_journal, 'container_duration', return_value=4000):
+            self.assertFalse(journal.output_complete('encode:Inception', output, 8880))
+        self.assertFalse(output.exists())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from job_queue import JobQueue
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.queue = JobQueue(self.folder / 'jobs', poll_interval=0.1)
+
+    def states(self):
+        return {state: [job['name'] for _, job in self.queue.jobs(state)] for state in ('pending', 'active', 'done', 'failed')}
+
+    def test_jobs_are_claimed_in_order(self):
+        for name in ('first', 'second'):
+            self.queue.put({'name': name})
+        self.assertEqual(self.queue.pending_count(), 2)
+        self.assertEqual(self.queue.claim()[1]['name'], 'first')
+        self.assertEqual(self.queue.claim()[1]['name'], 'second')
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.states(), {'pending': [], 'active': ['first', 'second'], 'done': [], 'failed': []})
+
+    def test_complete_and_fail(self):
+        for name in ('done', 'failed'):
+            self.queue.put({'name': name})
+        done_id, _ = self.queue.claim()
+        failed_id, _ = self.queue.claim()
+        self.queue.complete(done_id)
+        self.queue.fail(failed_id, RuntimeError('HandBrake failed'))
+        self.assertEqual(self.states(), {'pending': [], 'active': [], 'done': ['done'], 'failed': ['failed']})
+        self.assertEqual(dict(self.queue.jobs('failed'))[failed_id]['error'], 'HandBrake failed')
+
+    def test_deferred_jobs_wait_until_their_retry_time(self):
+        self.queue.put({'name': 'deferred'})
+        job_id, job = self.queue.claim()
+        job['progress'] = 'scanned'
+        self.queue.update(job_id, job)
+        self.queue.defer(job_id, 0.3)
+        self.assertEqual(self.states()['pending'], ['deferred'])
+        self.assertIsNone(self.queue.claim())
+        # Later jobs are not held up by it
+        self.queue.put({'name': 'later'})
+        self.assertEqual(self.queue.claim()[1]['name'], 'later')
+
+        time.sleep(0.3)
+        claimed_id, claimed = self.queue.claim()
+        self.assertEqual(claimed_id, job_id)
+        self.assertEqual(claimed['progress'], 'scanned')
+
+    def test_recover_after_a_crash(self):
+        self.queue.put({'name': 'interrupted'})
+        self.queue.put({'name': 'waiting'})
+        job_id, job = self.queue.claim()
+        job['journal'] = {'backup': {'state': 'complete'}}
+        self.queue.update(job_id, job)
+        # A write that was cut short leaves a temporary file, which is never taken for a job
+        (self.folder / 'jobs' / 'pending' / f".{job_id}.json.crash.tmp").write_text('{"name": "inter')
+
+        # The process is restarted, the active job goes back to the front of the queue with its progress
+        queue = JobQueue(self.folder / 'jobs', poll_interval=0.1)
+        self.assertEqual(queue.recover(), 1)
+        self.assertEqual(queue.pending_count(), 2)
+        self.assertEqual(queue.claim(), (job_id, job))
+        self.assertEqual(queue.claim()[1]['name'], 'waiting')
+        self.assertEqual(queue.recover(), 2)
+
+    def test_wait_for_job(self):
+        stop_event = threading.Event()
+        claimed = []
+        waiter = threading.Thread(target=lambda: claimed.append(self.queue.wait_for_job(stop_event)))
+        waiter.start()
+        time.sleep(0.2)
+        self.queue.put({'name': 'added'})
+        waiter.join(5)
+        self.assertEqual(claimed[0][1]['name'], 'added')
+
+        stop_event.set()
+        self.assertIsNone(self.queue.wait_for_job(stop_event))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import random
+import unittest
+from itertools import permutations
+from makemkv_info import DiscInfo, TitleInfo, parse_robot_output, match_titles, _min_cost_assignment
+
+# Lines as printed by 'makemkvcon info --robot', names and languages containing commas are quoted
+ROBOT_OUTPUT = '''MSG:1005,0,1,"MakeMKV v1.17.5 linux(x64-release) started","%1 started","MakeMKV v1.17.5 linux(x64-release)"
+TCOUNT:2
+CINFO:1,6209,"DVD disc"
+CINFO:2,0,"Band of Brothers, Disc 1"
+CINFO:32,0,"BAND_OF_BROTHERS_D1"
+TINFO:0,2,0,"Currahee, Part One"
+TINFO:0,8,0,"12"
+TINFO:0,9,0,"1:09:52"
+TINFO:0,10,0,"2.1 GB"
+TINFO:0,11,0,"2254857830"
+TINFO:0,16,0,"1.pgc"
+TINFO:0,27,0,"Band_of_Brothers,_Disc_1_t00.mkv"
+SINFO:0,0,1,6201,"Video"
+SINFO:0,0,6,0,"Mpeg2"
+SINFO:0,1,1,6202,"Audio"
+SINFO:0,1,3,0,"eng"
+SINFO:0,1,4,0,"English, Director's Commentary"
+SINFO:0,1,6,0,"AC3"
+SINFO:0,2,1,6203,"Subtitles"
+SINFO:0,2,3,0,"fra"
+TINFO:1,2,0,"Day of Days"
+TINFO:1,8,0,"9"
+TINFO:1,9,0,"52:31"
+TINFO:1,11,0,"not a number"
+MSG:5011,0,0,"Operation successfully completed","Operation successfully completed"
+'''
+
+def disc_with_runtimes(*minutes):
+    return DiscInfo(titles={title_id: TitleInfo(title_id, duration=runtime * 60) for title_id, runtime in enumerate(minutes)})
+
+def brute_force_cost(cost):
+    n = len(cost)
+    return min(sum(cost[row][column] for row, column in enumerate(columns)) for columns in permutations(range(len(cost[0])), n))
+
+class ParseRobotOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.disc = parse_robot_output(ROBOT_OUTPUT)
+
+    def test_disc_attributes(self):
+        self.assertEqual(self.disc.name, 'Band of Brothers, Disc 1')
+        self.assertEqual(self.disc.volume_name, 'BAND_OF_BROTHERS_D1')
+        self.assertEqual(self.disc.title_count, 2)
+        self.assertEqual(sorted(self.disc.titles), [0, 1])
+
+    def test_title_attributes_keep_quoted_commas(self):
+        title = self.disc.titles[0]
+        self.assertEqual(title.name, 'Currahee, Part One')
+        self.assertEqual(title.output_file, 'Band_of_Brothers,_Disc_1_t00.mkv')
+        self.assertEqual(title.duration, 69 * 60 + 52)
+        self.assertEqual(title.runtime, 69)
+        self.assertEqual(title.chapter_count, 12)
+        self.assertEqual(title.size_bytes, 2254857830)
+        self.assertEqual(title.source_file, '1.pgc')
+
+    def test_short_durations_and_bad_numbers(self):
+        title = self.disc.titles[1]
+        self.assertEqual(title.duration, 52 * 60 + 31)
+        self.assertEqual(title.size_bytes, 0)
+
+    def test_streams_are_sorted_by_type(self):
+        title = self.disc.titles[0]
+        self.assertEqual([stream.codec for stream in title.video_streams], ['Mpeg2'])
+        self.assertEqual(len(title.audio_streams), 1)
+        self.assertEqual(title.audio_streams[0].language, 'eng')
+        self.assertEqual(title.audio_streams[0].language_name, "English, Director's Commentary")
+        self.assertEqual([stream.language for stream in title.subtitle_streams], ['fra'])
+
+    def test_round_trip(self):
+        self.assertEqual(DiscInfo.from_dict(self.disc.to_dict()), self.disc)
+
+class MatchTitlesTest(unittest.TestCase):
+    def test_similar_runtimes(self):
+        # First fit would give the 52 minute episode the 55 minute title and leave the 56 minute one without a match
+        disc = disc_with_runtimes(55, 50)
+        self.assertEqual(match_titles(disc, [52, 56], runtime_threshold=4), [1, 0])
+
+    def test_ties_prefer_the_lower_title_id(self):
+        disc = disc_with_runtimes(45, 45, 45)
+        self.assertEqual(match_titles(disc, [45, 45], runtime_threshold=4), [0, 1])
+
+    def test_fewer_titles_than_episodes(self):
+        disc = disc_with_runtimes(50, 60)
+        self.assertEqual(match_titles(disc, [50, 60, 55], runtime_threshold=4), [0, 1, -1])
+
+    def test_falls_back_to_the_longest_unused_title(self):
+        disc = disc_with_runtimes(5, 130, 20)
+        self.assertEqual(match_titles(disc, [95], runtime_threshold=10), [1])
+        self.assertEqual(match_titles(disc, [20, 95], runtime_threshold=10), [2, 1])
+
+    def test_titles_without_a_duration_are_ignored(self):
+        disc = disc_with_runtimes(0, 0)
+        self.assertEqual(match_titles(disc, [45]), [-1])
+        self.assertEqual(match_titles(disc_with_runtimes(45), []), [])
+
+class MinCostAssignmentTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(5)
+        for _ in range(300):
+            rows = rng.randint(1, 5)
+            columns = rng.randint(rows, 6)
+            cost = [[rng.choice([rng.randint(0, 50), 10 ** 9]) for _ in range(columns)] for _ in range(rows)]
+            assignment = _min_cost_assignment(cost)
+            self.assertEqual(len(set(assignment)), rows)
+            self.assertEqual(sum(cost[row][column] for row, column in enumerate(assignment)), brute_force_cost(cost))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from disc_index import DiscIndex
+from media_store import MediaStore
+
+ROOT = Path(__file__).resolve().parent.parent
+
+class LegacyImportTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.db_file = str(self.folder / 'media-info.db')
+        with open(ROOT / 'test-movie.json') as f:
+            self.movie = json.load(f)[0]
+
+    def test_imported_after_the_disc_index_created_the_database(self):
+        # auto-rip.py creates the disc index on import, before anything is stored
+        DiscIndex(self.db_file)
+        store = MediaStore(self.db_file, legacy_json=str(ROOT / 'test-movie.json'))
+        self.assertEqual(store.get('movie', self.movie['tmdb_id'])['title'], self.movie['title'])
+
+    def test_only_imported_while_nothing_is_stored(self):
+        legacy_json = self.folder / 'movie-info.json'
+        legacy_json.write_text(json.dumps([self.movie]))
+        MediaStore(self.db_file, legacy_json=str(legacy_json))
+        legacy_json.write_text(json.dumps([dict(self.movie, tmdb_id=1, title='Removed later')]))
+        store = MediaStore(self.db_file, legacy_json=str(legacy_json))
+        self.assertIsNone(store.get('movie', 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import progress
+from progress import MakeMKVProgress
+
+class MakeMKVProgressTest(unittest.TestCase):
+    def feed(self, *lines):
+        parser = MakeMKVProgress()
+        job = {}
+        output = io.StringIO()
+        with mock.patch.object(progress.tracker, 'update', lambda job, **metrics: job.update(metrics)), redirect_stdout(output):
+            for line in lines:
+                parser.feed(line, job)
+        return job, output.getvalue()
+
+    def test_messages_with_commas(self):
+        _, output = self.feed(
+            'MSG:5014,0,1,"Saving 1 titles into directory file:///mnt/Movies/Band of Brothers, Disc 1","Saving %1 titles into directory %2","1","file:///mnt/Movies/Band of Brothers, Disc 1"',
+            'MSG:3307,0,2,"File 00001.mpls was added as title #0","File %1 was added as title #%2","00001.mpls","0"'
+        )
+        self.assertEqual(output.splitlines(), [
+            'Saving 1 titles into directory file:///mnt/Movies/Band of Brothers, Disc 1',
+            'File 00001.mpls was added as title #0'
+        ])
+
+    def test_progress_and_operation(self):
+        job, _ = self.feed('PRGT:5018,0,"Saving to MKV file"', 'PRGV:100,16384,65536')
+        self.assertEqual(job, {'operation': 'Saving to MKV file', 'percent': 25.0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import functools
+import subprocess
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BENCH_DIR = Path(__file__).resolve().parent.parent / 'benchmarks'
+sys.path.insert(0, str(BENCH_DIR))
+
+import job_journal
+import segmented_encode
+from segmented_encode import segmented_encode as encode_in_segments, plan_segments
+from encode_cluster import handbrake_command
+from bench_pipeline import write_wrapper
+from fake_media import read_fake_duration
+
+class PlanSegmentsTest(unittest.TestCase):
+    def test_balances_the_longest_segment(self):
+        self.assertEqual(plan_segments([10, 10, 10, 10], 2), [(1, 2), (3, 4)])
+        self.assertEqual(plan_segments([30, 5, 5, 5, 5, 10], 2), [(1, 1), (2, 6)])
+
+    def test_no_more_segments_than_chapters(self):
+        self.assertEqual(plan_segments([10, 10], 4), [(1, 1), (2, 2)])
+
+class SegmentedEncodeTest(unittest.TestCase):
+    """
+    Splits, encodes, joins and checks a title with the fake HandBrake, ffmpeg and ffprobe from the benchmarks.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        wrappers = {
+            name: write_wrapper(self.folder, name, BENCH_DIR / script)
+            for name, script in (('HandBrakeCLI', 'fake_handbrake.py'), ('ffprobe', 'fake_ffprobe.py'), ('ffmpeg', 'fake_ffmpeg.py'))
+        }
+        self.handbrake = wrappers['HandBrakeCLI']
+        disc = self.folder / 'disc.json'
+        disc.write_text(json.dumps({'name': 'Inception', 'titles': [{'duration': 154, 'chapters': 1, 'size_mb': 1}, {'duration': 8880, 'chapters': 8, 'size_mb': 8}]}))
+        # The image is a folder, so the fake HandBrake reads the titles from FAKE_DISC
+        self.image = self.folder / 'Inception.iso'
+        self.image.mkdir()
+        self.output = self.folder / 'Inception.mp4'
+        patches = [
+            mock.patch.dict(os.environ, {'FAKE_DISC': str(disc), 'FAKE_ENCODE_SPEED': '100000'}),
+            mock.patch.object(segmented_encode, 'FFMPEG', wrappers['ffmpeg']),
+            mock.patch.object(job_journal, 'FFPROBE', wrappers['ffprobe']),
+            mock.patch.object(segmented_encode, 'chapter_durations', functools.partial(segmented_encode.chapter_durations, handbrake_cli_path=self.handbrake))
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.encoded = []
+
+    def encode(self, input_file, output_file, title_id=None, chapters=None):
+        self.encoded.append(chapters)
+        subprocess.run(handbrake_command(input_file, output_file, title_id, chapters, handbrake_cli_path=self.handbrake), check=True, capture_output=True)
+
+    def test_split_join_and_verify(self):
+        self.assertTrue(encode_in_segments(self.image, self.output, self.encode, title_id=1, chapter_count=8, segment_count=3))
+        self.assertEqual(sorted(self.encoded), [(1, 2), (3, 5), (6, 8)])
+        self.assertEqual(read_fake_duration(self.output), 8880)
+        # The segments are removed once they have been joined
+        self.assertEqual([path.name for path in self.folder.iterdir() if path.name.startswith('.')], [])
+
+    def test_missing_segment(self):
+        def encode(input_file, output_file, title_id=None, chapters=None):
+            if chapters[0] != 1:
+                self.encode(input_file, output_file, title_id, chapters)
+
+        self.assertFalse(encode_in_segments(self.image, self.output, encode, title_id=1, chapter_count=8, segment_count=2))
+        self.assertFalse(self.output.exists())
+
+    def test_without_ffmpeg_nothing_is_encoded(self):
+        with mock.patch.object(segmented_encode, 'FFMPEG', str(self.folder / 'no-ffmpeg')):
+            self.assertFalse(encode_in_segments(self.image, self.output, self.encode, title_id=1, chapter_count=8, segment_count=2))
+        with mock.patch.object(job_journal, 'FFPROBE', str(self.folder / 'no-ffprobe')):
+            self.assertFalse(encode_in_segments(self.image, self.output, self.encode, title_id=1, chapter_count=8, segment_count=2))
+        self.assertEqual(self.encoded, [])
+
+if __name__ == '__main__':
+    unittest.main()
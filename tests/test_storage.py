@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from collections import namedtuple
+from unittest import mock
+
+import storage
+from storage import IsoRetention, AdmissionController, InsufficientSpace
+from job_queue import JobQueue
+
+DiskUsage = namedtuple('DiskUsage', ('total', 'used', 'free'))
+
+class RetentionTest(unittest.TestCase):
+    """
+    The same disc is queued twice, its image must be kept until both encodes are done.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.iso_dir = self.folder / 'iso'
+        self.iso_dir.mkdir()
+        self.image = self.iso_dir / 'Inception.iso'
+        self.image.write_bytes(b'\0' * 4096)
+        self.queue = JobQueue(self.folder / 'jobs', poll_interval=0.1)
+        # Any image at all is over the limit
+        self.retention = IsoRetention(self.iso_dir, max_bytes=1, db_file=str(self.folder / 'media-info.db'), queue=self.queue)
+
+    def queue_image(self):
+        job_id = self.queue.put({'name': 'Inception', 'iso_filename': str(self.image)})
+        self.retention.touch(self.image)
+        return job_id
+
+    def finish(self, job_id):
+        self.queue.complete(job_id)
+        if self.retention.mark_encoded(self.image):
+            self.retention.evict()
+
+    def test_kept_until_every_job_is_done(self):
+        self.queue_image()
+        first_id, _ = self.queue.claim()
+        # Inserted again while the first encode runs
+        second_id = self.queue_image()
+
+        self.finish(first_id)
+        self.assertTrue(self.image.exists())
+        self.assertEqual([image['evictable'] for image in self.retention.images()], [False])
+
+        self.assertEqual(self.queue.claim()[0], second_id)
+        self.finish(second_id)
+        self.assertFalse(self.image.exists())
+
+    def test_queued_again_after_it_was_marked(self):
+        job_id = self.queue_image()
+        self.queue.claim()
+        self.queue.complete(job_id)
+        self.assertTrue(self.retention.mark_encoded(self.image))
+        # Queued before the evict, e.g. by the backlog scan
+        self.queue.put({'name': 'Inception', 'iso_filename': str(self.image)})
+        self.assertEqual(self.retention.evict(), 0)
+        self.assertTrue(self.image.exists())
+
+    def test_images_without_a_job_are_kept(self):
+        self.assertEqual([image['evictable'] for image in self.retention.images()], [False])
+        self.assertEqual(self.retention.evict(), 0)
+
+class AdmissionTest(unittest.TestCase):
+    """
+    Reserves space on a temporary folder, with the size of its volume patched.
+    """
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.free = 10_000
+        patch = mock.patch.object(storage.shutil, 'disk_usage', lambda path: DiskUsage(100_000, 100_000 - self.free, self.free))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.admission = AdmissionController(min_free=1_000)
+
+    def needs(self, needed, name='movie.mp4'):
+        return [(str(self.folder), needed, [str(self.folder / name)])]
+
+    def test_reservations_are_added_together(self):
+        with self.admission.reserve(self.needs(6_000), 'first'):
+            with self.assertRaises(InsufficientSpace) as raised:
+                with self.admission.reserve(self.needs(6_000, 'other.mp4'), 'second'):
+                    pass
+            # The first job may still finish with less than it reserved
+            self.assertTrue(raised.exception.retryable)
+        with self.admission.reserve(self.needs(6_000, 'other.mp4'), 'second'):
+            pass
+
+    def test_written_outputs_are_not_counted_twice(self):
+        with self.admission.reserve(self.needs(6_000), 'first'):
+            # Half of it is written, which the patched free space already accounts for
+            (self.folder / 'movie.mp4').write_bytes(b'\0' * 3_000)
+            with self.admission.reserve(self.needs(5_000, 'other.mp4'), 'second'):
+                pass
+
+    def test_never_fits(self):
+        with self.assertRaises(InsufficientSpace) as raised:
+            with self.admission.reserve(self.needs(200_000), 'huge'):
+                pass
+        self.assertFalse(raised.exception.retryable)
+        # Nothing holds a reservation and there is nothing to delete, so waiting would not help either
+        with self.assertRaises(InsufficientSpace) as raised:
+            with self.admission.wait(self.needs(20_000), 'large', interval=0.01):
+                pass
+        self.assertFalse(raised.exception.retryable)
+        self.assertEqual(self.admission.reservations, [])
+
+    def test_images_are_deleted_to_make_room(self):
+        iso_dir = self.folder / 'iso'
+        iso_dir.mkdir()
+        image = iso_dir / 'Inception.iso'
+        image.write_bytes(b'\0' * 8_000)
+        self.admission.retention = IsoRetention(iso_dir, max_bytes=100_000, db_file=str(self.folder / 'media-info.db'))
+        self.admission.retention.mark_encoded(image)
+        self.free = 2_000
+
+        def disk_usage(path):
+            free = self.free + (0 if image.exists() else 8_000)
+            return DiskUsage(100_000, 100_000 - free, free)
+
+        with mock.patch.object(storage.shutil, 'disk_usage', disk_usage):
+            with self.admission.reserve(self.needs(6_000), 'movie'):
+                self.assertFalse(image.exists())
+
+if __name__ == '__main__':
+    unittest.main()
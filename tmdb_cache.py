@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from file_cache import evict, mark_used
+from atomic_file import atomic_write
+
+# An on-disk cache for TMDB responses, so every disc of a box set does not download the same show again.
+# Responses are reused for TMDB_CACHE_TTL seconds, after which they are revalidated with the ETag/Last-Modified
+# headers TMDB sent. With TMDB_OFFLINE set, only the cache is used and nothing is sent to TMDB.
+
+# Query parameters that do not change the response, so they are left out of the cache key
+IGNORED_PARAMS = ('api_key',)
+
+class CachedResponse:
+    """
+    The parts of a requests.Response used by the TMDB client, rebuilt from a cache entry.
+    """
+
+    def __init__(self, status_code, text='', headers=None, from_cache=True):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.from_cache = from_cache
+
+    def json(self):
+        return json.loads(self.text)
+
+def cache_key(url):
+    """
+    Builds the cache key for a URL from its path and sorted query, without the API key.
+    """
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query) if key not in IGNORED_PARAMS)
+    return f"{parts.path}?{urlencode(query)}"
+
+class CachedSession:
+    def __init__(self, session, cache_dir=os.getenv('TMDB_CACHE_DIR', 'tmdb-cache'),
+                 ttl=float(os.getenv('TMDB_CACHE_TTL', 7 * 24 * 60 * 60)),
+                 max_bytes=int(os.getenv('TMDB_CACHE_MAX_BYTES', 200 * 1024 * 1024)),
+                 offline=os.getenv('TMDB_OFFLINE', '').lower() in ('1', 'true', 'yes')):
+        """
+        :param session: The requests session used for requests that are not answered from the cache.
+        :param cache_dir: The folder the responses are stored in.
+        :param ttl: How long (in seconds) a response is used without asking TMDB if it has changed.
+        :param max_bytes: The total size of the cache, the least recently used responses are removed past this.
+        :param offline: Only answer from the cache, requests that are not cached get a 504 response.
+        """
+        self.session = session
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, key):
+        return self.cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+    def _load(self, entry_path):
+        try:
+            with open(entry_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, entry_path, entry):
+        with atomic_write(entry_path) as f:
+            json.dump(entry, f)
+        with self.lock:
+            evict(self.cache_dir, self.max_bytes)
+
+    def get(self, url, **kwargs):
+        key = cache_key(url)
+        entry_path = self._entry_path(key)
+        entry = self._load(entry_path)
+
+        if entry is not None:
+            mark_used(entry_path)
+            if self.offline or time.time() - entry['fetched_at'] < self.ttl:
+                return CachedResponse(entry['status_code'], entry['text'], entry['headers'])
+        elif self.offline:
+            print(f"Offline: {key} is not cached.")
+            return CachedResponse(504)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            if entry['headers'].get('ETag'):
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if entry['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+
+        response = self.session.get(url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            entry['fetched_at'] = time.time()
+            self._save(entry_path, entry)
+            return CachedResponse(entry['status_code'], entry['text'], entry['headers'])
+
+        if response.status_code == 200:
+            self._save(entry_path, {
+                'key': key,
+                'fetched_at': time.time(),
+                'status_code': response.status_code,
+                'headers': {name: response.headers[name] for name in ('ETag', 'Last-Modified') if name in response.headers},
+                'text': response.text
+            })
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()